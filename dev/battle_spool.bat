@@ -0,0 +1,3 @@
+@echo off
+pipenv run python manage.py consume_battle_spool
+pause
\ No newline at end of file
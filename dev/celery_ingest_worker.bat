@@ -0,0 +1,4 @@
+@echo off
+rem usage: celery_ingest_worker.bat <shard number>
+pipenv run celery -A website worker -Q ingest.%1 -c 1 -n ingest%1@%%h -l INFO -E
+pause
\ No newline at end of file
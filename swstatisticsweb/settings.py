@@ -219,12 +219,36 @@ LOGGING = {
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = None  # ALL
 DATA_UPLOAD_MAX_NUMBER_FIELDS = None  # ALL
+# upload endpoints accept gzip/deflate/zstd bodies, limit applies to body after decompression
+UPLOAD_MAX_DECOMPRESSED_SIZE = int(
+    os.getenv("UPLOAD_MAX_DECOMPRESSED_SIZE", 100 * 1024 * 1024))
 
 CELERY_BEAT_SCHEDULE = {
     'bot-report-generate': {
         'task': 'website.tasks.generate_bot_reports',
         'schedule': crontab(hour=0, minute=0),
     },
+    'payloads-purge': {
+        'task': 'website.tasks.purge_payloads_task',
+        'schedule': crontab(minute=30),
+    },
+    'profile-ingests-resume': {
+        'task': 'website.tasks.resume_profile_ingests_task',
+        'schedule': crontab(minute='*/15'),
+    },
+    'rollups-rebuild': {
+        'task': 'website.tasks.rebuild_rollups_task',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'snapshot-export': {
+        'task': 'website.tasks.export_snapshot_task',
+        'schedule': crontab(minute='5-59/15'),
+    },
+    'snapshot-export-full': {
+        'task': 'website.tasks.export_snapshot_task',
+        'schedule': crontab(hour=4, minute=0),
+        'kwargs': {'full': True},
+    },
 }
 
 if not DEBUG:
@@ -252,3 +276,77 @@ CACHES = {
         "KEY_PREFIX": "swstats"
     }
 }
+
+# Profile upload: skip rewriting runes, artifacts & monsters which didn't change since last upload
+PROFILE_FINGERPRINTS = os.getenv("PROFILE_FINGERPRINTS") == 'True'
+PROFILE_FINGERPRINTS_TIMEOUT = 60 * 60 * 24 * 30  # 30 days
+
+# Battle results spool: '' (Celery task per upload), 'redis' (stream) or 'file' (local append-only file)
+# saved by `python manage.py consume_battle_spool` in batches of UPLOAD_SPOOL_BATCH_SIZE runs or every UPLOAD_SPOOL_BATCH_MS
+UPLOAD_SPOOL = os.getenv("UPLOAD_SPOOL", '')
+UPLOAD_SPOOL_BATCH_SIZE = 500
+UPLOAD_SPOOL_BATCH_MS = 1000
+UPLOAD_SPOOL_FILE = os.path.join(BASE_DIR, 'logs', 'spool', 'battles.jsonl')
+# spooled battles read by consumer which didn't save them in this time (crashed, restarted) are taken over by another one
+UPLOAD_SPOOL_CLAIM_IDLE_MS = 5 * 60 * 1000
+
+# Profile uploads are passed to Celery tasks by key, payload itself is kept compressed
+# in Redis ('redis') or in PAYLOAD_STORE_DIR ('disk', shared by web & workers) for PAYLOAD_STORE_TTL seconds
+PAYLOAD_STORE = os.getenv("PAYLOAD_STORE", 'redis')
+PAYLOAD_STORE_TTL = 60 * 60 * 6
+PAYLOAD_STORE_DIR = os.path.join(BASE_DIR, 'logs', 'payloads')
+
+# HubUserLogin passed by payload key is streamed (ijson) & saved in batches of PROFILE_STREAMING_BATCH_SIZE
+# runes/artifacts/monsters, instead of loading whole JSON at once
+PROFILE_STREAMING = os.getenv("PROFILE_STREAMING") == 'True'
+PROFILE_STREAMING_BATCH_SIZE = 500
+
+# HubUserLogin uploads of wizard whose previous upload is still queued/running only replace pending payload
+# (newest tvalue wins), counts are shown by `python manage.py upload_stats`
+PROFILE_COALESCING = os.getenv("PROFILE_COALESCING") == 'True'
+PROFILE_COALESCING_TTL = 60 * 60
+
+# wizard-scoped upload tasks are routed by wizard ID to INGEST_SHARDS queues (ingest.0 ... ingest.<n-1>),
+# each consumed by a single worker process (`celery -A website worker -Q ingest.0 -c 1`), 0 = default queue
+INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", 0))
+INGEST_QUEUE_PREFIX = 'ingest.'
+
+# SWEX commands go to their own queues (see website.uploads.UPLOAD_COMMANDS), workers have to consume them:
+# `celery -A website worker -Q celery,uploads.profile,uploads.battles,uploads.siege,uploads.arena`
+UPLOAD_COMMAND_QUEUES = os.getenv("UPLOAD_COMMAND_QUEUES") == 'True'
+
+# battle uploads already seen in last BATTLE_DEDUP_TTL seconds (plugin retransmits) are dropped before any DB work
+BATTLE_DEDUP = os.getenv("BATTLE_DEDUP") == 'True'
+BATTLE_DEDUP_TTL = 60 * 60 * 24
+
+# raid & rift starts are held in Redis (up to BATTLE_PAIRING_TTL seconds) until their result comes,
+# then written as one complete row; starts without result are never saved
+BATTLE_PAIRING = os.getenv("BATTLE_PAIRING") == 'True'
+BATTLE_PAIRING_TTL = 60 * 60
+
+# runes, artifacts & monsters of wizard missing from their HubUserLogin upload (sold, fed, etc.) are deleted during ingest,
+# monsters used in battle/siege records are kept; counts are shown by `python manage.py upload_stats`
+PROFILE_RECONCILE = os.getenv("PROFILE_RECONCILE") == 'True'
+
+# HubUserLogin with at least PROFILE_CHUNKED_MIN_ITEMS runes/artifacts/monsters (or streamed one) is committed in chunks
+# of PROFILE_CHUNK_SIZE items, wizard's last_update is moved last; ingests stuck for PROFILE_CHUNKED_RESUME_AFTER seconds are re-queued
+PROFILE_CHUNKED = os.getenv("PROFILE_CHUNKED") == 'True'
+PROFILE_CHUNKED_MIN_ITEMS = 5000
+PROFILE_CHUNK_SIZE = 1000
+PROFILE_CHUNKED_RESUME_AFTER = 60 * 15
+
+# rune/artifact/monster counts per dashboard dimensions are updated by ingest (deltas) & rebuilt nightly,
+# dashboards read charts from them when filters allow it; run `python manage.py rebuild_rollups` after enabling
+ROLLUPS = os.getenv("ROLLUPS") == 'True'
+
+# monsters dashboard statistics (percentiles, etc.) are read from ROLLUPS stat buckets (within 1%) unless this is set
+MONSTER_STATS_EXACT = os.getenv("MONSTER_STATS_EXACT") == 'True'
+
+# rune & monster analytical columns are exported to SNAPSHOT_DIR as memory-mapped NumPy files (see website.snapshot),
+# rows saved since last export every 15 minutes & everything nightly; profile comparison & dashboards read them instead
+# of scanning tables; run `python manage.py export_snapshot` after enabling
+# snapshot not exported in last SNAPSHOT_MAX_AGE seconds (4 missed exports, e.g. stopped beat or long full export) is ignored
+SNAPSHOT = os.getenv("SNAPSHOT") == 'True'
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'logs', 'snapshot')
+SNAPSHOT_CHUNK_SIZE = 10000
+SNAPSHOT_MAX_AGE = 60 * 15 * 4
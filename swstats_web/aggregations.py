@@ -1,4 +1,16 @@
-from django.db.models import Aggregate, FloatField
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Aggregate, FloatField, F
+
+# filters which can be answered by rollups (website.rollups) instead of scanning whole table
+RUNE_ROLLUP_FILTERS = ['rune_set_id', 'slot', 'stars',
+                       'quality', 'quality_original', 'primary', 'upgrade_curr']
+ARTIFACT_ROLLUP_FILTERS = ['rtype', 'quality',
+                           'quality_original', 'primary', 'level']
+MONSTER_ROLLUP_FILTERS = ['stars', 'base_monster__base_class', 'base_monster__attribute',
+                          'base_monster__archetype', 'base_monster__awaken', 'base_monster__family']
+# lookups added to filter keys by get_*_filters, anything else is part of field path
+FILTER_LOOKUPS = ['in', 'gte', 'lte', 'isnull', 'contains']
 
 
 class Median(Aggregate):
@@ -20,3 +32,60 @@ class Perc75(Aggregate):
     name = 'perc75'
     output_field = FloatField()
     template = '%(function)s(0.75) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+
+def count_grouping_sets(queryset, grouping_sets, weight=None):
+    """Row counts of `queryset` for every grouping set (tuple of field paths) in a single scan, using GROUPING SETS.
+
+    Returns list of results in `grouping_sets` order, every result is a list of dicts shaped like
+    queryset.values(*grouping_set).annotate(count=Count(...)) rows; groups with NULL value count 0, like Count(field).
+    Empty grouping set () gives total count as [{'count': n}].
+    With `weight` field (e.g. count of rollup row) rows are summed up by it instead of counted.
+    """
+    fields = list(dict.fromkeys(
+        field for grouping_set in grouping_sets for field in grouping_set))
+    aliases = {field: 'd' + str(i) for i, field in enumerate(fields)}
+    annotations = {alias: F(field) for field, alias in aliases.items()}
+    if weight:
+        annotations['weight'] = F(weight)
+    query = queryset.order_by().annotate(**annotations).values(*annotations.keys())
+    try:
+        sql, params = query.query.sql_with_params()
+    except EmptyResultSet:  # e.g. filter by empty list, there's nothing to scan
+        return [list() if grouping_set else [{'count': 0}] for grouping_set in grouping_sets]
+
+    def columns(grouping_set):
+        return ', '.join(connection.ops.quote_name(aliases[field]) for field in grouping_set)
+
+    sets = list(dict.fromkeys(tuple(grouping_set)
+                              for grouping_set in grouping_sets))
+    # GROUPING() bit is set for every field which isn't part of row's grouping set, first field is the highest bit
+    masks = {sum(1 << (len(fields) - 1 - i) for i, field in enumerate(fields) if field not in grouping_set): grouping_set
+             for grouping_set in sets}
+    results = {grouping_set: list() for grouping_set in sets}
+    if fields:
+        select = columns(fields) + ', GROUPING(' + columns(fields) + ')'
+    else:
+        select = '0'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {select}, {'SUM(weight)::bigint' if weight else 'COUNT(*)'} FROM ({sql}) AS grouped GROUP BY GROUPING SETS ({', '.join('(' + columns(grouping_set) + ')' for grouping_set in sets)})", params)
+        for row in cursor.fetchall():
+            grouping_set = masks[row[-2]]
+            values = {field: row[fields.index(field)]
+                      for field in grouping_set}
+            values['count'] = 0 if None in values.values() else row[-1] or 0
+            results[grouping_set].append(values)
+
+    return [results[tuple(grouping_set)] for grouping_set in grouping_sets]
+
+
+def can_use_rollup(proper_filters, dimensions):
+    """True if every filter (field__lookup or exact field: value) is on one of rollup `dimensions`."""
+    return all(filter_field(key) in dimensions for key in proper_filters.keys())
+
+
+def filter_field(key):
+    """Field path of filter key, w/o lookup."""
+    field, _, lookup = key.rpartition('__')
+    return field if lookup in FILTER_LOOKUPS else key
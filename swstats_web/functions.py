@@ -8,11 +8,16 @@ from operator import itemgetter
 from datetime import timedelta
 import statistics
 
+from django.conf import settings
 from django.db.models import F, Q, Avg, Min, Max, Sum, Count, FloatField, Func
+from rest_framework.exceptions import ValidationError
 
 from website.models import *
-from website.functions import calc_efficiency
+from website.functions import calc_efficiencies
+from website import snapshot
 from .serializers import RuneFullSerializer, MonsterSerializer, ArtifactSerializer, SiegeSerializer, MonsterBaseSerializer
+from .aggregations import can_use_rollup, RUNE_ROLLUP_FILTERS, ARTIFACT_ROLLUP_FILTERS, MONSTER_ROLLUP_FILTERS
+from .pagination import InvalidCursor, paginate, count_rows
 
 
 def get_scoring_system():
@@ -369,9 +374,28 @@ def calc_rune_comparison_stats(id_, hp_f, hp, atk_f, atk, def_f, def_, spd, res,
     return r_stats
 
 
-def get_profile_comparison_with_database(wizard_id):
+def exclude_ingesting(queryset):
+    """Runes, artifacts or monsters of `queryset` w/o wizards which profile is being ingested in chunks (ProfileIngest).
+
+    Their items are half-saved until the last chunk, so readers don't see them until then.
+    Without PROFILE_CHUNKED there's nothing to leave out, so `queryset` is returned as it is.
+    """
+    if not settings.PROFILE_CHUNKED:
+        return queryset
+    return queryset.exclude(wizard__in=ProfileIngest.objects.values('wizard'))
+
+
+def ingesting_mask(table):
+    """Snapshot rows of wizards which profile is being ingested in chunks, see exclude_ingesting."""
+    if not settings.PROFILE_CHUNKED:
+        return np.zeros(len(table), dtype=bool)
+    return table.mask(wizard_id__in=list(ProfileIngest.objects.values_list('wizard_id', flat=True)))
+
+
+def get_comparison_frames(wizard_id):
     monsters = Monster.objects.select_related('base_monster', 'base_monster__family', ).exclude(base_monster__archetype=5).exclude(base_monster__archetype=0).filter(
         stars=6).defer('runes', 'runes_rta', 'artifacts', 'artifacts_rta').order_by('base_monster__name')  # w/o material, unknown; only 6*
+    monsters = exclude_ingesting(monsters)
     monsters_cols = ['id', 'wizard__id', 'base_monster__name', 'base_monster__id', 'base_monster__family__name', 'base_monster__awaken', 'hp', 'attack', 'defense', 'speed',
                      'res', 'acc', 'crit_rate', 'crit_dmg', 'avg_eff_total', 'eff_hp']
     df_monsters = pd.DataFrame(monsters.values_list(
@@ -379,6 +403,7 @@ def get_profile_comparison_with_database(wizard_id):
 
     runes = Rune.objects.select_related('rune_set', ).filter(upgrade_curr__gte=12).order_by(
         'slot', 'rune_set', '-quality_original')  # only +12-+15
+    runes = exclude_ingesting(runes)
     runes_kw = {
         'sub_hp_flat_sum': Func(F('sub_hp_flat'), function='unnest'),
         'sub_hp_sum': Func(F('sub_hp'), function='unnest'),
@@ -399,6 +424,52 @@ def get_profile_comparison_with_database(wizard_id):
     df_runes = pd.DataFrame(runes.values_list(*runes_cols), columns=[runes_col.replace(
         '_sum', '') for runes_col in runes_cols]).drop_duplicates(subset=['id']).fillna(0)
 
+    return df_monsters, df_runes
+
+
+def get_comparison_frames_from_snapshot(wizard_id, monsters_table, runes_table):
+    """Monsters & runes frames of get_profile_comparison_with_database read from snapshot (website.snapshot).
+
+    Just uploaded profile isn't in snapshot yet, so wizard's own rows are read from DB (encoded the same way).
+    """
+    own = list() if settings.PROFILE_CHUNKED and ProfileIngest.objects.filter(
+        wizard_id=wizard_id).exists() else [wizard_id]  # see exclude_ingesting
+    names = {'wizard_id': 'wizard__id', 'base_monster_id': 'base_monster__id'}
+    monsters_cols = ['id', 'wizard_id', 'base_monster__name', 'base_monster_id', 'base_monster__family__name', 'base_monster__awaken', 'hp', 'attack', 'defense', 'speed',
+                     'res', 'acc', 'crit_rate', 'crit_dmg', 'avg_eff_total', 'eff_hp']
+    mask = monsters_table.mask(stars=6) & ~monsters_table.mask(
+        base_monster__archetype__in=[0, 5]) & ~monsters_table.mask(wizard_id=wizard_id) & ~ingesting_mask(monsters_table)  # w/o material, unknown; only 6*
+    df_wiz = snapshot.read_frame('monsters', wizard_id__in=own, stars=6)
+    df_wiz = df_wiz[~df_wiz['base_monster__archetype'].isin([0, 5])]
+    df_monsters = pd.concat([
+        monsters_table.frame(monsters_cols, mask),
+        df_wiz[monsters_cols],
+    ], ignore_index=True).rename(columns=names)
+
+    runes_cols = ['id', 'wizard_id', 'slot', 'rune_set_id', 'rune_set__name', 'primary', 'efficiency', 'quality', 'quality_original',
+                  'sub_hp', 'sub_hp_flat', 'sub_atk', 'sub_atk_flat', 'sub_def', 'sub_def_flat', 'sub_speed',
+                  'sub_res', 'sub_acc', 'sub_crit_rate', 'sub_crit_dmg']
+    mask = runes_table.mask(upgrade_curr__gte=12) & ~runes_table.mask(
+        wizard_id=wizard_id) & ~ingesting_mask(runes_table)  # only +12-+15
+    df_runes = pd.concat([
+        runes_table.frame(runes_cols, mask),
+        snapshot.read_frame('runes', wizard_id__in=own,
+                            upgrade_curr__gte=12)[runes_cols],
+    ], ignore_index=True).rename(columns={**names, 'rune_set_id': 'rune_set__id'})
+
+    return df_monsters, df_runes
+
+
+def get_profile_comparison_with_database(wizard_id):
+    monsters_table = snapshot.load_table(
+        'monsters') if settings.SNAPSHOT else None
+    runes_table = snapshot.load_table('runes') if settings.SNAPSHOT else None
+    if monsters_table is not None and runes_table is not None:
+        df_monsters, df_runes = get_comparison_frames_from_snapshot(
+            wizard_id, monsters_table, runes_table)
+    else:
+        df_monsters, df_runes = get_comparison_frames(wizard_id)
+
     comparison = {
         "monsters": [],
         "runes": [],
@@ -472,47 +543,34 @@ def filter_runes(filters):
     return proper_filters
 
 
-def get_runes_table(request, filters=None):
-    runes = Rune.objects.all().select_related('rune_set', ).defer(
-        'wizard', 'base_value', 'sell_value').order_by()
+def get_runes_table(request, filters=None, count=None):
+    """`count` of filtered rows can be given if it's already known, e.g. from count_grouping_sets."""
+    runes = exclude_ingesting(Rune.objects.all().select_related('rune_set', ).defer(
+        'wizard', 'base_value', 'sell_value').order_by())
 
     if request:  # ajax call on page change
         filters = list(request.GET.lists())
 
         proper_filters = filter_runes(filters)
         runes = runes.filter(**proper_filters)
+        rollup = RuneRollup.objects.filter(**proper_filters) if settings.ROLLUPS and can_use_rollup(
+            proper_filters, RUNE_ROLLUP_FILTERS) else None
 
-        sort_order = request.GET['sort_order'] if 'sort_order' in request.GET else None
-        if sort_order:
-            if '-' in sort_order:
-                runes = runes.order_by(F(sort_order[1:]).desc(nulls_last=True))
-            else:
-                runes = runes.order_by(F(sort_order).asc(nulls_first=True))
-
-        page = int(request.GET['page']) if 'page' in request.GET else 1
-        count = runes.count()
-        PER_PAGE = 10
-        start = PER_PAGE * (page - 1)
-        end = start + 10
-        serializer = RuneFullSerializer(
-            runes[start:min(end, count)], many=True)
-
-        return {
-            'count': count,
-            'page': page,
-            'data': serializer.data,
-        }
+        return get_table_page(request, runes, RuneFullSerializer, rollup)
 
     # filters here
     if filters:
         proper_filters = filter_runes(filters)
         runes = runes.filter(**proper_filters)
 
-    serializer = RuneFullSerializer(runes[:10], many=True)
+    rows, next_cursor = paginate(runes)
+    serializer = RuneFullSerializer(rows, many=True)
 
     return {
-        'count': runes.count(),
+        'count': runes.count() if count is None else count,
+        'count_exact': True,
         'page': 1,
+        'next_cursor': next_cursor,
         'data': serializer.data,
     }
 
@@ -547,54 +605,18 @@ def filter_monsters(filters):
     return proper_filters
 
 
-def get_monsters_table(request, filters=None):
-    monsters = Monster.objects.exclude(base_monster__archetype__in=[0, 5]).select_related('base_monster', 'base_monster__family', ).prefetch_related(
-        'runes', 'runes_rta', 'artifacts', 'artifacts_rta', 'runes__rune_set', 'runes_rta__rune_set', ).defer('wizard', 'source', 'transmog', ).order_by()
+def get_monsters_table(request, filters=None, count=None):
+    """`count` of filtered rows can be given if it's already known, e.g. from count_grouping_sets."""
+    monsters = exclude_ingesting(Monster.objects.exclude(base_monster__archetype__in=[0, 5]).select_related('base_monster', 'base_monster__family', ).prefetch_related(
+        'runes', 'runes_rta', 'artifacts', 'artifacts_rta', 'runes__rune_set', 'runes_rta__rune_set', ).defer('wizard', 'source', 'transmog', ).order_by())
 
     if request:  # ajax call on page change
         filters = list(request.GET.lists())
 
-        # filters here
-        proper_filters = filter_monsters(filters)
-        # text for multi field, can't be in dict like others
-        try:
-            filter_keys = [f[0] for f in filters]
-            b_m = filter_keys.index('base_monster__name')
-            name_filter = (
-                Q(base_monster__name__icontains=filters[b_m][1][0])
-                | Q(base_monster__family__name__icontains=filters[b_m][1][0])
-            )
-            monsters = monsters.filter(name_filter, **proper_filters)
-        except ValueError:
-            monsters = monsters.filter(**proper_filters)
-
-        sort_order = request.GET['sort_order'].replace(
-            '.', '__') if 'sort_order' in request.GET else None
-        if sort_order:
-            if '-' in sort_order:
-                monsters = monsters.order_by(
-                    F(sort_order[1:]).desc(nulls_last=True))
-            else:
-                monsters = monsters.order_by(
-                    F(sort_order).asc(nulls_first=True))
-
-        page = int(request.GET['page']) if 'page' in request.GET else 1
-        count = monsters.count()
-        PER_PAGE = 10
-        start = PER_PAGE * (page - 1)
-        end = start + 10
-        serializer = MonsterSerializer(
-            monsters[start:min(end, count)], many=True)
-
-        return {
-            'count': count,
-            'page': page,
-            'data': serializer.data,
-        }
-
     # filters here
     proper_filters = filter_monsters(filters)
     # text for multi field, can't be in dict like others
+    name_filter = Q()
     try:
         filter_keys = [f[0] for f in filters]
         b_m = filter_keys.index('base_monster__name')
@@ -602,15 +624,25 @@ def get_monsters_table(request, filters=None):
             Q(base_monster__name__icontains=filters[b_m][1][0])
             | Q(base_monster__family__name__icontains=filters[b_m][1][0])
         )
-        monsters = monsters.filter(name_filter, **proper_filters)
     except ValueError:
-        monsters = monsters.filter(**proper_filters)
+        pass
+    monsters = monsters.filter(name_filter, **proper_filters)
+
+    if request:
+        rollup = MonsterRollup.objects.exclude(base_monster__archetype__in=[0, 5]).filter(name_filter, **proper_filters) if settings.ROLLUPS and can_use_rollup(
+            proper_filters, MONSTER_ROLLUP_FILTERS) else None
+
+        return get_table_page(request, monsters, MonsterSerializer, rollup, sort_order=request.GET['sort_order'].replace(
+            '.', '__') if 'sort_order' in request.GET else None)
 
-    serializer = MonsterSerializer(monsters[:10], many=True)
+    rows, next_cursor = paginate(monsters)
+    serializer = MonsterSerializer(rows, many=True)
 
     return {
-        'count': monsters.count(),
+        'count': monsters.count() if count is None else count,
+        'count_exact': True,
         'page': 1,
+        'next_cursor': next_cursor,
         'data': serializer.data,
     }
 
@@ -632,48 +664,34 @@ def filter_artifacts(filters):
     return proper_filters
 
 
-def get_artifacts_table(request, filters=None):
-    artifacts = Artifact.objects.all().defer('wizard').order_by()
+def get_artifacts_table(request, filters=None, count=None):
+    """`count` of filtered rows can be given if it's already known, e.g. from count_grouping_sets."""
+    artifacts = exclude_ingesting(
+        Artifact.objects.all().defer('wizard').order_by())
 
     if request:  # ajax call on page change
         filters = list(request.GET.lists())
 
         proper_filters = filter_artifacts(filters)
         artifacts = artifacts.filter(**proper_filters)
+        rollup = ArtifactRollup.objects.filter(**proper_filters) if settings.ROLLUPS and can_use_rollup(
+            proper_filters, ARTIFACT_ROLLUP_FILTERS) else None
 
-        sort_order = request.GET['sort_order'] if 'sort_order' in request.GET else None
-        if sort_order:
-            if '-' in sort_order:
-                artifacts = artifacts.order_by(
-                    F(sort_order[1:]).desc(nulls_last=True))
-            else:
-                artifacts = artifacts.order_by(
-                    F(sort_order).asc(nulls_first=True))
-
-        page = int(request.GET['page']) if 'page' in request.GET else 1
-        count = artifacts.count()
-        PER_PAGE = 10
-        start = PER_PAGE * (page - 1)
-        end = start + 10
-        serializer = ArtifactSerializer(
-            artifacts[start:min(end, count)], many=True)
-
-        return {
-            'count': count,
-            'page': page,
-            'data': serializer.data,
-        }
+        return get_table_page(request, artifacts, ArtifactSerializer, rollup)
 
     # filters here
     if filters:
         proper_filters = filter_artifacts(filters)
         artifacts = artifacts.filter(**proper_filters)
 
-    serializer = ArtifactSerializer(artifacts[:10], many=True)
+    rows, next_cursor = paginate(artifacts)
+    serializer = ArtifactSerializer(rows, many=True)
 
     return {
-        'count': artifacts.count(),
+        'count': artifacts.count() if count is None else count,
+        'count_exact': True,
         'page': 1,
+        'next_cursor': next_cursor,
         'data': serializer.data,
     }
 
@@ -691,6 +709,13 @@ def filter_siege(filters):
     return proper_filters
 
 
+def filter_siege_records(sieges, proper_filters):
+    """`sieges` matching filter_siege filters, once each; filter on monsters (M2M) would join every matching monster, so it's a subquery."""
+    if 'monsters__base_monster__in' in proper_filters:
+        return sieges.filter(id__in=SiegeRecord.objects.filter(**proper_filters).values('id'))
+    return sieges.filter(**proper_filters)
+
+
 def get_siege_table(request, filters=None):
     sieges = SiegeRecord.objects.all().select_related('wizard', 'wizard__guild', 'leader', 'leader__base_monster', 'leader__base_monster__family').prefetch_related(
         'monsters',
@@ -715,41 +740,52 @@ def get_siege_table(request, filters=None):
         filters = list(request.GET.lists())
 
         proper_filters = filter_siege(filters)
-        sieges = sieges.filter(**proper_filters)
+        sieges = filter_siege_records(sieges, proper_filters)
 
-        sort_order = request.GET['sort_order'] if 'sort_order' in request.GET else None
-        if sort_order:
-            if '-' in sort_order:
-                sieges = sieges.order_by(
-                    F(sort_order[1:]).desc(nulls_last=True))
-            else:
-                sieges = sieges.order_by(
-                    F(sort_order).asc(nulls_first=True))
-
-        page = int(request.GET['page']) if 'page' in request.GET else 1
-        count = sieges.count()
-        PER_PAGE = 10
-        start = PER_PAGE * (page - 1)
-        end = start + 10
-        serializer = SiegeSerializer(
-            sieges[start:min(end, count)], many=True)
-
-        return {
-            'count': count,
-            'page': page,
-            'data': serializer.data,
-        }
+        return get_table_page(request, sieges, SiegeSerializer)
 
     # filters here
     if filters:
         proper_filters = filter_siege(filters)
-        sieges = sieges.filter(**proper_filters)
+        sieges = filter_siege_records(sieges, proper_filters)
 
-    serializer = SiegeSerializer(sieges[:10], many=True)
+    rows, next_cursor = paginate(sieges)
+    serializer = SiegeSerializer(rows, many=True)
 
     return {
         'count': sieges.count(),
+        'count_exact': True,
         'page': 1,
+        'next_cursor': next_cursor,
+        'data': serializer.data,
+    }
+
+
+def get_table_page(request, queryset, serializer_class, rollup=None, sort_order=None):
+    """Table page for ajax call (GET `sort_order`, `cursor`, `page`, `exact_count`).
+
+    Pages are found by `next_cursor` keyset instead of OFFSET, `page` number is only given back. Total is estimated
+    (from `rollup` if filters allow it) unless `exact_count=true` is asked for. Invalid cursor or page is a 400 error.
+    """
+    sort_order = sort_order or request.GET.get('sort_order')
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise ValidationError({'page': 'Invalid page'})
+    try:
+        rows, next_cursor = paginate(
+            queryset, sort_order, request.GET.get('cursor'))
+    except InvalidCursor as e:
+        raise ValidationError({'cursor': str(e)})
+    count, count_exact = count_rows(
+        queryset, request.GET.get('exact_count') == 'true', rollup)
+    serializer = serializer_class(rows, many=True)
+
+    return {
+        'count': count,
+        'count_exact': count_exact,
+        'page': page,
+        'next_cursor': next_cursor,
         'data': serializer.data,
     }
 
@@ -996,7 +1032,7 @@ def parse_runes(runes_unequipped, runes_equipped, runes_locked):
     runes = [*runes_unequipped, *runes_equipped]
 
     # only current efficiency
-    efficiencies = [calc_efficiency(rune)[0] for rune in runes]
+    efficiencies = calc_efficiencies(runes)[0].tolist()
     eff_min = min(efficiencies)
     eff_max = max(efficiencies)
     eff_mean = round(statistics.mean(efficiencies), 2)
@@ -1136,7 +1172,7 @@ def parse_friends(friend_list):
 
 
 def generate_bot_monster_report(monster_id):
-    monsters = Monster.objects.filter(base_monster_id=monster_id, stars=6, level=40).prefetch_related(
+    monsters = exclude_ingesting(Monster.objects.filter(base_monster_id=monster_id, stars=6, level=40)).prefetch_related(
         'runes', 'runes__rune_set',
         'artifacts',
     ).order_by('id').values(
@@ -0,0 +1,107 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F, Q, Sum
+
+import base64
+import json
+
+PER_PAGE = 10
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_order, value, pk):
+    """Opaque cursor of table row, it's sort column value & ID."""
+    cursor = json.dumps([sort_order, value, pk],
+                        cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort_order):
+    """(sort column value, ID) of cursor made by encode_cursor for the same `sort_order`."""
+    try:
+        cursor_sort_order, value, pk = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):  # bad base64, JSON or shape
+        raise InvalidCursor('Invalid cursor')
+    if cursor_sort_order != sort_order:
+        raise InvalidCursor('Cursor was made for different sort order')
+    return value, pk
+
+
+def get_ordering(sort_order):
+    """(field path or None, descending) of table `sort_order` param, e.g. '-efficiency'."""
+    if not sort_order:
+        return None, False
+    if '-' in sort_order:
+        return sort_order[1:], True
+    return sort_order, False
+
+
+def order_by_keyset(queryset, sort_order):
+    """Queryset ordered by sort column (NULLs first ascending, last descending, like before) and ID as tie-breaker."""
+    field, desc = get_ordering(sort_order)
+    if field is None:
+        return queryset.order_by('-pk' if desc else 'pk')
+    queryset = queryset.annotate(cursor_value=F(field))
+    if desc:
+        return queryset.order_by(F('cursor_value').desc(nulls_last=True), '-pk')
+    return queryset.order_by(F('cursor_value').asc(nulls_first=True), 'pk')
+
+
+def after_cursor(queryset, sort_order, value, pk):
+    """Rows of queryset ordered by order_by_keyset which come after row with given sort column value & ID."""
+    field, desc = get_ordering(sort_order)
+    if field is None:
+        return queryset.filter(pk__lt=pk) if desc else queryset.filter(pk__gt=pk)
+    if desc:  # values descending, then NULLs
+        if value is None:
+            return queryset.filter(cursor_value__isnull=True, pk__lt=pk)
+        return queryset.filter(Q(cursor_value__lt=value) | Q(cursor_value=value, pk__lt=pk) | Q(cursor_value__isnull=True))
+    # NULLs, then values ascending
+    if value is None:
+        return queryset.filter(Q(cursor_value__isnull=True, pk__gt=pk) | Q(cursor_value__isnull=False))
+    return queryset.filter(Q(cursor_value__gt=value) | Q(cursor_value=value, pk__gt=pk))
+
+
+def paginate(queryset, sort_order=None, cursor=None):
+    """(rows of page, cursor of next page or None).
+
+    Pages are found by keyset: first one without `cursor`, next ones after `cursor` (next_cursor of previous page),
+    so every page costs the same. Raises InvalidCursor if `cursor` isn't one of `sort_order`.
+    """
+    queryset = order_by_keyset(queryset, sort_order)
+    if cursor:
+        queryset = after_cursor(
+            queryset, sort_order, *decode_cursor(cursor, sort_order))
+    rows = list(queryset[:PER_PAGE + 1])
+    if len(rows) <= PER_PAGE:
+        return rows, None
+    rows = rows[:PER_PAGE]
+    last = rows[-1]
+    return rows, encode_cursor(sort_order, getattr(last, 'cursor_value', None), last.pk)
+
+
+def estimate_count(queryset):
+    """Planner's estimate of number of rows of queryset, without running it."""
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset, exact=False, rollup=None):
+    """(number of rows, is it exact): exact count only if requested, otherwise summed up `rollup` rows or planner's estimate.
+
+    Estimates also count items of profiles being ingested in chunks, which `queryset` leaves out (see website.rollups).
+    """
+    if exact:
+        return queryset.count(), True
+    if rollup is not None:
+        return rollup.aggregate(count=Sum('count'))['count'] or 0, False
+    return estimate_count(queryset), False
@@ -1,11 +1,14 @@
-from django.db.models import Count, Q, F, Avg, StdDev, Min, Max
+from django.conf import settings
+from django.db.models import Count, Q, F, Avg, StdDev, Min, Max, Sum
 
 from website.celery import app as celery_app
 from website.tasks import handle_profile_upload_task
-from website.models import Rune, RuneSet, Monster, MonsterBase, Artifact, SiegeRecord, Guild, DungeonRun, DimensionHoleRun, RaidDungeonRun, RiftDungeonRun, MonsterHoh, MonsterFusion
+from website.payloads import resolve_payload, get_payload_value
+from website import sketches, snapshot
+from website.models import Rune, RuneSet, Monster, MonsterBase, Artifact, SiegeRecord, Guild, DungeonRun, DimensionHoleRun, RaidDungeonRun, RiftDungeonRun, MonsterHoh, MonsterFusion, RuneRollup, ArtifactRollup, MonsterRollup, MonsterStatBucket
 from .functions import *
 from .serializers import MonsterImageSerializer, MonsterBaseSerializer
-from .aggregations import Perc25, Median, Perc75
+from .aggregations import Perc25, Median, Perc75, count_grouping_sets, can_use_rollup, RUNE_ROLLUP_FILTERS, ARTIFACT_ROLLUP_FILTERS, MONSTER_ROLLUP_FILTERS
 
 import itertools
 import operator
@@ -17,14 +20,19 @@ import numpy as np
 
 @celery_app.task(name="profile.compare", bind=True)
 def handle_profile_upload_and_rank_task(self, data):
+    if isinstance(data, str) and settings.PROFILE_STREAMING:
+        wizard_id = get_payload_value(data, 'wizard_info.wizard_id')
+    else:
+        data = resolve_payload(data)
+        wizard_id = data['wizard_info']['wizard_id']
     self.update_state(state='PROGRESS', meta={'step': 'Creating profile'})
     handle_profile_upload_task.s(data).apply()
     self.update_state(state='PROGRESS', meta={
                       'step': 'Comparing profile to database'})
 
     content = {
-        'points': get_scoring_for_profile(data['wizard_info']['wizard_id']),
-        'comparison': get_profile_comparison_with_database(data['wizard_info']['wizard_id'])
+        'points': get_scoring_for_profile(wizard_id),
+        'comparison': get_profile_comparison_with_database(wizard_id)
     }
 
     return content
@@ -32,8 +40,8 @@ def handle_profile_upload_and_rank_task(self, data):
 
 @celery_app.task(name='fetch.runes', bind=True)
 def fetch_runes_data(self, filters):
-    runes = Rune.objects.all().select_related('rune_set', ).defer(
-        'wizard', 'base_value', 'sell_value').order_by()
+    runes = exclude_ingesting(Rune.objects.all().select_related('rune_set', ).defer(
+        'wizard', 'base_value', 'sell_value').order_by())
 
     # filters here
     proper_filters = filter_runes(filters)
@@ -43,7 +51,20 @@ def fetch_runes_data(self, filters):
     form_filters = Rune.get_filter_fields()
     #
 
-    stars = runes.values('stars').annotate(count=Count('stars'))
+    # all charts & table count in one scan, of rollup or snapshot if filters allow it
+    # (rollup counts are approximate, they include profiles being ingested in chunks, see website.rollups)
+    grouping_sets = [('stars', ), ('quality', ), ('quality_original', ), ('primary', ),
+                     ('rune_set__name', ), ('slot', ), ('upgrade_curr', ), (), ]
+    table = snapshot.load_table('runes') if settings.SNAPSHOT else None
+    if settings.ROLLUPS and can_use_rollup(proper_filters, RUNE_ROLLUP_FILTERS):
+        counts = count_grouping_sets(RuneRollup.objects.filter(
+            **proper_filters), grouping_sets, 'count')
+    elif table is not None and table.covers(proper_filters):
+        counts = table.count_grouping_sets(
+            grouping_sets, table.mask(**proper_filters) & ~ingesting_mask(table))
+    else:
+        counts = count_grouping_sets(runes, grouping_sets)
+    stars, qualities, qualities_orig, primary, rune_sets, rune_slots, rune_levels, total = counts
     rune_stars = {}
     for star in stars:
         s_c = star['stars'] % 10  # Ancient runes
@@ -54,9 +75,6 @@ def fetch_runes_data(self, filters):
             }
         rune_stars[s_c]['count'] += star['count']
 
-    qualities = runes.values('quality').annotate(count=Count('quality'))
-    qualities_orig = runes.values('quality_original').annotate(
-        count=Count('quality_original'))
     rune_qualities = {}
     for q in qualities:
         q_n = Rune.get_rune_quality(q['quality']).replace('Ancient ', '')
@@ -78,7 +96,6 @@ def fetch_runes_data(self, filters):
             }
         rune_qualities[q_n]['original'] += q['count']
 
-    primary = runes.values('primary').annotate(count=Count('primary'))
     rune_primaries = {}
     for p in primary:
         p_n = Rune.get_rune_primary(p['primary'])
@@ -92,21 +109,21 @@ def fetch_runes_data(self, filters):
             'rune_set': [{
                 'name': rune_set['rune_set__name'],
                 'count': rune_set['count'],
-            } for rune_set in runes.values('rune_set__name').annotate(count=Count('rune_set__name'))],
+            } for rune_set in rune_sets],
             'rune_slot': [{
                 'name': rune_slot['slot'],
                 'count': rune_slot['count'],
-            } for rune_slot in runes.values('slot').annotate(count=Count('slot'))],
+            } for rune_slot in rune_slots],
             'rune_level': [{
                 'name': rune_level['upgrade_curr'],
                 'count': rune_level['count'],
-            } for rune_level in runes.values('upgrade_curr').annotate(count=Count('upgrade_curr'))],
+            } for rune_level in rune_levels],
             'rune_stars': list(rune_stars.values()),
             'rune_qualities': list(rune_qualities.values()),
             'rune_primaries': list(rune_primaries.values()),
         },
         'filters': form_filters,
-        'table': get_runes_table(None, filters)
+        'table': get_runes_table(None, filters, total[0]['count'])
     }
 
     return content
@@ -114,30 +131,52 @@ def fetch_runes_data(self, filters):
 
 @celery_app.task(name='fetch.monsters', bind=True)
 def fetch_monsters_data(self, filters):
-    monsters = Monster.objects.exclude(base_monster__archetype__in=[0, 5]).select_related('base_monster', 'base_monster__family', ).defer(
-        'wizard', 'source', 'transmog', 'runes', 'runes_rta', 'artifacts', 'artifacts_rta', ).order_by()
+    monsters = exclude_ingesting(Monster.objects.exclude(base_monster__archetype__in=[0, 5]).select_related('base_monster', 'base_monster__family', ).defer(
+        'wizard', 'source', 'transmog', 'runes', 'runes_rta', 'artifacts', 'artifacts_rta', ).order_by())
 
     # filters here
     proper_filters = filter_monsters(filters)
     # text for multi field, can't be in dict like others
+    name, name_filter = None, Q()
     try:
         filter_keys = [f[0] for f in filters]
         b_m = filter_keys.index('base_monster__name')
+        name = filters[b_m][1][0]
         name_filter = (
-            Q(base_monster__name__icontains=filters[b_m][1][0])
-            | Q(base_monster__family__name__icontains=filters[b_m][1][0])
+            Q(base_monster__name__icontains=name)
+            | Q(base_monster__family__name__icontains=name)
         )
-        monsters = monsters.filter(name_filter, **proper_filters)
     except ValueError:
-        monsters = monsters.filter(**proper_filters)
+        pass
+    monsters = monsters.filter(name_filter, **proper_filters)
+
+    # in-process filtering of snapshot (website.snapshot), if it has all filtered columns
+    table = snapshot.load_table('monsters') if settings.SNAPSHOT else None
+    if table is not None and table.covers(proper_filters):
+        mask = table.mask(**proper_filters) & ~table.mask(
+            base_monster__archetype__in=[0, 5]) & ~ingesting_mask(table)
+        if name is not None:
+            mask &= table.mask(base_monster__name__icontains=name) | table.mask(
+                base_monster__family__name__icontains=name)
+    else:
+        table = None
 
     # prepare filters to show in Form
     form_filters = Monster.get_filter_fields()
     #
 
-    stars = monsters.values('stars').annotate(count=Count('stars'))
-    base_stars = monsters.values('base_monster__base_class').annotate(
-        count=Count('base_monster__base_class'))
+    # all charts & table count in one scan, of rollup if filters allow it (name filter is on base monster as well)
+    # (rollup counts are approximate, they include profiles being ingested in chunks, see website.rollups)
+    grouping_sets = [('stars', ), ('base_monster__base_class', ), ('base_monster__attribute', ),
+                     ('base_monster__archetype', ), ('base_monster__awaken', ), (), ]
+    if settings.ROLLUPS and can_use_rollup(proper_filters, MONSTER_ROLLUP_FILTERS):
+        counts = count_grouping_sets(MonsterRollup.objects.exclude(
+            base_monster__archetype__in=[0, 5]).filter(name_filter, **proper_filters), grouping_sets, 'count')
+    elif table is not None:
+        counts = table.count_grouping_sets(grouping_sets, mask)
+    else:
+        counts = count_grouping_sets(monsters, grouping_sets)
+    stars, base_stars, elements, archetypes, awakens, total = counts
     monster_stars = {}
 
     for s in stars:
@@ -160,8 +199,6 @@ def fetch_monsters_data(self, filters):
             }
         monster_stars[s_n]["natural"] = s["count"]
 
-    elements = monsters.values('base_monster__attribute').annotate(
-        count=Count('base_monster__attribute'))
     monster_elements = {}
     for e in elements:
         e_n = MonsterBase.get_attribute_name(e['base_monster__attribute'])
@@ -170,8 +207,6 @@ def fetch_monsters_data(self, filters):
             "count": e['count']
         }
 
-    archetypes = monsters.values('base_monster__archetype').annotate(
-        count=Count('base_monster__archetype'))
     monster_archetypes = {}
     for e in archetypes:
         e_n = MonsterBase.get_archetype_name(e['base_monster__archetype'])
@@ -180,8 +215,6 @@ def fetch_monsters_data(self, filters):
             "count": e['count']
         }
 
-    awakens = monsters.values('base_monster__awaken').annotate(
-        count=Count('base_monster__awaken'))
     monster_awakens = {}
     for e in awakens:
         e_n = MonsterBase.get_awaken_name(e['base_monster__awaken'])
@@ -215,8 +248,23 @@ def fetch_monsters_data(self, filters):
             Max(stat)
         ]
 
+    # merged stat buckets of base monsters (within sketches.RELATIVE_ACCURACY) instead of sorting whole table,
+    # they include profiles being ingested in chunks as well
+    if settings.ROLLUPS and not settings.MONSTER_STATS_EXACT and can_use_rollup(proper_filters, MONSTER_ROLLUP_FILTERS):
+        buckets = MonsterStatBucket.objects.exclude(base_monster__archetype__in=[0, 5]).filter(name_filter, **proper_filters).values_list(
+            'stat', 'bucket').annotate(n=Sum('count'), s=Sum('total'), sq=Sum('total_sq')).order_by()
+        summary = sketches.summarize(buckets)
+        aggregated = {stat + '__' + f: summary[stat][f] if stat in summary else None
+                      for stat in stats.keys() for f in sketches.SUMMARY}
+    elif table is not None:
+        summary = table.describe(stats.keys(), mask)
+        aggregated = {stat + '__' + f: summary[stat][f] if stat in summary else None
+                      for stat in stats.keys() for f in sketches.SUMMARY}
+    else:
+        aggregated = monsters.aggregate(*agg)
+
     desc = {}
-    for key, val in monsters.aggregate(*agg).items():
+    for key, val in aggregated.items():
         stat, f = key.split('__')
         if f == 'perc25':
             f = '25%'
@@ -239,7 +287,7 @@ def fetch_monsters_data(self, filters):
         },
         'desc': desc,
         'filters': form_filters,
-        'table': get_monsters_table(None, filters)
+        'table': get_monsters_table(None, filters, total[0]['count'])
     }
 
     return content
@@ -247,7 +295,8 @@ def fetch_monsters_data(self, filters):
 
 @celery_app.task(name='fetch.artifacts', bind=True)
 def fetch_artifacts_data(self, filters):
-    artifacts = Artifact.objects.all().defer('wizard').order_by()
+    artifacts = exclude_ingesting(
+        Artifact.objects.all().defer('wizard').order_by())
 
     # filters here
     proper_filters = filter_artifacts(filters)
@@ -257,9 +306,15 @@ def fetch_artifacts_data(self, filters):
     form_filters = Artifact.get_filter_fields()
     #
 
-    qualities = artifacts.values('quality').annotate(count=Count('quality'))
-    qualities_orig = artifacts.values('quality_original').annotate(
-        count=Count('quality_original'))
+    # all charts & table count in one scan, of rollup if filters allow it
+    # (rollup counts are approximate, they include profiles being ingested in chunks, see website.rollups)
+    if settings.ROLLUPS and can_use_rollup(proper_filters, ARTIFACT_ROLLUP_FILTERS):
+        source, weight = ArtifactRollup.objects.filter(
+            **proper_filters), 'count'
+    else:
+        source, weight = artifacts, None
+    qualities, qualities_orig, primary, rtype, slot_attr, slot_el, total = count_grouping_sets(source, [
+        ('quality', ), ('quality_original', ), ('primary', ), ('rtype', ), ('rtype', 'attribute'), ('rtype', 'archetype'), (), ], weight)
     artifact_qualities = {}
     for q in qualities:
         q_n = Artifact.get_artifact_quality(q['quality'])
@@ -280,7 +335,6 @@ def fetch_artifacts_data(self, filters):
             }
         artifact_qualities[q_n]['original'] += q['count']
 
-    primary = artifacts.values('primary').annotate(count=Count('primary'))
     artifact_primaries = []
     for p in primary:
         p_n = Artifact.get_artifact_primary(p['primary'])
@@ -289,7 +343,6 @@ def fetch_artifacts_data(self, filters):
             'count': p['count'],
         })
 
-    rtype = artifacts.values('rtype').annotate(count=Count('rtype'))
     artifact_rtypes = []
     for r in rtype:
         r_n = Artifact.get_artifact_rtype(r['rtype'])
@@ -298,18 +351,18 @@ def fetch_artifacts_data(self, filters):
             'count': r['count'],
         })
 
-    slot_attr = artifacts.filter(attribute__isnull=False, attribute__gt=0).values(
-        'rtype', 'attribute').annotate(count=Count('attribute'))
-    slot_el = artifacts.filter(archetype__isnull=False, archetype__gt=0).values(
-        'rtype', 'archetype').annotate(count=Count('archetype'))
     artifact_slots = []
     for s in slot_attr:
+        if s['attribute'] is None or s['attribute'] <= 0:
+            continue
         s_n = Artifact.get_artifact_slot(s['rtype'], s['attribute'])
         artifact_slots.append({
             "name": s_n,
             "count": s["count"],
         })
     for s in slot_el:
+        if s['archetype'] is None or s['archetype'] <= 0:
+            continue
         s_n = Artifact.get_artifact_slot(s['rtype'], s['archetype'])
         artifact_slots.append({
             "name": s_n,
@@ -324,7 +377,7 @@ def fetch_artifacts_data(self, filters):
             'artifact_primaries': artifact_primaries,
         },
         'filters': form_filters,
-        'table': get_artifacts_table(None, filters)
+        'table': get_artifacts_table(None, filters, total[0]['count'])
     }
 
     return content
@@ -353,7 +406,7 @@ def fetch_siege_data(self, filters):
 
     # filters here
     proper_filters = filter_siege(filters)
-    sieges = sieges.filter(**proper_filters)
+    sieges = filter_siege_records(sieges, proper_filters)
 
     # prepare filters to show in Form
     form_filters = SiegeRecord.get_filter_fields()
@@ -853,7 +906,7 @@ def fetch_rift_detail_data(self, filters, dungeon):
 
 @celery_app.task(name='generate.monster-report', bind=True)
 def generate_monster_report(self, monster_id):
-    monsters = Monster.objects.filter(base_monster_id=monster_id, stars=6, level=40).prefetch_related(
+    monsters = exclude_ingesting(Monster.objects.filter(base_monster_id=monster_id, stars=6, level=40)).prefetch_related(
         'runes', 'runes__rune_set',
         'artifacts',
     ).order_by('id').values(
@@ -1088,6 +1141,7 @@ def generate_monster_report(self, monster_id):
 
 @celery_app.task(name='generate.profile-report', bind=True)
 def generate_profile_report(self, data):
+    data = resolve_payload(data)
     runes_equipped = [rune for monster in data['unit_list']
                       for rune in monster['runes']]
     data_keys = data.keys()
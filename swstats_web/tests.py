@@ -0,0 +1,158 @@
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from website.models import RuneRollup
+from .aggregations import count_grouping_sets, can_use_rollup, MONSTER_ROLLUP_FILTERS, RUNE_ROLLUP_FILTERS
+from .functions import get_table_page
+from .pagination import InvalidCursor, PER_PAGE, encode_cursor, paginate
+
+
+class RuneRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RuneRollup
+        fields = ['id', 'quality', 'count']
+
+
+# (rune_set, slot, stars, quality, count)
+RUNE_ROLLUP = [
+    (1, 1, 6, 5, 3),
+    (1, 2, 6, 4, 1),
+    (3, 2, 5, 4, 2),
+    (3, 2, 15, 4, 7),
+    (3, 4, 6, 5, 4),
+]
+
+
+class CountGroupingSetsTestCase(TestCase):
+    """count_grouping_sets gives the same groups as separate values().annotate(Count) queries."""
+    fixtures = ['base_data.json']
+    grouping_sets = [('slot', ), ('rune_set__name', ), ('stars', 'quality'), ()]
+
+    def setUp(self):
+        RuneRollup.objects.bulk_create([
+            RuneRollup(rune_set_id=rune_set, slot=slot, stars=stars, quality=quality,
+                       quality_original=quality, primary=2, upgrade_curr=15, count=count)
+            for rune_set, slot, stars, quality, count in RUNE_ROLLUP
+        ])
+
+    def expected(self, queryset, aggregate):
+        results = list()
+        for grouping_set in self.grouping_sets:
+            if grouping_set:
+                results.append([dict(row) for row in queryset.order_by().values(
+                    *grouping_set).annotate(total=aggregate).values(*grouping_set, 'total')])
+            else:
+                results.append([queryset.aggregate(total=aggregate)])
+            for row in results[-1]:
+                row['count'] = row.pop('total')
+        return results
+
+    def assertGroups(self, counts, expected):
+        self.assertEqual(len(counts), len(expected))
+        for result, expected_result in zip(counts, expected):
+            self.assertCountEqual(result, expected_result)
+
+    def test_count(self):
+        rollup = RuneRollup.objects.all()
+        counts = count_grouping_sets(rollup, self.grouping_sets)
+        self.assertGroups(counts, self.expected(rollup, Count('id')))
+        self.assertEqual(counts[-1], [{'count': len(RUNE_ROLLUP)}])
+
+    def test_weight(self):
+        rollup = RuneRollup.objects.filter(slot=2)
+        counts = count_grouping_sets(rollup, self.grouping_sets, 'count')
+        self.assertGroups(counts, self.expected(rollup, Sum('count')))
+        self.assertCountEqual(counts[0], [{'slot': 2, 'count': 10}])
+
+    def test_repeated_sets(self):
+        # same grouping set asked twice is grouped once, but returned in both places
+        counts = count_grouping_sets(RuneRollup.objects.all(), [('slot', ), ('stars', ), ('slot', )])
+        self.assertEqual(counts[0], counts[2])
+        self.assertCountEqual(counts[1], [{'stars': 5, 'count': 1}, {'stars': 6, 'count': 3}, {'stars': 15, 'count': 1}])
+
+    def test_empty(self):
+        counts = count_grouping_sets(RuneRollup.objects.none(), self.grouping_sets)
+        self.assertEqual(counts, [list(), list(), list(), [{'count': 0}]])
+        self.assertEqual(count_grouping_sets(RuneRollup.objects.filter(slot=3), self.grouping_sets), counts)
+
+
+class CanUseRollupTestCase(SimpleTestCase):
+    """Filters are answered by rollup only if all of them are on its dimensions, with or without lookup."""
+
+    def test_lookups(self):
+        self.assertTrue(can_use_rollup(dict(), RUNE_ROLLUP_FILTERS))
+        self.assertTrue(can_use_rollup({'slot__in': [1, 2], 'stars__gte': 5, 'stars__lte': 6}, RUNE_ROLLUP_FILTERS))
+        self.assertFalse(can_use_rollup({'slot__in': [1], 'efficiency__gte': 80}, RUNE_ROLLUP_FILTERS))
+        self.assertFalse(can_use_rollup({'sub_speed__isnull': False}, RUNE_ROLLUP_FILTERS))
+
+    def test_exact(self):
+        # exact filters have no lookup, their last part is field name
+        self.assertTrue(can_use_rollup({'base_monster__attribute': 1}, MONSTER_ROLLUP_FILTERS))
+        self.assertTrue(can_use_rollup({'base_monster__family__in': [1], 'base_monster__awaken': True}, MONSTER_ROLLUP_FILTERS))
+        self.assertFalse(can_use_rollup({'base_monster': 10101}, MONSTER_ROLLUP_FILTERS))
+        self.assertFalse(can_use_rollup({'locked': True}, RUNE_ROLLUP_FILTERS))
+
+
+class PaginationTestCase(TestCase):
+    """Table pages are found by keyset cursors, every page comes after the previous one in sort order."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        # 25 rows, sorted values repeat, so ID has to break ties across pages
+        RuneRollup.objects.bulk_create([
+            RuneRollup(rune_set_id=1, slot=slot, stars=6, quality=slot % 3, quality_original=0,
+                       primary=2, upgrade_curr=15, count=(slot * 7) % 5)
+            for slot in range(25)
+        ])
+
+    def pages(self, queryset, sort_order):
+        rows, cursor = paginate(queryset, sort_order)
+        self.assertIsNotNone(cursor)
+        pages = [rows]
+        while cursor:
+            with CaptureQueriesContext(connection) as queries:
+                rows, cursor = paginate(queryset, sort_order, cursor)
+            self.assertNotIn('OFFSET', queries[0]['sql'])
+            pages.append(rows)
+        return pages
+
+    def test_keyset(self):
+        rollup = RuneRollup.objects.all()
+        ordered = sorted(rollup, key=lambda row: row.pk)
+        for sort_order, expected in [
+            (None, ordered),
+            ('-id', ordered[::-1]),
+            ('quality', sorted(ordered, key=lambda row: row.quality)),
+            ('-count', sorted(ordered[::-1], key=lambda row: row.count, reverse=True)),
+        ]:
+            pages = self.pages(rollup, sort_order)
+            self.assertEqual([len(page) for page in pages], [PER_PAGE, PER_PAGE, 5])
+            self.assertEqual([row.pk for page in pages for row in page], [row.pk for row in expected])
+
+    def test_invalid_cursor(self):
+        rollup = RuneRollup.objects.all()
+        _, cursor = paginate(rollup, 'quality')
+        with self.assertRaises(InvalidCursor):
+            paginate(rollup, '-quality', cursor)
+        with self.assertRaises(InvalidCursor):
+            paginate(rollup, 'quality', 'not a cursor')
+        self.assertEqual(paginate(rollup, 'quality', encode_cursor('quality', 2, 0))[1], None)
+
+    def test_table_page(self):
+        factory = RequestFactory()
+        rollup = RuneRollup.objects.all()
+        first = get_table_page(factory.get('/', {'sort_order': 'quality', 'exact_count': 'true'}), rollup, RuneRollupSerializer)
+        self.assertEqual((first['count'], first['count_exact'], first['page']), (25, True, 1))
+        second = get_table_page(factory.get('/', {'sort_order': 'quality', 'cursor': first['next_cursor'], 'page': 2}),
+                                rollup, RuneRollupSerializer)
+        self.assertEqual(second['page'], 2)
+        self.assertEqual(len(set(row['id'] for row in first['data'] + second['data'])), 2 * PER_PAGE)
+
+        for params in [{'cursor': 'not a cursor'}, {'cursor': first['next_cursor']}, {'page': 'x'}]:
+            with self.assertRaises(ValidationError) as error:
+                get_table_page(factory.get('/', params), rollup, RuneRollupSerializer)
+            self.assertEqual(error.exception.status_code, 400)
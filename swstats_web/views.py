@@ -6,12 +6,14 @@ from rest_framework.response import Response
 
 from celery.result import AsyncResult
 from website.celery import app as celery_app
+from website.payloads import store_payload
+from website.parsers import CompressedJSONParser, read_body
 
 from swstats_web.permissions import IsSwstatsWeb
 
 from website.models import Monster, Rune, Artifact, DungeonRun, DimensionHoleRun, RiftDungeonRun, RaidDungeonRun
 from .tasks import *
-from .functions import get_scoring_system, get_runes_table, get_monsters_table, get_artifacts_table, get_siege_table, calculate_cache_key
+from .functions import get_scoring_system, get_runes_table, get_monsters_table, get_artifacts_table, get_siege_table, calculate_cache_key, exclude_ingesting
 from .serializers import MonsterSerializer, RuneSerializer, ArtifactSerializer
 
 import json
@@ -99,7 +101,7 @@ class HomepageView(APIView):
                 "precision": 2,
                 "w": 3,
                 "title": "Most Efficient Rune",
-                "desc": Rune.objects.order_by('-efficiency').first().efficiency,
+                "desc": exclude_ingesting(Rune.objects.order_by('-efficiency')).first().efficiency,
             },
             {
                 "id": 9,
@@ -108,7 +110,7 @@ class HomepageView(APIView):
                 "precision": 0,
                 "w": 3,
                 "title": "Highest Crit Damage",
-                "desc": Monster.objects.order_by('-crit_dmg').first().crit_dmg,
+                "desc": exclude_ingesting(Monster.objects.order_by('-crit_dmg')).first().crit_dmg,
             },
             {
                 "id": 10,
@@ -117,7 +119,7 @@ class HomepageView(APIView):
                 "precision": 0,
                 "w": 2,
                 "title": "Highest Speed",
-                "desc": Monster.objects.order_by('-speed').first().speed,
+                "desc": exclude_ingesting(Monster.objects.order_by('-speed')).first().speed,
             },
             {
                 "id": 11,
@@ -182,11 +184,14 @@ class UploadView(APIView):
     swagger_schema = None
 
     def post(self, request, format=None):
-        data = json.loads(request.body)
+        body = read_body(request.stream, request.META.get(
+            'HTTP_CONTENT_ENCODING'))
+        data = json.loads(body)
         if data['command'] != 'HubUserLogin':
             return Response({'error': 'Invalid JSON File'}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = handle_profile_upload_and_rank_task.delay(data)
+        task = handle_profile_upload_and_rank_task.delay(
+            store_payload(raw=body))
 
         return Response({'status': task.state, 'task_id': task.id})
 
@@ -707,11 +712,12 @@ class StatusView(APIView):
 class ProfileView(APIView):
     permission_classes = [IsSwstatsWeb, ]
     swagger_schema = None
+    parser_classes = [CompressedJSONParser, ]
 
     def post(self, request, format=None):
         if 'command' not in request.data.keys() or request.data['command'] != 'HubUserLogin':
             return Response({'error': "Given File is an invalid Summoners War JSON File."}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = generate_profile_report.delay(request.data)
+        task = generate_profile_report.delay(store_payload(request.data))
 
         return Response({'status': task.state, 'task_id': task.id})
@@ -4,4 +4,6 @@ from __future__ import absolute_import, unicode_literals
 # Django starts so that shared_task will use this app.
 from .celery import app as celery_app
 
-__all__ = ('celery_app',)
\ No newline at end of file
+__all__ = ('celery_app',)
+
+default_app_config = 'website.apps.WebsiteConfig'
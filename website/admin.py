@@ -14,10 +14,15 @@ class GuildAdmin(admin.ModelAdmin):
 class WizardAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'mana', 'crystals', 'crystals_paid', 'last_login', 'country', 'lang', 'level', 'energy', 'energy_max', 'arena_wing', 'glory_point', 'guild_point',
-        'rta_point', 'rta_mark', 'event_coin', 'antibot_count', 'raid_level', 'storage_capacity', 'guild', 'last_update'
+        'rta_point', 'rta_mark', 'event_coin', 'antibot_count', 'raid_level', 'storage_capacity', 'guild', 'last_update', 'profile_tvalue'
     )
 
 
+class ProfileIngestAdmin(admin.ModelAdmin):
+    list_display = ('wizard', 'payload', 'tvalue',
+                    'batch_size', 'chunks', 'updated')
+
+
 class RuneSetAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'amount')
 
@@ -139,6 +144,7 @@ admin.site.register(Command, CommandAdmin)
 
 admin.site.register(Guild, GuildAdmin)
 admin.site.register(Wizard, WizardAdmin)
+admin.site.register(ProfileIngest, ProfileIngestAdmin)
 admin.site.register(RuneSet, RuneSetAdmin)
 admin.site.register(Rune, RuneAdmin)
 admin.site.register(MonsterFamily, MonsterFamilyAdmin)
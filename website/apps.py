@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class WebsiteConfig(AppConfig):
     name = 'website'
+
+    def ready(self):
+        # receivers of website.signals sent by ingest (bulk_upsert, reconcile)
+        from . import rollups, sketches, snapshot  # noqa: F401
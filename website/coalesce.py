@@ -0,0 +1,85 @@
+from django.conf import settings
+
+from . import metrics
+
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# One HubUserLogin ingest per wizard at a time. While it's queued or running, newer uploads
+# only replace pending payload key (highest tvalue wins) instead of creating another task.
+# Hash fields: state (queued/running), payload (pending payload key, empty if none), tvalue (newest accepted),
+# token (of task which owns the state). Only owner's claim() refreshes TTL, so if its worker dies,
+# state expires PROFILE_COALESCING_TTL after the last claim and the next upload creates a new task.
+KEY_PREFIX = 'swstats:ingest:wizard:'
+
+SUBMIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HMSET', KEYS[1], 'state', 'queued', 'payload', ARGV[1], 'tvalue', ARGV[2], 'token', ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('HINCRBY', KEYS[2], 'profile.queued', 1)
+    return 1
+end
+if tonumber(ARGV[2]) > tonumber(redis.call('HGET', KEYS[1], 'tvalue')) then
+    redis.call('HMSET', KEYS[1], 'payload', ARGV[1], 'tvalue', ARGV[2])
+end
+redis.call('HINCRBY', KEYS[2], 'profile.collapsed', 1)
+return 0
+"""
+
+CLAIM_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') ~= ARGV[2] then
+    return false
+end
+local payload = redis.call('HGET', KEYS[1], 'payload')
+redis.call('HMSET', KEYS[1], 'state', 'running', 'payload', '')
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return payload
+"""
+
+FINISH_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') ~= ARGV[2] then
+    return 0
+end
+local payload = redis.call('HGET', KEYS[1], 'payload')
+if payload and payload ~= '' then
+    redis.call('HSET', KEYS[1], 'state', 'queued')
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return 0
+"""
+
+_scripts = dict()
+
+
+def _script(name, lua):
+    if name not in _scripts:
+        from django_redis import get_redis_connection
+        _scripts[name] = get_redis_connection('default').register_script(lua)
+    return _scripts[name]
+
+
+def submit(wizard_id, tvalue, payload_key):
+    """Returns token of ingest task which has to be created, None if upload was collapsed into the pending one."""
+    token = uuid.uuid4().hex
+    if _script('submit', SUBMIT_SCRIPT)(keys=[KEY_PREFIX + str(wizard_id), metrics.KEY], args=[payload_key, tvalue, settings.PROFILE_COALESCING_TTL, token]):
+        return token
+    return None
+
+
+def claim(wizard_id, token):
+    """Takes pending payload key, '' if there's nothing pending, None if state is gone (expired) or owned by other task."""
+    payload_key = _script('claim', CLAIM_SCRIPT)(
+        keys=[KEY_PREFIX + str(wizard_id)], args=[settings.PROFILE_COALESCING_TTL, token or ''])
+    return payload_key.decode('utf-8') if isinstance(payload_key, bytes) else payload_key
+
+
+def finish(wizard_id, token):
+    """Returns True if newer upload came in while ingest was running, so it has to be ingested as well.
+
+    State owned by other task (this one's expired in the meantime) is left untouched.
+    """
+    return bool(_script('finish', FINISH_SCRIPT)(keys=[KEY_PREFIX + str(wizard_id)], args=[settings.PROFILE_COALESCING_TTL, token or '']))
@@ -0,0 +1,41 @@
+from django.conf import settings
+
+from . import metrics
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recently seen battle uploads (see get_battle_key), plugin retransmits are dropped before any database work.
+# Keys expire after BATTLE_DEDUP_TTL, shared by all web processes. Key is claimed when upload is accepted
+# and released if it couldn't be queued or saved, so retransmit of a failed upload is saved.
+KEY_PREFIX = 'swstats:seen:'
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def is_duplicate(key):
+    try:
+        pipe = _redis().pipeline()
+        pipe.set(KEY_PREFIX + key, 1, nx=True, ex=settings.BATTLE_DEDUP_TTL)
+        pipe.hincrby(metrics.KEY, 'battles.seen', 1)
+        first, _ = pipe.execute()
+    except Exception as e:  # better to save a duplicate than to lose an upload
+        logger.warning(f"Couldn't check if {key} is a duplicate: {e}")
+        return False
+
+    if not first:
+        metrics.incr_counter('battles.duplicate')
+    return not first
+
+
+def release(key):
+    if key is None or not settings.BATTLE_DEDUP:
+        return
+    try:
+        _redis().delete(KEY_PREFIX + key)
+    except Exception as e:  # retransmit is dropped until the key expires
+        logger.warning(f"Couldn't release {key}: {e}")
@@ -1,7 +1,13 @@
 from .models import *
-from django.db.models import F, Q, Avg, Min, Max, Sum, Count, FloatField, Func
+from . import references, payloads, pairing, metrics, signals
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Q, Avg, Min, Max, Sum, Count, FloatField, DateTimeField, Func, Value
+from django.db.models.functions import Greatest
 
 import copy
+import hashlib
 import math
 import datetime
 import logging
@@ -21,58 +27,67 @@ from datetime import timedelta
 # region RUNES
 
 
+# TYPE: [ 1*, 2*, 3*, 4*, 5*, 6* ]
+RUNE_MAINSTAT_MAX = {
+    1: [804, 1092, 1380, 1704, 2088, 2448],
+    2: [18, 20, 38, 43, 51, 63],
+    3: [54, 74, 93, 113, 135, 160],
+    4: [18, 20, 38, 43, 51, 63],
+    5: [54, 74, 93, 113, 135, 160],
+    6: [18, 20, 38, 43, 51, 63],
+
+    8: [18, 19, 25, 30, 39, 42],
+    9: [18, 20, 37, 41, 47, 58],
+    10: [20, 37, 43, 58, 65, 80],
+    11: [18, 20, 38, 44, 51, 64],
+    12: [18, 20, 38, 44, 51, 64],
+}
+
+# TYPE: [ 1*, 2*, 3*, 4*, 5*, 6* ]
+RUNE_SUBSTAT_MAX = {
+    1: [300, 525, 825, 1125, 1500, 1875],
+    2: [10, 15, 25, 30, 35, 40],
+    3: [20, 25, 40, 50, 75, 100],
+    4: [10, 15, 25, 30, 35, 40],
+    5: [20, 25, 40, 50, 75, 100],
+    6: [10, 15, 25, 30, 35, 40],
+
+    8: [5, 10, 15, 20, 25, 30],
+    9: [5, 10, 15, 20, 25, 30],
+    10: [10, 15, 20, 25, 25, 35],
+    11: [10, 15, 20, 25, 35, 40],
+    12: [10, 15, 20, 25, 35, 40],
+}
+
+# lookup tables for calc_efficiency_batch, index: stat effect (& rune class), NaN for unknown effects
+RUNE_MAINSTAT_RATIO = np.full((max(RUNE_MAINSTAT_MAX) + 1, 6), np.nan)
+for _effect, _values in RUNE_MAINSTAT_MAX.items():
+    RUNE_MAINSTAT_RATIO[_effect] = [value / _values[-1] for value in _values]
+RUNE_SUBSTAT_DIVISOR = np.full(max(RUNE_SUBSTAT_MAX) + 1, np.nan)
+for _effect, _values in RUNE_SUBSTAT_MAX.items():
+    RUNE_SUBSTAT_DIVISOR[_effect] = _values[-1]
+
+
 def calc_efficiency(rune):
     primary = rune['pri_eff']
     innate = rune['prefix_eff']
     substats = rune['sec_eff']
 
-    # TYPE: [ 1*, 2*, 3*, 4*, 5*, 6* ]
-    MAINSTAT_MAX = {
-        1: [804, 1092, 1380, 1704, 2088, 2448],
-        2: [18, 20, 38, 43, 51, 63],
-        3: [54, 74, 93, 113, 135, 160],
-        4: [18, 20, 38, 43, 51, 63],
-        5: [54, 74, 93, 113, 135, 160],
-        6: [18, 20, 38, 43, 51, 63],
-
-        8: [18, 19, 25, 30, 39, 42],
-        9: [18, 20, 37, 41, 47, 58],
-        10: [20, 37, 43, 58, 65, 80],
-        11: [18, 20, 38, 44, 51, 64],
-        12: [18, 20, 38, 44, 51, 64],
-    }
-
-    # TYPE: [ 1*, 2*, 3*, 4*, 5*, 6* ]
-    SUBSTAT_MAX = {
-        1: [300, 525, 825, 1125, 1500, 1875],
-        2: [10, 15, 25, 30, 35, 40],
-        3: [20, 25, 40, 50, 75, 100],
-        4: [10, 15, 25, 30, 35, 40],
-        5: [20, 25, 40, 50, 75, 100],
-        6: [10, 15, 25, 30, 35, 40],
-
-        8: [5, 10, 15, 20, 25, 30],
-        9: [5, 10, 15, 20, 25, 30],
-        10: [10, 15, 20, 25, 25, 35],
-        11: [10, 15, 20, 25, 35, 40],
-        12: [10, 15, 20, 25, 35, 40],
-    }
-
     ratio = 0.00
     rune_class = rune['class'] % 10  # ancient runes
     rune_class -= 1  # because 1* - 6*, but indexes starts at 0
 
     # mainstat
-    ratio += MAINSTAT_MAX[primary[0]][rune_class] / \
-        MAINSTAT_MAX[primary[0]][-1]  # -1: last, the biggest one
+    ratio += RUNE_MAINSTAT_MAX[primary[0]][rune_class] / \
+        RUNE_MAINSTAT_MAX[primary[0]][-1]  # -1: last, the biggest one
 
     # innate
     if innate[0]:
-        ratio += innate[1] / SUBSTAT_MAX[innate[0]][-1]
+        ratio += innate[1] / RUNE_SUBSTAT_MAX[innate[0]][-1]
 
     # substats
     for sub in substats:
-        ratio += (sub[1] + sub[3]) / SUBSTAT_MAX[sub[0]][-1]
+        ratio += (sub[1] + sub[3]) / RUNE_SUBSTAT_MAX[sub[0]][-1]
 
     eff_curr = ratio / 2.8 * 100
     eff_max = eff_curr + \
@@ -81,6 +96,85 @@ def calc_efficiency(rune):
     return round(eff_curr, 2), round(eff_max, 2)
 
 
+def _check_effects(table, effects, mask=None):
+    effects = np.asarray(effects, dtype=np.int64)
+    if effects.size and (effects.min() < 0 or effects.max() >= table.shape[0]):
+        raise KeyError(int(effects.max() if effects.max()
+                           >= table.shape[0] else effects.min()))
+    invalid = np.isnan(table[effects])
+    if invalid.ndim > 1:
+        invalid = invalid.any(axis=tuple(range(1, invalid.ndim)))
+    if mask is not None:
+        invalid &= mask
+    if invalid.any():
+        raise KeyError(int(effects[invalid][0]))
+
+
+def _round_array(values):
+    # Python round(), np.round gives different results for some halves
+    return np.array([round(value, 2) for value in values.tolist()])
+
+
+def calc_efficiency_batch(primary, rune_class, innate, innate_value, substats, substats_values, upgrade_curr):
+    """Vectorized calc_efficiency, same results for every rune.
+
+    `substats` & `substats_values` (main value + grind) are 2D arrays padded with 0, everything else is 1D.
+    """
+    if not len(primary):
+        return np.array([]), np.array([])
+
+    primary = np.asarray(primary, dtype=np.int64)
+    rune_class = np.asarray(rune_class, dtype=np.int64) % 10 - 1
+    innate = np.asarray(innate, dtype=np.int64)
+    innate_value = np.asarray(innate_value, dtype=np.float64)
+    substats = np.asarray(substats, dtype=np.int64).reshape(len(primary), -1)
+    substats_values = np.asarray(
+        substats_values, dtype=np.float64).reshape(len(primary), -1)
+    upgrade_curr = np.asarray(upgrade_curr, dtype=np.int64)
+
+    _check_effects(RUNE_MAINSTAT_RATIO, primary)
+    _check_effects(RUNE_SUBSTAT_DIVISOR, innate, innate != 0)
+    for column in range(substats.shape[1]):
+        _check_effects(RUNE_SUBSTAT_DIVISOR,
+                       substats[:, column], substats[:, column] != 0)
+
+    # same order of operations as in calc_efficiency, so floats are equal
+    ratio = RUNE_MAINSTAT_RATIO[primary, rune_class]
+    with np.errstate(invalid='ignore'):
+        ratio = ratio + np.where(innate != 0, innate_value /
+                                 RUNE_SUBSTAT_DIVISOR[innate], 0.0)
+        for column in range(substats.shape[1]):
+            ratio = ratio + np.where(substats[:, column] != 0, substats_values[:, column] /
+                                     RUNE_SUBSTAT_DIVISOR[substats[:, column]], 0.0)
+
+    eff_curr = ratio / 2.8 * 100
+    eff_max = eff_curr + \
+        np.maximum(np.ceil((12 - upgrade_curr) / 3), 0) * 0.2 / 2.8 * 100
+
+    return _round_array(eff_curr), _round_array(eff_max)
+
+
+def calc_efficiencies(runes):
+    """calc_efficiency for list of com2us runes, returns (efficiency, efficiency_max) arrays."""
+    width = max([len(rune['sec_eff']) for rune in runes], default=0)
+    substats = np.zeros((len(runes), width), dtype=np.int64)
+    substats_values = np.zeros((len(runes), width), dtype=np.float64)
+    for i, rune in enumerate(runes):
+        for j, sub in enumerate(rune['sec_eff']):
+            substats[i, j] = sub[0]
+            substats_values[i, j] = sub[1] + sub[3]
+
+    return calc_efficiency_batch(
+        [rune['pri_eff'][0] for rune in runes],
+        [rune['class'] for rune in runes],
+        [rune['prefix_eff'][0] for rune in runes],
+        [rune['prefix_eff'][1] for rune in runes],
+        substats,
+        substats_values,
+        [rune['upgrade_curr'] for rune in runes],
+    )
+
+
 def add_stat(stats, base_stats, stat, substat=False):
     stat_effect = stat[0]
     # grinds for substats
@@ -114,7 +208,7 @@ def add_stat(stats, base_stats, stat, substat=False):
         stats['defense'] += stat_value * base_stats['defense'] / 100
 
 
-def parse_rune(temp_rune, wizard, rune_sets, rune_lock=None):
+def prepare_rune(temp_rune, wizard, rune_sets, rune_lock=None, efficiency=None):
     com2us_keys = ['rune_id', 'slot_no', 'rank', 'class',
                    'upgrade_curr', 'base_value', 'sell_value', 'extra']
     map_keys = ['id', 'slot', 'quality', 'stars', 'upgrade_curr',
@@ -159,80 +253,107 @@ def parse_rune(temp_rune, wizard, rune_sets, rune_lock=None):
         for sub in temp_rune['sec_eff']:
             rune[sub_map[sub[0]]] = [sub[1], sub[3]]
 
-        eff_curr, eff_max = calc_efficiency(temp_rune)
+        eff_curr, eff_max = efficiency if efficiency else calc_efficiency(
+            temp_rune)
         rune['efficiency'] = eff_curr
         rune['efficiency_max'] = eff_max
 
     rune['equipped'] = True if 'occupied_type' in temp_rune_keys and temp_rune['occupied_type'] == 1 else False
     rune['locked'] = True if rune_lock is not None and 'rune_id' in temp_rune_keys and temp_rune['rune_id'] in rune_lock else False
 
-    Rune.objects.update_or_create(
-        id=rune['id'], defaults=rune, )
+    return rune
+
+
+def parse_runes_bulk(temp_runes, wizard, rune_sets, rune_lock=None, update=True):
+    """Upserts all given runes at once (only inserts new ones if not `update`), returns prepared rows as {id: rune}."""
+    temp_runes = [temp_rune for temp_rune in temp_runes if isinstance(
+        temp_rune, dict)]
+    with_substats = [temp_rune for temp_rune in temp_runes if 'sec_eff' in temp_rune]
+    efficiencies = {id(temp_rune): efficiency for temp_rune, efficiency in zip(
+        with_substats, zip(*calc_efficiencies(with_substats)))}
+
+    runes = dict()
+    for temp_rune in temp_runes:
+        rune = prepare_rune(temp_rune, wizard, rune_sets,
+                            rune_lock, efficiencies.get(id(temp_rune)))
+        if rune is None:
+            continue
+        runes[rune['id']] = {**runes[rune['id']], **
+                             rune} if rune['id'] in runes else rune
+
+    bulk_upsert(Rune, list(runes.values()), update=update)
+    return runes
 
 # endregion
 
 # region ARTIFACTS
 
 
+# TYPE: max value
+ARTIFACT_SUBSTAT_MAX = {
+    200: 70,
+    201: 70,
+    202: 70,
+    203: 30,
+    204: 25,
+    205: 20,
+    206: 30,
+    207: 30,
+    208: 20,
+    209: 20,
+    210: 20,
+    211: 15,
+    212: 20,
+    213: 15,
+    214: 20,
+    215: 40,
+    216: 30,
+    217: 30,
+    218: 15,
+    219: 20,
+    220: 20,
+    221: 200,
+    222: 30,
+    223: 60,
+    224: 20,
+
+    300: 25,
+    301: 25,
+    302: 25,
+    303: 25,
+    304: 25,
+    305: 30,
+    306: 30,
+    307: 30,
+    308: 30,
+    309: 30,
+
+    400: 30,
+    401: 30,
+    402: 30,
+    403: 30,
+    404: 30,
+    405: 30,
+    406: 30,
+    407: 30,
+    408: 30,
+    409: 30,
+}
+
+# lookup table for calc_efficiency_artifact_batch, index: substat effect, NaN for unknown effects
+ARTIFACT_SUBSTAT_DIVISOR = np.full(max(ARTIFACT_SUBSTAT_MAX) + 1, np.nan)
+for _effect, _value in ARTIFACT_SUBSTAT_MAX.items():
+    ARTIFACT_SUBSTAT_DIVISOR[_effect] = _value
+
+
 def calc_efficiency_artifact(artifact):
     substats = artifact['sec_effects']
 
-    # TYPE: [ 1*, 2*, 3*, 4*, 5*, 6* ]
-    SUBSTAT_MAX = {
-        200: 70,
-        201: 70,
-        202: 70,
-        203: 30,
-        204: 25,
-        205: 20,
-        206: 30,
-        207: 30,
-        208: 20,
-        209: 20,
-        210: 20,
-        211: 15,
-        212: 20,
-        213: 15,
-        214: 20,
-        215: 40,
-        216: 30,
-        217: 30,
-        218: 15,
-        219: 20,
-        220: 20,
-        221: 200,
-        222: 30,
-        223: 60,
-        224: 20,
-
-        300: 25,
-        301: 25,
-        302: 25,
-        303: 25,
-        304: 25,
-        305: 30,
-        306: 30,
-        307: 30,
-        308: 30,
-        309: 30,
-
-        400: 30,
-        401: 30,
-        402: 30,
-        403: 30,
-        404: 30,
-        405: 30,
-        406: 30,
-        407: 30,
-        408: 30,
-        409: 30,
-    }
-
     ratio = 1.00
 
     # substats
     for sub in substats:
-        ratio += sub[1] / SUBSTAT_MAX[sub[0]]
+        ratio += sub[1] / ARTIFACT_SUBSTAT_MAX[sub[0]]
 
     eff_curr = ratio / 2.6 * 100
     eff_max = eff_curr + \
@@ -241,7 +362,51 @@ def calc_efficiency_artifact(artifact):
     return round(eff_curr, 2), round(eff_max, 2)
 
 
-def parse_artifact(temp_artifact, wizard):
+def calc_efficiency_artifact_batch(substats, substats_values, level):
+    """Vectorized calc_efficiency_artifact, same results for every artifact.
+
+    `substats` & `substats_values` are 2D arrays padded with 0.
+    """
+    if not len(level):
+        return np.array([]), np.array([])
+
+    level = np.asarray(level, dtype=np.int64)
+    substats = np.asarray(substats, dtype=np.int64).reshape(len(level), -1)
+    substats_values = np.asarray(
+        substats_values, dtype=np.float64).reshape(len(level), -1)
+
+    for column in range(substats.shape[1]):
+        _check_effects(ARTIFACT_SUBSTAT_DIVISOR,
+                       substats[:, column], substats[:, column] != 0)
+
+    ratio = np.full(len(level), 1.00)
+    with np.errstate(invalid='ignore'):
+        for column in range(substats.shape[1]):
+            ratio = ratio + np.where(substats[:, column] != 0, substats_values[:, column] /
+                                     ARTIFACT_SUBSTAT_DIVISOR[substats[:, column]], 0.0)
+
+    eff_curr = ratio / 2.6 * 100
+    eff_max = eff_curr + \
+        np.maximum(np.ceil((12 - level) / 3), 0) * 0.2 / 2.6 * 100
+
+    return _round_array(eff_curr), _round_array(eff_max)
+
+
+def calc_efficiencies_artifact(artifacts):
+    """calc_efficiency_artifact for list of com2us artifacts, returns (efficiency, efficiency_max) arrays."""
+    width = max([len(artifact['sec_effects'])
+                 for artifact in artifacts], default=0)
+    substats = np.zeros((len(artifacts), width), dtype=np.int64)
+    substats_values = np.zeros((len(artifacts), width), dtype=np.float64)
+    for i, artifact in enumerate(artifacts):
+        for j, sub in enumerate(artifact['sec_effects']):
+            substats[i, j] = sub[0]
+            substats_values[i, j] = sub[1]
+
+    return calc_efficiency_artifact_batch(substats, substats_values, [artifact['level'] for artifact in artifacts])
+
+
+def prepare_artifact(temp_artifact, wizard, efficiency=None):
     com2us_keys = ['rid', 'type', 'attribute', 'unit_style',
                    'level', 'rank', 'natural_rank', 'locked']
     map_keys = ['id', 'rtype', 'attribute', 'archetype',
@@ -275,14 +440,32 @@ def parse_artifact(temp_artifact, wizard):
         artifact['substats'] = subs
         artifact['substats_values'] = sub_values
 
-        eff_curr, eff_max = calc_efficiency_artifact(temp_artifact)
+        eff_curr, eff_max = efficiency if efficiency else calc_efficiency_artifact(
+            temp_artifact)
         artifact['efficiency'] = eff_curr
         artifact['efficiency_max'] = eff_max
 
     artifact['equipped'] = True if 'occupied_id' in temp_artifact_keys and temp_artifact['occupied_id'] > 0 else False
 
-    Artifact.objects.update_or_create(
-        id=artifact['id'], defaults=artifact, )
+    return artifact
+
+
+def parse_artifacts_bulk(temp_artifacts, wizard, update=True):
+    """Upserts all given artifacts at once (only inserts new ones if not `update`), returns prepared rows as {id: artifact}."""
+    with_substats = [temp_artifact for temp_artifact in temp_artifacts
+                     if 'sec_effects' in temp_artifact and temp_artifact['sec_effects']]
+    efficiencies = {id(temp_artifact): efficiency for temp_artifact, efficiency in zip(
+        with_substats, zip(*calc_efficiencies_artifact(with_substats)))}
+
+    artifacts = dict()
+    for temp_artifact in temp_artifacts:
+        artifact = prepare_artifact(
+            temp_artifact, wizard, efficiencies.get(id(temp_artifact)))
+        artifacts[artifact['id']] = {**artifacts[artifact['id']], **
+                                     artifact} if artifact['id'] in artifacts else artifact
+
+    bulk_upsert(Artifact, list(artifacts.values()), update=update)
+    return artifacts
 # endregion
 
 # region MONSTERS
@@ -334,7 +517,7 @@ def calc_stats(monster, runes, artifacts):
                 stats['defense'] += temp_artifact['pri_effect'][1]
 
     for key, value in sets.items():
-        _set = RuneSet.objects.get(id=key)
+        _set = references.get_rune_set(key)
         set_number = math.floor(value / _set.amount)
         if set_number > 0:
             # bonus times number of completed sets
@@ -367,19 +550,196 @@ def calc_stats(monster, runes, artifacts):
     return stats, rune_ids
 
 
-def parse_monster(temp_monster, wizard, buildings=list(), units_locked=list(), runes_rta=list(), artifacts_rta=list()):
-    com2us_keys = ['unit_id', 'unit_level', 'class', 'create_time']
-    map_keys = ['id', 'level', 'stars', 'created']
-    temp_monster_keys = temp_monster.keys()
-    monster = dict()
+MONSTER_STATS = ['hp', 'attack', 'defense', 'speed',
+                 'res', 'acc', 'crit_rate', 'crit_dmg']
+
+# rune effect -> column in MONSTER_STATS (-1: no stat), % of base stat
+RUNE_EFFECT_COLUMN = np.array([-1, 0, 0, 1, 1, 2, 2, -1, 3, 6, 7, 4, 5])
+RUNE_EFFECT_PERCENT = np.array(
+    [False, False, True, False, True, False, True, False, False, False, False, False, False])
+
+# set name: [stat, bonus, is bonus multiplied by base stat]
+RUNE_SET_BONUSES = {
+    'Energy': ['hp', 0.15, True],  # Energy: +15% base HP
+    'Guard': ['defense', 0.15, True],  # Guard: +15% base Defense
+    'Swift': ['speed', 0.25, True],  # Swift: +25% base Speed
+    'Blade': ['crit_rate', 12, False],  # Blade: +12% Critical Rate
+    'Rage': ['crit_dmg', 40, False],  # Rage: +40% Critical Damage
+    'Focus': ['acc', 20, False],  # Focus: +20% Accuracy
+    'Endure': ['res', 20, False],  # Endure: +20% Resistance
+    'Fatal': ['attack', 0.35, True],  # Fatal: +35% base Attack
+}
+
+
+def calc_stats_batch(temp_monsters, runes, artifacts):
+    """Stats & efficiency averages of all monsters of the profile at once, returns calc_monster_stats result for every monster.
+
+    Rune & set bonuses are the ones of calc_stats (artifacts don't add any stats there either),
+    efficiency averages and equipped IDs the ones of calc_monster_stats. Equal values & types are checked
+    by website.tests.MonsterStatsBatchTestCase on hand-built profiles and by `python manage.py check_monster_stats`
+    on real HubUserLogin JSON files.
+    """
+    count = len(temp_monsters)
+    base = np.zeros((count, len(MONSTER_STATS)))
+    rune_counts = np.zeros(count, dtype=np.int64)
+    with_runes = np.zeros(count, dtype=bool)
+
+    # every rune stat in calc_stats order: (monster, effect, value)
+    stat_monsters, stat_effects, stat_values = list(), list(), list()
+    set_monsters, set_ids = list(), list()
+    eff_monsters, eff_slots, eff_values = list(), list(), list()
+    art_monsters, art_values = list(), list()
+    links = [{'runes': list(), 'artifacts': list()} for _ in range(count)]
+
+    for i, temp_monster in enumerate(temp_monsters):
+        if 'runes' not in temp_monster.keys():
+            continue
+        with_runes[i] = True
+        temp_monster['artifacts']  # KeyError, same as calc_stats
+        base[i] = [temp_monster['con'] * 15, temp_monster['atk'], temp_monster['def'], temp_monster['spd'],
+                   temp_monster['resist'], temp_monster['accuracy'], temp_monster['critical_rate'], temp_monster['critical_damage']]
+
+        monster_runes = get_monster_runes(temp_monster)
+        rune_counts[i] = len(monster_runes)
+        for temp_rune in monster_runes:
+            set_monsters.append(i)
+            set_ids.append(temp_rune['set_id'])
+            for stat in [temp_rune['pri_eff'], temp_rune['prefix_eff']]:
+                stat_monsters.append(i)
+                stat_effects.append(stat[0])
+                stat_values.append(stat[1])
+            for stat in temp_rune['sec_eff']:
+                stat_monsters.append(i)
+                stat_effects.append(stat[0])
+                stat_values.append(stat[1] + stat[3])
+
+        for rune_id in dict.fromkeys(temp_rune['rune_id'] for temp_rune in monster_runes):
+            if rune_id in runes:
+                eff_monsters.append(i)
+                eff_slots.append(runes[rune_id]['slot'])
+                eff_values.append(runes[rune_id]['efficiency'])
+                links[i]['runes'].append(rune_id)
+
+    for i, temp_monster in enumerate(temp_monsters):
+        if 'artifacts' not in temp_monster.keys() or not temp_monster['artifacts']:
+            continue
+        for artifact in temp_monster['artifacts']:
+            if artifact['rid'] not in artifacts:
+                raise Artifact.DoesNotExist(
+                    f"Artifact {artifact['rid']} does not exist.")
+            art_monsters.append(i)
+            art_values.append(artifacts[artifact['rid']]['efficiency'])
+            links[i]['artifacts'].append(artifact['rid'])
 
-    for db, c2u in zip(map_keys, com2us_keys):
-        if c2u in temp_monster_keys:
-            monster[db] = temp_monster[c2u]
+    ####################
+    # Stats calc
+    stats = base.copy()
+    stat_monsters = np.array(stat_monsters, dtype=np.int64)
+    stat_effects = np.array(stat_effects, dtype=np.int64)
+    stat_values = np.array(stat_values, dtype=np.float64)
+    known = (stat_effects >= 0) & (stat_effects < len(RUNE_EFFECT_COLUMN))
+    columns = RUNE_EFFECT_COLUMN[np.where(known, stat_effects, 0)]
+    known &= columns >= 0
+    stat_monsters, stat_effects, stat_values, columns = stat_monsters[
+        known], stat_effects[known], stat_values[known], columns[known]
+    bonus = np.where(RUNE_EFFECT_PERCENT[stat_effects], stat_values *
+                     base[stat_monsters, columns] / 100, stat_values)
+    # ufunc.at adds in given order, same as calc_stats
+    np.add.at(stats, (stat_monsters, columns), bonus)
+
+    if set_ids:
+        unique_sets, set_columns = np.unique(
+            np.array(set_ids), return_inverse=True)
+        set_counts = np.zeros((count, len(unique_sets)))
+        np.add.at(set_counts, (np.array(set_monsters), set_columns), 1)
+        for j, set_id in enumerate(unique_sets.tolist()):
+            _set = references.get_rune_set(set_id)
+            if _set.name not in RUNE_SET_BONUSES:
+                continue
+            stat, value, of_base = RUNE_SET_BONUSES[_set.name]
+            column = MONSTER_STATS.index(stat)
+            set_number = np.floor(set_counts[:, j] / _set.amount)
+            completed = set_number > 0
+            if of_base:
+                stats[completed, column] += base[completed,
+                                                 column] * set_number[completed] * value
+            else:
+                stats[completed, column] += set_number[completed] * value
+
+    stats = np.ceil(stats)
+    eff_hp = stats[:, 0] * (1140 + (stats[:, 2] * 1 * 3.5)) / 1000
+    ####################
 
-    monster['wizard'] = wizard
-    monster['base_monster'] = MonsterBase.objects.get(
-        id=temp_monster['unit_master_id'])
+    eff_sums = np.zeros(count)
+    eff_counts = np.zeros(count, dtype=np.int64)
+    if eff_values:
+        eff_monsters = np.array(eff_monsters, dtype=np.int64)
+        # same order as Rune.Meta.ordering, every slot is unique per monster
+        order = np.lexsort((np.array(eff_slots), eff_monsters))
+        np.add.at(eff_sums, eff_monsters[order],
+                  np.array(eff_values, dtype=np.float64)[order])
+        eff_counts = np.bincount(eff_monsters, minlength=count)
+
+    art_sums = np.zeros(count)
+    art_counts = np.zeros(count, dtype=np.int64)
+    if art_values:
+        art_monsters = np.array(art_monsters, dtype=np.int64)
+        np.add.at(art_sums, art_monsters, np.array(
+            art_values, dtype=np.float64))
+        art_counts = np.bincount(art_monsters, minlength=count)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_eff = np.array([round(value, 2) if counter > 0 else 0.00 for value, counter in zip(
+            (eff_sums / eff_counts).tolist(), eff_counts.tolist())])
+        avg_eff_artifacts = np.array([round(value, 2) if counter > 0 else 0.00 for value, counter in zip(
+            (art_sums / art_counts).tolist(), art_counts.tolist())])
+        with_artifacts = avg_eff_artifacts > 0
+        total = 0.00 + avg_eff * eff_counts
+        total = np.where(with_artifacts, total +
+                         avg_eff_artifacts * art_counts, total)
+        total_counts = eff_counts + np.where(with_artifacts, art_counts, 0)
+        avg_eff_total = [round(value, 2) if counter > 0 else 0.00 for value, counter in zip(
+            (total / total_counts).tolist(), total_counts.tolist())]
+
+    results = list()
+    for i, temp_monster in enumerate(temp_monsters):
+        monster = dict()
+        if with_runes[i]:
+            if rune_counts[i]:
+                monster.update({stat: int(value) for stat, value in zip(
+                    MONSTER_STATS, stats[i].tolist())})
+                monster['eff_hp'] = eff_hp[i].item()
+            else:
+                # no runes, calc_stats returns base stats as they are
+                monster.update({stat: value for stat, value in zip(MONSTER_STATS, [
+                    temp_monster['con'] * 15, temp_monster['atk'], temp_monster['def'], temp_monster['spd'],
+                    temp_monster['resist'], temp_monster['accuracy'], temp_monster['critical_rate'], temp_monster['critical_damage']])})
+                monster['eff_hp'] = monster['hp'] * \
+                    (1140 + (monster['defense'] * 1 * 3.5)) / 1000
+        monster['avg_eff'] = avg_eff[i].item()
+        monster['avg_eff_artifacts'] = avg_eff_artifacts[i].item()
+        monster['avg_eff_total'] = avg_eff_total[i]
+        monster['runes'] = sorted(links[i]['runes'], key=lambda rune_id: runes[rune_id]['slot'])
+        monster['artifacts'] = links[i]['artifacts']
+        results.append(monster)
+
+    return results
+
+
+def get_monster_runes(temp_monster):
+    runes = temp_monster['runes'] if 'runes' in temp_monster.keys() else list()
+    return [rune if isinstance(rune, dict) else runes[rune] for rune in runes]
+
+
+def calc_monster_stats(temp_monster, runes, artifacts):
+    """Stats & efficiency averages of a monster, returns monster fields with equipped 'runes' & 'artifacts' IDs.
+
+    `runes` and `artifacts` map already stored IDs to rows with at least 'efficiency' (and 'slot' for runes).
+    Ingest uses calc_stats_batch; this per-monster version (on top of calc_stats) is kept as its reference,
+    see website.tests & `python manage.py check_monster_stats`.
+    """
+    temp_monster_keys = temp_monster.keys()
+    monster = dict()
 
     ####################
     # Stats calc
@@ -395,12 +755,14 @@ def parse_monster(temp_monster, wizard, buildings=list(), units_locked=list(), r
         monster['crit_rate'] = stats['crit_rate']
         monster['crit_dmg'] = stats['crit_dmg']
 
-        monster_runes = Rune.objects.filter(id__in=rune_ids).only('efficiency')
+        # same order as Rune.Meta.ordering, every slot is unique per monster
+        monster_runes = sorted([runes[rune_id] for rune_id in dict.fromkeys(
+            rune_ids) if rune_id in runes], key=lambda rune: rune['slot'])
         sum_eff = 0
         for monster_rune in monster_runes:
-            sum_eff += monster_rune.efficiency
+            sum_eff += monster_rune['efficiency']
         monster['avg_eff'] = round(
-            sum_eff / monster_runes.count(), 2) if monster_runes.count() > 0 else 0.00
+            sum_eff / len(monster_runes), 2) if len(monster_runes) > 0 else 0.00
         monster['eff_hp'] = stats['hp'] * \
             (1140 + (stats['defense'] * 1 * 3.5)) / 1000
     else:
@@ -409,11 +771,15 @@ def parse_monster(temp_monster, wizard, buildings=list(), units_locked=list(), r
     ####################
 
     if 'artifacts' in temp_monster_keys and temp_monster['artifacts']:
-        monster_artifacts = [Artifact.objects.get(
-            id=artifact['rid']) for artifact in temp_monster['artifacts']]
+        monster_artifacts = list()
+        for artifact in temp_monster['artifacts']:
+            if artifact['rid'] not in artifacts:
+                raise Artifact.DoesNotExist(
+                    f"Artifact {artifact['rid']} does not exist.")
+            monster_artifacts.append(artifacts[artifact['rid']])
         sum_eff_artifacts = 0
         for monster_artifact in monster_artifacts:
-            sum_eff_artifacts += monster_artifact.efficiency
+            sum_eff_artifacts += monster_artifact['efficiency']
         monster['avg_eff_artifacts'] = round(
             sum_eff_artifacts / len(monster_artifacts), 2) if len(monster_artifacts) > 0 else 0.00
     else:
@@ -432,11 +798,39 @@ def parse_monster(temp_monster, wizard, buildings=list(), units_locked=list(), r
     monster['avg_eff_total'] = round(
         monster['avg_eff_total'] / eff_len, 2) if eff_len > 0 else 0.00
 
+    monster['runes'] = [rune['id'] for rune in monster_runes]
+    monster['artifacts'] = [artifact['id'] for artifact in monster_artifacts]
+
+    return monster
+
+
+def prepare_monster(temp_monster, wizard, stats, buildings=list(), units_locked=list()):
+    """Returns monster row, equipped rune IDs and equipped artifact IDs.
+
+    `stats` come from calc_stats_batch (or calc_monster_stats).
+    """
+    com2us_keys = ['unit_id', 'unit_level', 'class', 'create_time']
+    map_keys = ['id', 'level', 'stars', 'created']
+    temp_monster_keys = temp_monster.keys()
+    monster = dict()
+
+    for db, c2u in zip(map_keys, com2us_keys):
+        if c2u in temp_monster_keys:
+            monster[db] = temp_monster[c2u]
+
+    monster['wizard'] = wizard
+    monster['base_monster'] = references.get_monster_base(
+        temp_monster['unit_master_id'])
+
+    for key, value in stats.items():
+        if key not in ['runes', 'artifacts']:
+            monster[key] = value
+
     if 'skills' in temp_monster_keys:
         monster['skills'] = [skill[1] for skill in temp_monster['skills']]
     if 'source' in temp_monster_keys:
-        monster['source'] = MonsterSource.objects.get(
-            id=temp_monster['source'])
+        monster['source'] = references.get_monster_source(
+            temp_monster['source'])
     monster['transmog'] = True if 'costume_master_id' in temp_monster_keys and temp_monster['costume_master_id'] else False
     monster['storage'] = False
     if 'building_id' in temp_monster_keys:
@@ -446,50 +840,96 @@ def parse_monster(temp_monster, wizard, buildings=list(), units_locked=list(), r
                 break
     monster['locked'] = True if 'unit_id' in temp_monster_keys and temp_monster['unit_id'] in units_locked else False
 
-    mon_runes_rta = Rune.objects.filter(id__in=runes_rta)
-    mon_artifacts_rta = Artifact.objects.filter(id__in=artifacts_rta)
-
-    obj, _ = Monster.objects.update_or_create(
-        id=monster['id'], defaults=monster, )
-    obj.runes.set(monster_runes)
-    obj.runes_rta.set(mon_runes_rta)
-    obj.artifacts.set(monster_artifacts)
-    obj.artifacts_rta.set(mon_artifacts_rta)
-    obj.save()
-
-
-def parse_wizard_homunculus(homunculus, wizard):
+    return monster, stats['runes'], stats['artifacts']
+
+
+def parse_monsters_bulk(temp_monsters, wizard, runes=dict(), artifacts=dict(), buildings=list(), units_locked=list(), runes_rta=dict(), artifacts_rta=dict(), update=True):
+    """Upserts all given monsters at once (only inserts new ones if not `update`), returns prepared rows as {id: monster}.
+
+    `runes` and `artifacts` are rows returned by parse_runes_bulk & parse_artifacts_bulk,
+    anything referenced but not given there is read from database in one query.
+    `runes_rta` and `artifacts_rta` map monster ID to list of equipped (RTA) IDs.
+    """
+    runes = {rune_id: rune for rune_id, rune in runes.items()
+             if 'efficiency' in rune and 'slot' in rune}
+    artifacts = {artifact_id: artifact for artifact_id,
+                 artifact in artifacts.items() if 'efficiency' in artifact}
+
+    rune_ids = set(rune_id for rta in runes_rta.values() for rune_id in rta)
+    artifact_ids = set(
+        artifact_id for rta in artifacts_rta.values() for artifact_id in rta)
+    for temp_monster in temp_monsters:
+        rune_ids.update(rune['rune_id']
+                        for rune in get_monster_runes(temp_monster))
+        if 'artifacts' in temp_monster.keys() and temp_monster['artifacts']:
+            artifact_ids.update(artifact['rid']
+                                for artifact in temp_monster['artifacts'])
+
+    missing_runes = rune_ids - runes.keys()
+    if missing_runes:
+        runes.update({rune['id']: rune for rune in Rune.objects.filter(
+            id__in=missing_runes).values('id', 'slot', 'efficiency')})
+    missing_artifacts = artifact_ids - artifacts.keys()
+    if missing_artifacts:
+        artifacts.update({artifact['id']: artifact for artifact in Artifact.objects.filter(
+            id__in=missing_artifacts).values('id', 'efficiency')})
+
+    monsters = dict()
+    links = dict()
+    for temp_monster, stats in zip(temp_monsters, calc_stats_batch(temp_monsters, runes, artifacts)):
+        monster, monster_runes, monster_artifacts = prepare_monster(
+            temp_monster, wizard, stats, buildings, units_locked)
+        monsters[monster['id']] = monster
+        links[monster['id']] = {
+            'runes': monster_runes,
+            'runes_rta': [rune_id for rune_id in runes_rta.get(monster['id'], list()) if rune_id in runes],
+            'artifacts': monster_artifacts,
+            'artifacts_rta': [artifact_id for artifact_id in artifacts_rta.get(monster['id'], list()) if artifact_id in artifacts],
+        }
+
+    bulk_upsert(Monster, list(monsters.values()), update=update)
+
+    for field in ['runes', 'runes_rta', 'artifacts', 'artifacts_rta']:
+        bulk_set_m2m(Monster, field, {
+                     monster_id: monster_links[field] for monster_id, monster_links in links.items()})
+
+    return monsters
+
+
+def parse_wizard_homunculus(homunculus, wizard, monsters):
+    """`monsters` are existing monsters of the profile, see get_profile_monsters."""
     homies = dict()
     for el in homunculus:
+        if el['unit_id'] not in monsters:
+            continue
         if el['unit_id'] not in homies.keys():
-            homies[el['unit_id']] = dict()
-            homies[el['unit_id']]['wizard'] = wizard
-            homies[el['unit_id']]['homunculus'] = Monster.objects.get(
-                id=el['unit_id'])
-            homies[el['unit_id']]['depth_1'] = None
-            homies[el['unit_id']]['depth_2'] = None
-            homies[el['unit_id']]['depth_3'] = None
-            homies[el['unit_id']]['depth_4'] = None
-            homies[el['unit_id']]['depth_5'] = None
-
+            homies[el['unit_id']] = {
+                'depth_' + str(depth): None for depth in range(1, 6)}
         homies[el['unit_id']]['depth_' +
                               str(el['skill_depth'])] = el['skill_id']
 
-    for homie in homies.values():
+    stored = {homie.homunculus_id: homie for homie in WizardHomunculus.objects.filter(
+        wizard=wizard)}
+    to_create = list()
+    to_update = list()
+    for homunculus_id, homie in homies.items():
         if None in homie.values():
             continue
-        if None in [homie['depth_1'], homie['depth_2'], homie['depth_3'], homie['depth_4'], homie['depth_5']]:
-            continue
         try:
-            homie['build'] = HomunculusBuild.objects.get(
-                depth_1=homie['depth_1'], depth_2=homie['depth_2'], depth_3=homie['depth_3'], depth_4=homie['depth_4'], depth_5=homie['depth_5'])
-            obj, created = WizardHomunculus.objects.update_or_create(wizard=homie['wizard'], homunculus=homie['homunculus'], defaults={
-                'wizard': homie['wizard'],
-                'homunculus': homie['homunculus'],
-                'build': homie['build'],
-            }, )
+            build = references.get_homunculus_build(
+                homie['depth_1'], homie['depth_2'], homie['depth_3'], homie['depth_4'], homie['depth_5'])
         except HomunculusBuild.DoesNotExist:
-            pass
+            continue
+        if homunculus_id in stored:
+            stored[homunculus_id].build = build
+            to_update.append(stored[homunculus_id])
+        else:
+            to_create.append(WizardHomunculus(
+                wizard=wizard, homunculus_id=homunculus_id, build=build))
+
+    if to_update:
+        WizardHomunculus.objects.bulk_update(to_update, ['build'])
+    WizardHomunculus.objects.bulk_create(to_create)
 
 # endregion
 
@@ -515,6 +955,56 @@ def parse_guild(guild_info, guildwar, tvalue):
     guild['last_update'] = datetime.datetime.utcfromtimestamp(tvalue)
     Guild.objects.update_or_create(
         id=guild['id'], defaults=guild, )
+
+
+def parse_siege_defenses(data):
+    """Upserts siege defenses of already known wizards, up to 3 known monsters per defense. Returns number of defenses."""
+    last_update = datetime.datetime.utcfromtimestamp(data['tvalue'])
+    decks = data['defense_deck_list']
+    wizards = set(Wizard.objects.filter(id__in=set(
+        deck['wizard_id'] for deck in decks)).values_list('id', flat=True))
+
+    defenses = dict()
+    for deck in decks:
+        if deck['wizard_id'] not in wizards:
+            continue
+        defenses[deck['deck_id']] = {
+            'id': deck['deck_id'],
+            'win': deck['win_count'],
+            'lose': deck['lose_count'],
+            'ratio': deck['winning_rate'],
+            'wizard_id': deck['wizard_id'],
+            'last_update': last_update,
+        }
+    if not defenses:
+        return 0
+
+    units = [deck_units for deck_units in data['defense_unit_list']
+             if 'unit_info' in deck_units.keys() and deck_units['deck_id'] in defenses]
+    monsters = set(Monster.objects.filter(id__in=set(
+        deck_units['unit_info']['unit_id'] for deck_units in units)).values_list('id', flat=True))
+
+    links = {deck_id: list() for deck_id in defenses.keys()}
+    for deck_units in units:
+        monster_id = deck_units['unit_info']['unit_id']
+        if monster_id not in monsters or len(links[deck_units['deck_id']]) >= 3:
+            continue
+        links[deck_units['deck_id']].append(monster_id)
+        if deck_units['pos_id'] == 1:
+            defenses[deck_units['deck_id']]['leader_id'] = monster_id
+    for deck_id, defense in defenses.items():
+        defense['full'] = len(links[deck_id]) == 3
+
+    bulk_upsert(SiegeRecord, list(defenses.values()))
+    bulk_set_m2m(SiegeRecord, 'monsters', links)
+
+    if data['wizard_info_list']:
+        guild_id = data['wizard_info_list'][0]['guild_id']
+        if Guild.objects.filter(id=guild_id).exists():
+            Wizard.objects.filter(id__in=set(defense['wizard_id'] for defense in defenses.values())).exclude(
+                guild_id=guild_id).update(guild_id=guild_id)
+
+    return len(defenses)
 # endregion
 
 # region WIZARD
@@ -539,10 +1029,42 @@ def parse_wizard(temp_wizard, tvalue):
     return wizard
 
 
+def parse_friend_items(temp_wizard, wizard):
+    """Inserts runes, artifacts & monsters of visited friend, rows which already exist are left untouched.
+
+    Monster (and the rest of its items) is skipped at first broken (string) rune or artifact.
+    """
+    temp_runes = list()
+    temp_artifacts = list()
+    temp_monsters = list()
+    for temp_monster in temp_wizard['unit_list']:
+        good = True
+        for rune in temp_monster['runes']:
+            if isinstance(rune, str):
+                good = False
+                break
+            temp_runes.append(rune)
+        if good:
+            for artifact in temp_monster['artifacts']:
+                if isinstance(artifact, str):
+                    good = False
+                    break
+                temp_artifacts.append(artifact)
+        if good:
+            temp_monsters.append(temp_monster)
+
+    runes = parse_runes_bulk(
+        temp_runes, wizard, references.get_rune_sets(), update=False)
+    artifacts = parse_artifacts_bulk(temp_artifacts, wizard, update=False)
+    building_list = temp_wizard['building_list'] if 'building_list' in temp_wizard else [
+    ]
+    return parse_monsters_bulk(temp_monsters, wizard, runes, artifacts, building_list, update=False)
+
+
 def parse_wizard_buildings(decos, wizard):
-    buildings = {b.id: b for b in Building.objects.all()}
-    wizard_buildings = {wb.building.id: wb for wb in WizardBuilding.objects.select_related(
-        'building').filter(wizard=wizard)}
+    buildings = references.get_buildings()
+    wizard_buildings = {
+        wb.building_id: wb for wb in WizardBuilding.objects.filter(wizard=wizard)}
     wizard_buildings_new = {}
     wizard_buildings_update = []
 
@@ -567,39 +1089,943 @@ def parse_wizard_buildings(decos, wizard):
     WizardBuilding.objects.bulk_create(list(wizard_buildings_new.values()))
 
 
-def parse_arena_records(pvp_info, defense_units, wizard):
+def get_profile_monsters(monster_ids, monsters_eff=dict()):
+    """{monster ID: avg_eff} for given monster IDs which exist.
+
+    `monsters_eff` are monsters saved by current ingest, the rest is read in one query.
+    """
+    monster_ids = set(monster_ids)
+    monsters = {monster_id: avg_eff for monster_id,
+                avg_eff in monsters_eff.items() if monster_id in monster_ids}
+    missing = monster_ids - monsters.keys()
+    if missing:
+        monsters.update(Monster.objects.filter(
+            id__in=missing).values_list('id', 'avg_eff'))
+    return monsters
+
+
+def get_referenced_monster_ids(decks=list(), defense_units=list(), homunculus=list()):
+    """Monsters used by parse_decks, parse_arena_records & parse_wizard_homunculus."""
+    monster_ids = set()
+    for temp_deck in decks:
+        monster_ids.add(temp_deck['leader_unit_id'])
+        monster_ids.update(temp_deck['unit_id_list'])
+    monster_ids.update(def_unit['unit_id'] for def_unit in defense_units)
+    monster_ids.update(el['unit_id'] for el in homunculus)
+    monster_ids.discard(0)
+    return monster_ids
+
+
+def parse_arena_records(pvp_info, defense_units, wizard, monsters):
+    """`monsters` are existing monsters of the profile, see get_profile_monsters."""
     arena = dict()
     arena['wizard'] = wizard
     arena['wins'] = pvp_info['arena_win']
     arena['loses'] = pvp_info['arena_lose']
     arena['rank'] = pvp_info['rating_id']
     for def_unit in defense_units:
-        arena['def_' + str(def_unit['pos_id'])
-              ] = Monster.objects.get(id=def_unit['unit_id'])
+        if def_unit['unit_id'] in monsters:
+            arena['def_' + str(def_unit['pos_id']) +
+                  '_id'] = def_unit['unit_id']
     Arena.objects.update_or_create(
         wizard=wizard, defaults=arena, )
 
 
-def parse_decks(decks, wizard):
+def parse_decks(decks, wizard, monsters):
+    """`monsters` are existing monsters of the profile with their avg_eff, see get_profile_monsters."""
+    stored = {(deck.place, deck.number): deck for deck in Deck.objects.filter(
+        wizard=wizard)}
+    to_create = dict()
+    to_update = dict()
+    links = dict()
     for temp_deck in decks:
-        try:
-            deck = dict()
-            deck['wizard'] = wizard
-            deck['place'] = temp_deck['deck_type']
-            deck['number'] = temp_deck['deck_seq']
-            deck['leader'] = Monster.objects.get(
-                id=temp_deck['leader_unit_id'])
-            deck_monsters = Monster.objects.filter(
-                id__in=[monster_id for monster_id in temp_deck['unit_id_list'] if monster_id])
-            temp_team_eff = [mon.avg_eff for mon in deck_monsters]
-            deck['team_runes_eff'] = round(
-                sum(temp_team_eff) / len(temp_team_eff), 2)
-            obj, _ = Deck.objects.update_or_create(
-                wizard=wizard, place=temp_deck['deck_type'], number=temp_deck['deck_seq'], defaults=deck, )
-            obj.monsters.set(deck_monsters)
-            obj.save()
-        except Monster.DoesNotExist as e:
+        if temp_deck['leader_unit_id'] not in monsters:
+            continue
+        deck_monsters = list(dict.fromkeys(
+            monster_id for monster_id in temp_deck['unit_id_list'] if monster_id in monsters))
+        if not deck_monsters:
+            continue
+        key = (temp_deck['deck_type'], temp_deck['deck_seq'])
+        team_runes_eff = round(
+            sum(monsters[monster_id] for monster_id in deck_monsters) / len(deck_monsters), 2)
+
+        if key in stored and key not in to_create:
+            stored[key].leader_id = temp_deck['leader_unit_id']
+            stored[key].team_runes_eff = team_runes_eff
+            to_update[key] = stored[key]
+        else:
+            stored[key] = Deck(wizard=wizard, place=key[0], number=key[1],
+                               leader_id=temp_deck['leader_unit_id'], team_runes_eff=team_runes_eff)
+            to_create[key] = stored[key]
+        links[key] = deck_monsters
+
+    if to_update:
+        Deck.objects.bulk_update(
+            list(to_update.values()), ['leader', 'team_runes_eff'])
+    Deck.objects.bulk_create(list(to_create.values()))
+    bulk_set_m2m(Deck, 'monsters', {
+                 stored[key].id: deck_monsters for key, deck_monsters in links.items()})
+
+# HubUserLogin arrays which can be too big to keep in memory, streamed in batches when profile is given as payload key
+PROFILE_ARRAYS = ['runes', 'artifacts', 'unit_list']
+
+
+def read_profile_header(payload_key):
+    """Every HubUserLogin key except PROFILE_ARRAYS."""
+    return dict(payloads.iter_payload(payload_key, skip=PROFILE_ARRAYS))
+
+
+def iter_profile_batches(data, batch_size=None):
+    """Yields (PROFILE_ARRAYS key, list of items) batches of up to `batch_size` items, from profile dict or payload key."""
+    if isinstance(data, str):
+        items = payloads.iter_payload(
+            data, items=PROFILE_ARRAYS, values=False)
+    else:
+        items = ((key, item)
+                 for key in PROFILE_ARRAYS for item in data.get(key) or list())
+
+    batches = {key: list() for key in PROFILE_ARRAYS}
+    for key, item in items:
+        batches[key].append(item)
+        if batch_size and len(batches[key]) >= batch_size:
+            yield key, batches[key]
+            batches[key] = list()
+
+    for key in PROFILE_ARRAYS:
+        if batches[key]:
+            yield key, batches[key]
+
+
+def get_rta_equipment(equip_list, item_key):
+    """{monster ID: [equipped item IDs]} from world_arena_*_equip_list."""
+    equipment = dict()
+    for item in equip_list:
+        equipment.setdefault(item['occupied_id'], list()).append(
+            item[item_key])
+    return equipment
+
+
+# battle & siege records keep monsters they were made with, so those monsters are never reconciled
+HISTORY_MODELS = [DungeonRun, RiftDungeonRun,
+                  RaidDungeonRun, DimensionHoleRun, SiegeRecord]
+
+
+def get_history_monsters(monster_ids):
+    """IDs of given monsters which are used in any of HISTORY_MODELS records."""
+    referenced = set()
+    for relation in Monster._meta.related_objects:
+        if relation.related_model not in HISTORY_MODELS:
+            continue
+        if relation.many_to_many:
+            field = relation.field.m2m_reverse_field_name()
+            query = relation.through.objects.filter(
+                **{field + '_id__in': monster_ids}).values_list(field + '_id', flat=True)
+        else:
+            query = relation.related_model.objects.filter(
+                **{relation.field.attname + '__in': monster_ids}).values_list(relation.field.attname, flat=True)
+        referenced.update(query.distinct())
+    return referenced
+
+
+def reconcile_profile_items(wizard, uploaded):
+    """Deletes runes, artifacts & monsters of wizard which aren't in uploaded profile anymore (sold, fed, etc.).
+
+    `uploaded` is {'runes': set of IDs, 'artifacts': ..., 'monsters': ...}, returns number of deleted rows per kind.
+    """
+    reconciled = dict()
+    for kind, model in [('monsters', Monster), ('runes', Rune), ('artifacts', Artifact)]:
+        vanished = set(model.objects.filter(wizard=wizard).values_list(
+            'id', flat=True)) - uploaded[kind]
+        if kind == 'monsters' and vanished:
+            kept = get_history_monsters(vanished)
+            vanished -= kept
+            if kept:
+                metrics.incr_counter('reconcile.monsters.kept', len(kept))
+        if vanished:
+            signals.pre_bulk_delete.send(sender=model, ids=vanished)
+            model.objects.filter(id__in=vanished).delete()
+        reconciled[kind] = len(vanished)
+        metrics.incr_counter('reconcile.' + kind, len(vanished))
+    metrics.incr_counter('reconcile.profiles')
+    return reconciled
+
+
+def parse_profile_items(source, header, wizard, stored_fingerprints=None, batch_size=None, progress=None):
+    """Upserts runes, artifacts & monsters of HubUserLogin profile, `batch_size` items at once.
+
+    `source` is profile dict or payload key to stream PROFILE_ARRAYS from, rest of profile is given as `header`.
+    Returns {monster ID: avg_eff} of saved monsters and, if `stored_fingerprints` are given,
+    new fingerprints (only changed items are saved then).
+    With PROFILE_RECONCILE, items of wizard which aren't in the profile anymore are deleted afterwards.
+    Every batch is saved in its own transaction; with `progress` (ProfileIngest) batches it already counts are skipped.
+    """
+    rune_sets = references.get_rune_sets()
+    rune_lock_list = header.get('rune_lock_list', list())
+    building_list = header.get('building_list', list())
+    unit_lock_list = header.get('unit_lock_list', list())
+    runes_rta = get_rta_equipment(header.get(
+        'world_arena_rune_equip_list', list()), 'rune_id')
+    artifacts_rta = get_rta_equipment(header.get(
+        'world_arena_artifact_equip_list', list()), 'artifact_id')
+
+    rune_lock = set(rune_lock_list)
+    unit_lock = set(unit_lock_list)
+    storages = set(building['building_id'] for building in building_list
+                   if building['building_master_id'] == 25)
+    fingerprints = {'runes': dict(), 'artifacts': dict(), 'monsters': dict()}
+    filters = {
+        'runes': (lambda rune: rune['rune_id'], lambda rune: rune['rune_id'] in rune_lock),
+        'artifacts': (lambda artifact: artifact['rid'], None),
+        'monsters': (lambda monster: monster['unit_id'], lambda monster: [
+            monster['unit_id'] in unit_lock,
+            monster.get('building_id') in storages,
+            runes_rta.get(monster['unit_id']),
+            artifacts_rta.get(monster['unit_id']),
+        ]),
+    }
+
+    def changed(kind, items):
+        if stored_fingerprints is None:
+            return items
+        key, context = filters[kind]
+        items, current = filter_changed(
+            items, key, stored_fingerprints.get(kind, dict()), context)
+        fingerprints[kind].update(current)
+        return items
+
+    # monsters with RTA equipment are saved last, their RTA runes & artifacts may come in later batches
+    deferred = list()
+    monsters_eff = dict()
+    uploaded = {'runes': set(), 'artifacts': set(), 'monsters': set()}
+    for chunk, (kind, items) in enumerate(iter_profile_batches(source, batch_size)):
+        temp_runes, temp_artifacts, temp_monsters = list(), list(), list()
+        if kind == 'runes':
+            temp_runes = items
+        elif kind == 'artifacts':
+            temp_artifacts = items
+        else:
+            for temp_monster in items:
+                temp_runes += get_monster_runes(temp_monster)
+                temp_artifacts += temp_monster.get('artifacts') or list()
+                if temp_monster['unit_id'] in runes_rta or temp_monster['unit_id'] in artifacts_rta:
+                    deferred.append(temp_monster)
+                else:
+                    temp_monsters.append(temp_monster)
+        if settings.PROFILE_RECONCILE:
+            # broken (non-dict) entries are skipped, same as when items are parsed
+            uploaded['runes'].update(rune['rune_id'] for rune in temp_runes
+                                     if isinstance(rune, dict))
+            uploaded['artifacts'].update(artifact['rid'] for artifact in temp_artifacts
+                                         if isinstance(artifact, dict))
+            uploaded['monsters'].update(monster['unit_id'] for monster in items
+                                        if kind == 'unit_list' and isinstance(monster, dict))
+
+        temp_runes = changed('runes', temp_runes)
+        temp_artifacts = changed('artifacts', temp_artifacts)
+        temp_monsters = changed('monsters', temp_monsters)
+        if progress is not None and chunk < progress.chunks:
+            continue  # committed by interrupted ingest of the same payload
+
+        with transaction.atomic():
+            runes = parse_runes_bulk(
+                temp_runes, wizard, rune_sets, rune_lock_list) if temp_runes else dict()
+            artifacts = parse_artifacts_bulk(
+                temp_artifacts, wizard) if temp_artifacts else dict()
+            if temp_monsters:
+                monsters = parse_monsters_bulk(temp_monsters, wizard, runes, artifacts, building_list,
+                                               unit_lock_list, runes_rta, artifacts_rta)
+                monsters_eff.update((monster_id, monster['avg_eff'])
+                                    for monster_id, monster in monsters.items())
+            if progress is not None:
+                progress.chunks = chunk + 1
+                progress.save(update_fields=['chunks', 'updated'])
+
+    deferred = changed('monsters', deferred)
+    with transaction.atomic():
+        if deferred:
+            monsters = parse_monsters_bulk(deferred, wizard, dict(), dict(), building_list,
+                                           unit_lock_list, runes_rta, artifacts_rta)
+            monsters_eff.update((monster_id, monster['avg_eff'])
+                                for monster_id, monster in monsters.items())
+
+        if runes_rta:
+            temp_instances = Rune.objects.filter(
+                id__in=[item for record in runes_rta.values() for item in record])
+            temp_instances.equipped_rta = True
+            Rune.objects.bulk_update(
+                temp_instances, ['equipped_rta'], batch_size=100)
+        if artifacts_rta:
+            temp_instances = Artifact.objects.filter(
+                id__in=[item for record in artifacts_rta.values() for item in record])
+            temp_instances.equipped_rta = True
+            Artifact.objects.bulk_update(
+                temp_instances, ['equipped_rta'], batch_size=100)
+
+        # profile without monsters is broken, it would wipe out whole wizard
+        if settings.PROFILE_RECONCILE and uploaded['monsters']:
+            reconciled = reconcile_profile_items(wizard, uploaded)
+            logger.debug(
+                f"Profile {wizard.id}: reconciled {reconciled['runes']} runes, {reconciled['artifacts']} artifacts, {reconciled['monsters']} monsters")
+
+    return monsters_eff, fingerprints if stored_fingerprints is not None else None
+
+
+def count_profile_items(data):
+    """Number of runes, artifacts & monsters listed at the top level of HubUserLogin profile."""
+    return sum(len(data.get(key) or list()) for key in PROFILE_ARRAYS)
+
+
+def parse_profile_wizard(data, publish=True):
+    """Saves guild & wizard of HubUserLogin profile, returns (wizard, wizard_exists); wizard is None if stored profile is up-to-date.
+
+    Stored profile is up-to-date if its profile_tvalue isn't older than upload's tvalue.
+    Without `publish`, wizard's last_update & profile_tvalue are left as they were (epoch for new wizard), see parse_profile_chunked.
+    """
+    profile_guild = True
+    if data['guild']['guild_info'] is None:
+        logger.debug(
+            f"Profile {data['wizard_info']['wizard_id']} has no guild.")
+        profile_guild = False
+    else:
+        logger.debug(
+            f"Checking if guild {data['guild']['guild_info']['guild_id']} exists...")
+        guild = Guild.objects.filter(
+            id=data['guild']['guild_info']['guild_id'])
+        guild_uptodate = False
+        if guild.exists():
+            logger.debug(
+                f"Guild {data['guild']['guild_info']['guild_id']} exists... Checking if it's up-to-date...")
+            guild = guild.filter(
+                last_update__gte=datetime.datetime.utcfromtimestamp(data['tvalue']))
+            if guild.exists():
+                logger.debug(
+                    f"Guild {data['guild']['guild_info']['guild_id']} profile is up-to-date.")
+                guild_uptodate = True
+            else:
+                logger.debug(
+                    f"Updating guild profile {data['guild']['guild_info']['guild_id']}")
+        else:
+            logger.debug(
+                f"Guild profile does NOT exists. Starting first-time guild profile upload for {data['guild']['guild_info']['guild_id']}")
+
+    if (
+        profile_guild
+        and not guild_uptodate
+        and 'guild' in data
+        and 'guild_info' in data['guild']
+        and 'guildwar_ranking_stat' in data
+        and 'best' in data['guildwar_ranking_stat']
+        and 'tvalue' in data
+    ):
+        parse_guild(data['guild']['guild_info'],
+                    data['guildwar_ranking_stat']['best'], data['tvalue'])
+
+    logger.debug(
+        f"Checking if profile {data['wizard_info']['wizard_id']} exists...")
+    wiz = Wizard.objects.filter(id=data['wizard_info']['wizard_id'])
+    wizard_exists = wiz.exists()
+    if wizard_exists:
+        logger.debug(
+            f"Profile {data['wizard_info']['wizard_id']} exists... Checking if it's up-to-date...")
+        # battle uploads move last_update too, so only tvalue of saved profile tells if upload is stale
+        wizard = wiz.filter(
+            profile_tvalue__gte=datetime.datetime.utcfromtimestamp(data['tvalue']))
+        if wizard.exists():
+            logger.debug(
+                f"Wizard profile {data['wizard_info']['wizard_id']} is up-to-date. Ending...")
+            return None, wizard_exists
+        else:
+            logger.debug(
+                f"Updating profile {data['wizard_info']['wizard_id']}")
+    else:
+        logger.debug(
+            f"Profile {data['wizard_info']['wizard_id']} does NOT exists. Starting first-time profile upload")
+
+    temp_wizard = data['wizard_info']
+
+    wizard = parse_wizard(temp_wizard, data['tvalue'])
+    if 'quiz_reward_info' in data and 'reward_count' in data['quiz_reward_info']:
+        wizard['antibot_count'] = data['quiz_reward_info']['reward_count']
+
+    if 'raid_info_list' in data and len(data['raid_info_list']) > 0 and 'available_stage_id' in data['raid_info_list'][0]:
+        wizard['raid_level'] = data['raid_info_list'][0]['available_stage_id']
+
+    if 'unit_depository_slots' in data and 'number' in data['unit_depository_slots']:
+        wizard['storage_capacity'] = data['unit_depository_slots']['number']
+
+    if profile_guild:
+        wizard_guilds = Guild.objects.filter(
+            id=data['guild']['guild_info']['guild_id'])
+        if wizard_guilds.count() > 0:
+            wizard['guild'] = wizard_guilds.first()
+    else:
+        wizard['guild'] = None
+
+    stored_last_update = wiz.values_list('last_update', flat=True).first()
+    if publish:
+        wizard['profile_tvalue'] = wizard['last_update']
+        if stored_last_update is not None and stored_last_update > wizard['last_update']:  # battle uploaded after profile
+            wizard['last_update'] = stored_last_update
+    else:
+        wizard['last_update'] = stored_last_update or datetime.datetime.utcfromtimestamp(
+            0)
+    wizard, _ = Wizard.objects.update_or_create(
+        id=wizard['id'], defaults=wizard, )
+    return wizard, wizard_exists
+
+
+def parse_profile_links(data, wizard, monsters_eff=dict()):
+    """Saves monster rep, decks, buildings, arena & homunculus of HubUserLogin profile."""
+    temp_wizard = data['wizard_info']
+    deck_list = data['deck_list'] if 'deck_list' in data else []
+    deco_list = data['deco_list'] if 'deco_list' in data else []
+    defense_unit_list = data['defense_unit_list'] if 'defense_unit_list' in data else [
+    ]
+    homunculus_skill_list = data['homunculus_skill_list'] if 'homunculus_skill_list' in data else [
+    ]
+    monsters = get_profile_monsters(get_referenced_monster_ids(
+        deck_list, defense_unit_list, homunculus_skill_list) | {temp_wizard['rep_unit_id']}, monsters_eff)
+
+    # monster rep
+    if temp_wizard['rep_unit_id'] != 0 and temp_wizard['rep_unit_id'] in monsters:
+        MonsterRep.objects.update_or_create(wizard=wizard, defaults={
+            'wizard': wizard,
+            'monster_id': temp_wizard['rep_unit_id'],
+        }, )
+
+    parse_decks(deck_list, wizard, monsters)
+    parse_wizard_buildings(deco_list, wizard)
+    if 'pvp_info' in data:
+        parse_arena_records(
+            data['pvp_info'], defense_unit_list, wizard, monsters)
+    if 'homunculus_skill_list' in data:
+        parse_wizard_homunculus(
+            homunculus_skill_list, wizard, monsters)
+
+
+def parse_profile(source, data, wizard, wizard_exists, batch_size=None, progress=None):
+    """Saves items & the rest of HubUserLogin profile of already saved `wizard`.
+
+    With `progress` (ProfileIngest) it's the last step of chunked ingest, wizard's profile_tvalue
+    is moved to upload's tvalue (last_update only forward) in the same transaction as the marker is removed.
+    Without it the whole profile was saved in the current transaction: marker of interrupted chunked ingest
+    of older profile is removed, ingest of newer one starts over (rows it already saved were just overwritten).
+    """
+    fingerprints_key = f'profile_fingerprints_{wizard.id}'
+    stored_fingerprints = None
+    if settings.PROFILE_FINGERPRINTS:
+        stored_fingerprints = (cache.get(
+            fingerprints_key) or dict()) if wizard_exists else dict()
+
+    monsters_eff, fingerprints = parse_profile_items(
+        source, data, wizard, stored_fingerprints, batch_size, progress)
+
+    with transaction.atomic():
+        if fingerprints is not None:
+            logger.debug(
+                f"Profile {wizard.id}: {len(fingerprints['runes'])} runes, {len(fingerprints['artifacts'])} artifacts, {len(fingerprints['monsters'])} monsters fingerprinted")
+            transaction.on_commit(lambda: cache.set(
+                fingerprints_key, fingerprints, settings.PROFILE_FINGERPRINTS_TIMEOUT))
+
+        parse_profile_links(data, wizard, monsters_eff)
+
+        if progress is not None:
+            Wizard.objects.filter(id=wizard.id).update(last_update=Greatest('last_update', Value(
+                progress.tvalue, output_field=DateTimeField())), profile_tvalue=progress.tvalue)
+            progress.delete()
+        else:
+            ingests = ProfileIngest.objects.filter(wizard=wizard)
+            ingests.filter(tvalue__lte=wizard.profile_tvalue).delete()
+            ingests.update(chunks=0)
+
+
+def parse_profile_chunked(source, data, payload_key=None, batch_size=None):
+    """HubUserLogin ingest committed in chunks: guild & wizard, every batch of runes/artifacts/monsters, then the rest.
+
+    Progress is kept in ProfileIngest, so ingest of the same payload continues after the last committed chunk,
+    a newer payload starts over it (all writes are upserts). Readers leave out items of wizards with ProfileIngest,
+    so the new profile version is seen only after the last chunk.
+    """
+    tvalue = datetime.datetime.utcfromtimestamp(data['tvalue'])
+    with transaction.atomic():
+        wizard, wizard_exists = parse_profile_wizard(data, publish=False)
+        if wizard is None:
+            return
+        progress = ProfileIngest.objects.select_for_update().filter(wizard=wizard).first()
+        if progress is not None and payload_key and progress.payload == payload_key and progress.batch_size == batch_size:
+            logger.debug(
+                f"Profile {wizard.id}: resuming ingest after {progress.chunks} chunks")
+            progress.save(update_fields=['updated'])
+        else:
+            progress, _ = ProfileIngest.objects.update_or_create(wizard=wizard, defaults={
+                'payload': payload_key or '',
+                'tvalue': tvalue,
+                'batch_size': batch_size,
+                'chunks': 0,
+            }, )
+
+    parse_profile(source, data, wizard, wizard_exists, batch_size, progress)
+# endregion
+
+# region BATTLES
+BATTLE_COMMANDS = {
+    'BattleDungeonResult': 'dungeon',
+    'BattleDungeonResult_V2': 'dungeon',
+    'BattleDimensionHoleDungeonResult': 'dimension_hole',
+    'BattleDimensionHoleDungeonResult_v2': 'dimension_hole',
+    'BattleRiftDungeonStart': 'rift_start',  # Elemental Rift
+    'BattleRiftDungeonResult': 'rift_result',  # Elemental Rift
+    'BattleRiftOfWorldsRaidStart': 'raid_start',  # R5
+    'BattleRiftOfWorldsRaidResult': 'raid_result',  # R5
+}
+
+
+def parse_clear_time(clear_time):
+    time_str = str(clear_time)
+    _time = {
+        'hour': 0 if int(time_str[:-3]) < 3600 else math.floor(int(time_str[:-3]) / 3600),
+        'minute': 0 if int(time_str[:-3]) < 60 else math.floor(int(time_str[:-3]) / 60),
+        'second': int(time_str[:-3]) if int(time_str[:-3]) < 60 else int(time_str[:-3]) % 60,
+        'microsecond': int(time_str[-3:]) * 1000,
+    }
+    return datetime.time(_time['hour'], _time['minute'], _time['second'], _time['microsecond'])
+
+
+def get_battle_key(command, data_resp, data_req):
+    """Identifies battle upload, so retransmits of the same one can be dropped; None if it can't be identified."""
+    kind = BATTLE_COMMANDS.get(command)
+    if kind == 'dungeon':  # saved per (wizard, date)
+        wizard_id = data_resp.get('wizard_info', dict()).get('wizard_id')
+        if wizard_id is None or 'tvalue' not in data_resp:
+            return None
+        return f"{kind}:{wizard_id}:{data_resp['tvalue']}"
+    battle_key = data_resp.get(
+        'battle_key') if kind == 'rift_start' else data_req.get('battle_key')
+    if kind is None or battle_key is None:
+        return None
+    return f'{kind}:{battle_key}'
+
+
+def get_unit_ids(unit_id_list):
+    return [m['unit_id'] if not isinstance(m['unit_id'], dict) else m['unit_id']['unit_id'] for m in unit_id_list]
+
+
+# Every prepare_* function returns dict with (optional) keys:
+#   wizard - Wizard row to upsert
+#   run - run row to upsert, with 'wizard_id'
+#   monsters - monster IDs for M2M or {monster ID: slot} for monster_<slot> fields
+#   leaders - monster IDs which can be set as leader
+#   result - fields to update in existing run
+# or None if upload has nothing to save
+def prepare_dungeon_run(data_resp, data_req):
+    if 'wizard_info' not in data_resp or 'wizard_id' not in data_resp['wizard_info']:
+        return None
+    battle = {'wizard': parse_wizard(
+        data_resp['wizard_info'], data_resp['tvalue'])}
+
+    dungeon = dict()
+    dungeon['wizard_id'] = data_resp['wizard_info']['wizard_id']
+    dungeon['dungeon'] = data_req['dungeon_id']
+    dungeon['stage'] = data_req['stage_id']
+    dungeon['date'] = datetime.datetime.utcfromtimestamp(data_resp['tvalue'])
+
+    if data_resp['win_lose'] == 1:
+        dungeon['win'] = True
+        if 'clear_time' not in data_resp:
+            return battle  # HOH Dungeon
+        dungeon['clear_time'] = parse_clear_time(
+            data_resp['clear_time']['current_time'])
+    else:
+        dungeon['win'] = False
+
+    battle['run'] = dungeon
+    battle['monsters'] = get_unit_ids(data_req['unit_id_list'])
+    return battle
+
+
+def prepare_dimension_hole_run(data_resp, data_req):
+    battle = {'wizard': parse_wizard(
+        data_resp['wizard_info'], data_resp['tvalue'])}
+
+    dungeon = dict()
+    dungeon['id'] = data_req['battle_key']
+    dungeon['wizard_id'] = data_resp['wizard_info']['wizard_id']
+    dungeon['dungeon'] = data_resp['dungeon_id']
+    dungeon['stage'] = data_resp['difficulty']
+    dungeon['date'] = datetime.datetime.utcfromtimestamp(data_resp['tvalue'])
+    dungeon['practice'] = data_resp['practice_mode']
+
+    if data_resp['win_lose'] == 1:
+        dungeon['win'] = True
+        if 'clear_time' not in data_resp or not isinstance(data_resp['clear_time'], dict):
+            return battle  # Predator -_-
+        dungeon['clear_time'] = parse_clear_time(
+            data_resp['clear_time']['current_time'])
+    else:
+        dungeon['win'] = False
+
+    battle['run'] = dungeon
+    # whole info (with runes) is in response data, but by unknown reason sometimes it's a good JSON, sometimes bad
+    # good  ->  [Rune, Rune, Rune]
+    # bad   ->  instead of list of Rune objects, it has number objects { "5": Rune , "6": Rune, "7": Rune}
+    # so, using monster_id from request data, if exists in database
+    battle['monsters'] = get_unit_ids(data_req['unit_id_list'])
+    return battle
+
+
+def prepare_rift_dungeon_start(data_resp, data_req):
+    battle = {'wizard': parse_wizard(
+        data_resp['wizard_info'], data_resp['tvalue'])}
+
+    dungeon = dict()
+    dungeon['battle_key'] = data_resp['battle_key']
+    dungeon['dungeon'] = data_req['dungeon_id']
+    dungeon['date'] = datetime.datetime.utcfromtimestamp(data_resp['tvalue'])
+    dungeon['wizard_id'] = data_resp['wizard_info']['wizard_id']
+
+    battle['run'] = dungeon
+    battle['monsters'] = {
+        m['unit_id']: m['slot_index'] for m in data_req['unit_id_list']
+    }
+    battle['leaders'] = [monster_id for monster_id, slot in battle['monsters'].items(
+    ) if slot == data_req['leader_index']]
+    return battle
+
+
+def prepare_rift_dungeon_result(data_resp, data_req):
+    if 'rift_dungeon_box_id' not in data_resp:
+        return None
+
+    rift = dict()
+    rift['battle_key'] = data_req['battle_key']
+    rift['win'] = True if data_req['battle_result'] == 1 else False
+    rift['clear_rating'] = data_resp['rift_dungeon_box_id']
+
+    # need to check if always table like this
+    dmg_records = data_req['round_list']
+    rift['dmg_phase_1'] = dmg_records[0][1]
+    if len(dmg_records) > 1:
+        rift['dmg_phase_glory'] = dmg_records[1][1]
+    if len(dmg_records) > 2:
+        rift['dmg_phase_2'] = dmg_records[2][1]
+
+    return {'result': rift}
+
+
+def prepare_raid_start(data_resp, data_req):
+    if 'battle_info' not in data_resp:
+        return None
+    wizard = parse_wizard(data_resp['wizard_info'], data_resp['tvalue'])
+    wizard['id'] = data_req['wizard_id']
+    battle = {'wizard': wizard, 'monsters': dict(), 'leaders': list()}
+
+    dungeon = dict()
+    dungeon['battle_key'] = data_req['battle_key']
+    dungeon['stage'] = data_resp['battle_info']['room_info']['stage_id']
+    dungeon['date'] = datetime.datetime.utcfromtimestamp(data_resp['tvalue'])
+    dungeon['wizard_id'] = data_req['wizard_id']
+
+    for user in data_resp['battle_info']['user_list']:
+        if user['wizard_id'] == data_req['wizard_id']:
+            battle['monsters'] = {
+                m['unit_info']['unit_id']: m['index'] for m in user['deck_list']
+            }
+            battle['leaders'] = [m['unit_info']['unit_id']
+                                 for m in user['deck_list'] if m['leader']]
+
+    battle['run'] = dungeon
+    return battle
+
+
+def prepare_raid_result(data_resp, data_req):
+    raid = dict()
+    raid['battle_key'] = data_req['battle_key']
+    if data_req['win_lose'] == 1:
+        raid['win'] = True
+        raid['clear_time'] = parse_clear_time(data_req['clear_time'])
+    else:
+        raid['win'] = False
+
+    return {'result': raid}
+
+
+BATTLE_PARSERS = {
+    'dungeon': prepare_dungeon_run,
+    'dimension_hole': prepare_dimension_hole_run,
+    'rift_start': prepare_rift_dungeon_start,
+    'rift_result': prepare_rift_dungeon_result,
+    'raid_start': prepare_raid_start,
+    'raid_result': prepare_raid_result,
+}
+# result kind: start kind
+BATTLE_PAIRS = {
+    'rift_result': 'rift_start',
+    'raid_result': 'raid_start',
+}
+RIFT_DMG_PHASES = ['dmg_phase_1', 'dmg_phase_glory', 'dmg_phase_2']
+
+
+def pair_battles(prepared):
+    """Merges results with their starts (from the same batch or held by pairing), holds starts without results.
+
+    Paired starts get 'results' key, results without start are left for updating already saved runs.
+    """
+    for result_kind, start_kind in BATTLE_PAIRS.items():
+        starts = {battle['run']['battle_key']: battle for battle in prepared[start_kind]}
+        held = pairing.take_starts(start_kind, set(
+            battle['result']['battle_key'] for battle in prepared[result_kind]) - starts.keys())
+        for battle_key, (command, data_resp, data_req) in held.items():
+            battle = BATTLE_PARSERS[start_kind](data_resp, data_req)
+            if battle is not None:
+                battle.pop('wizard', None)  # saved with start upload
+                starts[battle_key] = battle
+
+        unpaired = list()
+        for battle in prepared[result_kind]:
+            if battle['result']['battle_key'] in starts:
+                starts[battle['result']['battle_key']].setdefault(
+                    'results', list()).append(battle['result'])
+            else:
+                unpaired.append(battle)
+        prepared[result_kind] = unpaired
+
+        pairing.hold_starts(start_kind, {battle_key: battle['upload'] for battle_key, battle in starts.items()
+                                         if 'results' not in battle and 'upload' in battle})
+        prepared[start_kind] = [
+            battle for battle in starts.values() if 'results' in battle]
+
+    return prepared
+
+
+def parse_battles(battles):
+    """Saves list of (command, response, request) battle uploads in bulk, later uploads win. Returns number of saved runs & results."""
+    prepared = {kind: list() for kind in BATTLE_PARSERS.keys()}
+    wizards = dict()
+    for command, data_resp, data_req in battles:
+        kind = BATTLE_COMMANDS[command]
+        battle = BATTLE_PARSERS[kind](data_resp, data_req)
+        if battle is None:
+            continue
+        if kind in BATTLE_PAIRS.values():
+            battle['upload'] = [command, data_resp, data_req]
+        if 'wizard' in battle:
+            wizard = battle['wizard']
+            wizards[wizard['id']] = {**wizards[wizard['id']], **
+                                     wizard} if wizard['id'] in wizards else wizard
+        if 'run' in battle or 'result' in battle:
+            prepared[kind].append(battle)
+
+    bulk_upsert(Wizard, list(wizards.values()))
+    if settings.BATTLE_PAIRING:
+        prepared = pair_battles(prepared)
+
+    monster_ids = set()
+    for kind_battles in prepared.values():
+        for battle in kind_battles:
+            monster_ids.update(battle.get('monsters', list()))
+    monsters = set(Monster.objects.filter(id__in=monster_ids).values_list(
+        'id', flat=True)) if monster_ids else set()
+
+    saved = 0
+    # starts before results, so result can be applied to start from the same batch
+    for kind, model in [('rift_start', RiftDungeonRun), ('raid_start', RaidDungeonRun)]:
+        runs = list()
+        complete = list()
+        for battle in prepared[kind]:
+            run = battle['run']
+            for monster_id, slot in battle['monsters'].items():
+                if monster_id in monsters:
+                    run['monster_' + str(slot) + '_id'] = monster_id
+            leaders = [monster_id for monster_id in battle['leaders']
+                       if monster_id in monsters]
+            if leaders:
+                run['leader_id'] = leaders[-1]
+            if 'results' in battle:  # paired with its result, saved at once
+                for result in battle['results']:
+                    run.update(result)
+                if model is RiftDungeonRun:
+                    run['dmg_total'] = sum(run.get(phase, 0)
+                                           for phase in RIFT_DMG_PHASES)
+                complete.append(run)
+                continue
+            if model is RiftDungeonRun:
+                run['dmg_total'] = 0  # only for new runs
+            runs.append(run)
+        saved += bulk_upsert(model, runs, update_fields=[
+                             field.name for field in model._meta.concrete_fields if field.name != 'dmg_total'])
+        saved += bulk_upsert(model, complete)
+
+    for kind, model in [('rift_result', RiftDungeonRun), ('raid_result', RaidDungeonRun)]:
+        results = dict()
+        for battle in prepared[kind]:
+            result = battle['result']
+            results[result['battle_key']] = {**results[result['battle_key']], **
+                                             result} if result['battle_key'] in results else result
+        if not results:
+            continue
+        runs = list(model.objects.filter(battle_key__in=results.keys()))
+        fields = set()
+        for run in runs:
+            for key, val in results[run.battle_key].items():
+                setattr(run, key, val)
+                fields.add(key)
+            if model is RiftDungeonRun:
+                run.dmg_total = run.dmg_phase_1 + run.dmg_phase_glory + run.dmg_phase_2
+                fields.add('dmg_total')
+        fields.discard('battle_key')
+        if runs:
+            model.objects.bulk_update(runs, list(fields), batch_size=1000)
+        saved += len(runs)
+
+    dungeons = dict()
+    for battle in prepared['dungeon']:
+        run = battle['run']
+        key = (run['wizard_id'], run['date'])
+        dungeons[key] = ({**dungeons[key][0], **run} if key in dungeons else run, [
+                         monster_id for monster_id in battle['monsters'] if monster_id in monsters])
+    if dungeons:
+        stored = dict()
+        for obj in DungeonRun.objects.filter(wizard_id__in=set(key[0] for key in dungeons.keys()), date__in=set(key[1] for key in dungeons.keys())):
+            if (obj.wizard_id, obj.date) not in stored:
+                stored[(obj.wizard_id, obj.date)] = obj
+        to_create = list()
+        to_update = list()
+        fields = set()
+        for key, (run, _) in dungeons.items():
+            if key in stored:
+                obj = stored[key]
+                for field, val in run.items():
+                    setattr(obj, field, val)
+                fields.update(run.keys())
+                to_update.append(obj)
+            else:
+                stored[key] = DungeonRun(**run)
+                to_create.append(stored[key])
+        if to_update:
+            DungeonRun.objects.bulk_update(to_update, list(
+                fields - {'wizard_id', 'date'}), batch_size=1000)
+        DungeonRun.objects.bulk_create(to_create, batch_size=1000)
+        bulk_set_m2m(DungeonRun, 'monsters', {
+                     stored[key].id: monster_ids for key, (_, monster_ids) in dungeons.items()})
+        saved += len(dungeons)
+
+    runs = dict()
+    for battle in prepared['dimension_hole']:
+        runs[battle['run']['id']] = (battle['run'], [
+            monster_id for monster_id in battle['monsters'] if monster_id in monsters])
+    if runs:
+        bulk_upsert(DimensionHoleRun, [run for run, _ in runs.values()])
+        bulk_set_m2m(DimensionHoleRun, 'monsters', {
+                     run_id: monster_ids for run_id, (_, monster_ids) in runs.items()})
+        saved += len(runs)
+
+    logger.debug(
+        f"Saved {saved} battle runs & results from {len(battles)} uploads ({len(wizards)} wizards)")
+    return saved
+# endregion
+
+# region BULK
+
+
+def bulk_upsert(model, rows, update=True, update_fields=None, batch_size=1000):
+    """INSERT ... ON CONFLICT for list of dicts shaped like update_or_create defaults.
+
+    Like update_or_create, only fields given in a row are overwritten on conflict, missing ones use model defaults on insert.
+    `update_fields` limits overwritten fields even more. Returns number of upserted rows.
+    Receivers of pre_bulk_upsert (website.signals; rollups, snapshot) get merged rows before they're written.
+    """
+    if not rows:
+        return 0
+
+    from psycopg2.extras import execute_values
+
+    pk = model._meta.pk
+    merged = dict()
+    for row in rows:
+        key = row[pk.name]
+        merged[key] = {**merged[key], **row} if key in merged else row
+    signals.pre_bulk_upsert.send(sender=model, rows=merged, update=update)
+
+    # one statement per set of given fields, rows sorted so concurrent uploads lock them in the same order
+    shapes = dict()
+    for key in sorted(merged.keys()):
+        shapes.setdefault(frozenset(merged[key].keys()), list()).append(merged[key])
+
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = model._meta.concrete_fields
+    columns = ', '.join(qn(field.column) for field in fields)
+
+    with connection.cursor() as cursor:
+        for shape, shape_rows in shapes.items():
+            values = list()
+            for row in shape_rows:
+                obj = model(**row)
+                values.append(tuple(field.get_db_prep_save(
+                    field.pre_save(obj, True), connection) for field in fields))
+
+            updates = [f'{qn(field.column)} = EXCLUDED.{qn(field.column)}' for field in fields if not field.primary_key and (
+                field.name in shape or field.attname in shape) and (update_fields is None or field.name in update_fields)]
+            sql = f'INSERT INTO {table} ({columns}) VALUES %s ON CONFLICT ({qn(pk.column)}) '
+            sql += f'DO UPDATE SET {", ".join(updates)}' if update and updates else 'DO NOTHING'
+            execute_values(cursor.cursor, sql, values, page_size=batch_size)
+
+    return len(merged)
+
+
+def bulk_set_m2m(model, field_name, links, batch_size=1000):
+    """Equivalent of calling .set() on `field_name` for every object in `links` ({object id: [related ids]}).
+
+    Reads existing through-table rows once, then removes and adds the difference in bulk.
+    """
+    if not links:
+        return 0, 0
+
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+
+    desired = {(obj_id, rel_id) for obj_id, rel_ids in links.items()
+               for rel_id in rel_ids}
+    existing = dict()
+    for pk, obj_id, rel_id in through.objects.filter(**{f'{source}__in': list(links.keys())}).values_list('pk', source, target):
+        existing[(obj_id, rel_id)] = pk
+
+    to_delete = [pk for pair, pk in existing.items() if pair not in desired]
+    to_create = [through(**{source: obj_id, target: rel_id})
+                 for obj_id, rel_id in sorted(desired - existing.keys())]
+
+    if to_delete:
+        through.objects.filter(pk__in=to_delete).delete()
+    if to_create:
+        through.objects.bulk_create(to_create, batch_size=batch_size)
+
+    return len(to_create), len(to_delete)
+
+
+def fingerprint(*parts):
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True, separators=(',', ':')).encode(), digest_size=8).hexdigest()
+
+
+def filter_changed(items, key, fingerprints, context=None):
+    """Returns items which fingerprint differs from given `fingerprints` ({id: fingerprint}) & new fingerprints for all items.
+
+    `context` is a function returning anything outside of item that has impact on parsed row (i.e. lock status).
+    """
+    changed = list()
+    current = dict()
+    for item in items:
+        if not isinstance(item, dict):
+            changed.append(item)
             continue
+        item_id = key(item)
+        current[item_id] = fingerprint(
+            item, context(item) if context else None)
+        if fingerprints.get(item_id) != current[item_id]:
+            changed.append(item)
+
+    return changed, current
 # endregion
 
 
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from website.functions import get_monster_runes, calc_efficiencies, calc_efficiencies_artifact, calc_monster_stats, calc_stats_batch
+
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compares batch monster stats calculation with the per-monster one for given HubUserLogin JSON files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', type=str)
+
+    def handle(self, *args, **options):
+        failed = 0
+        for path in options['files']:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+
+            temp_runes = [rune for rune in data.get('runes', list())
+                          if isinstance(rune, dict)]
+            temp_artifacts = list(data.get('artifacts', list()))
+            for temp_monster in data['unit_list']:
+                temp_runes += get_monster_runes(temp_monster)
+                temp_artifacts += temp_monster.get('artifacts', list())
+
+            efficiencies, _ = calc_efficiencies(temp_runes)
+            runes = {rune['rune_id']: {'id': rune['rune_id'], 'slot': rune['slot_no'], 'efficiency': efficiency}
+                     for rune, efficiency in zip(temp_runes, efficiencies.tolist())}
+            efficiencies, _ = calc_efficiencies_artifact(temp_artifacts)
+            artifacts = {artifact['rid']: {'id': artifact['rid'], 'efficiency': efficiency}
+                         for artifact, efficiency in zip(temp_artifacts, efficiencies.tolist())}
+
+            start = time.time()
+            expected = [calc_monster_stats(temp_monster, runes, artifacts)
+                        for temp_monster in data['unit_list']]
+            scalar_time = time.time() - start
+            start = time.time()
+            calculated = calc_stats_batch(data['unit_list'], runes, artifacts)
+            batch_time = time.time() - start
+
+            mismatches = 0
+            for temp_monster, monster_expected, monster_calculated in zip(data['unit_list'], expected, calculated):
+                if monster_expected != monster_calculated or any(type(monster_expected[key]) != type(monster_calculated[key]) for key in monster_expected):
+                    mismatches += 1
+                    self.stdout.write(self.style.ERROR(
+                        f"\t[{temp_monster['unit_id']}] {monster_expected} != {monster_calculated}"))
+
+            failed += mismatches
+            self.stdout.write(
+                f"{path}: {len(data['unit_list'])} monsters, {mismatches} mismatches ({round(scalar_time, 4)}s -> {round(batch_time, 4)}s)")
+
+        if failed:
+            self.stdout.write(self.style.ERROR(f'{failed} mismatches!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Done!'))
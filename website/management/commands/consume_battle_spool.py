@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from website import spool
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Saves spooled battle results (UPLOAD_SPOOL) in micro-batches, runs until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.UPLOAD_SPOOL_BATCH_SIZE)
+        parser.add_argument('--batch-ms', type=int,
+                            default=settings.UPLOAD_SPOOL_BATCH_MS)
+        parser.add_argument('--once', action='store_true',
+                            help='Flush a single batch and exit')
+
+    def handle(self, *args, **options):
+        if not settings.UPLOAD_SPOOL:
+            self.stdout.write(self.style.ERROR(
+                'UPLOAD_SPOOL is disabled, nothing to consume'))
+            return
+
+        while True:
+            start = time.time()
+            count = spool.flush(options['batch_size'], options['batch_ms'])
+            if count:
+                self.stdout.write(
+                    f'Saved {count} battles in {round(time.time() - start, 4)} seconds')
+            if options['once']:
+                break
+
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from website import snapshot
+
+
+class Command(BaseCommand):
+    help = 'Exports rune & monster analytical columns to SNAPSHOT_DIR (has to be run once after enabling SNAPSHOT)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Export only rows saved or deleted since last export')
+
+    def handle(self, *args, **options):
+        for name, rows in snapshot.export_snapshot(not options['incremental']).items():
+            if rows is None:
+                self.stdout.write(f'{name}: skipped, already being exported')
+            else:
+                self.stdout.write(f'{name}: {rows} rows')
+        self.stdout.write(self.style.SUCCESS('Done!'))
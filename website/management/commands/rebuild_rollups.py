@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from website import rollups, sketches
+
+
+class Command(BaseCommand):
+    help = 'Recounts rune, artifact & monster rollups and monster stat buckets from scratch (has to be run once after enabling ROLLUPS)'
+
+    def handle(self, *args, **options):
+        for name, rows in rollups.rebuild_rollups().items():
+            self.stdout.write(f'{name}: {rows} rows')
+        self.stdout.write(
+            f'MonsterStatBucket: {sketches.rebuild_sketches()} rows')
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from website import metrics
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Shows upload counters (uploads per command, collapsed profile uploads, duplicated battles, etc.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Show per-second rates measured over given number of seconds')
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset all counters after showing them')
+
+    def handle(self, *args, **options):
+        counters = metrics.get_counters()
+        if options['interval']:
+            time.sleep(options['interval'])
+            current = metrics.get_counters()
+            for name in sorted(current):
+                rate = (current[name] - counters.get(name, 0)) / \
+                    options['interval']
+                self.stdout.write(
+                    f'{name}: {current[name]} ({round(rate, 2)}/s)')
+        else:
+            for name in sorted(counters):
+                self.stdout.write(f'{name}: {counters[name]}')
+
+        if counters.get('battles.seen'):
+            self.stdout.write(
+                f"Battle duplicate rate: {round(100 * counters.get('battles.duplicate', 0) / counters['battles.seen'], 2)}%")
+
+        if options['reset']:
+            metrics.reset_counters()
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,26 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upload counters shared by web & workers, see `python manage.py upload_stats`
+KEY = 'swstats:metrics'
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def incr_counter(name, amount=1):
+    try:
+        _redis().hincrby(KEY, name, amount)
+    except Exception as e:  # metrics should never break an upload
+        logger.warning(f"Couldn't increment counter {name}: {e}")
+
+
+def get_counters():
+    return {name.decode('utf-8'): int(value) for name, value in _redis().hgetall(KEY).items()}
+
+
+def reset_counters():
+    _redis().delete(KEY)
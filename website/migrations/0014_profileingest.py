@@ -0,0 +1,25 @@
+# Generated by Django 3.1.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0013_auto_20201227_1547'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileIngest',
+            fields=[
+                ('wizard', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='website.wizard')),
+                ('payload', models.CharField(blank=True, max_length=64)),
+                ('tvalue', models.DateTimeField()),
+                ('batch_size', models.IntegerField()),
+                ('chunks', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.1.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0014_profileingest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtifactRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rtype', models.SmallIntegerField()),
+                ('attribute', models.SmallIntegerField()),
+                ('archetype', models.SmallIntegerField()),
+                ('quality', models.SmallIntegerField()),
+                ('quality_original', models.SmallIntegerField()),
+                ('primary', models.SmallIntegerField()),
+                ('level', models.SmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('rtype', 'attribute', 'archetype', 'quality', 'quality_original', 'primary', 'level')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonsterRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stars', models.SmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('base_monster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.monsterbase')),
+            ],
+            options={
+                'unique_together': {('base_monster', 'stars')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RuneRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.SmallIntegerField()),
+                ('stars', models.SmallIntegerField()),
+                ('quality', models.SmallIntegerField()),
+                ('quality_original', models.SmallIntegerField()),
+                ('primary', models.SmallIntegerField()),
+                ('upgrade_curr', models.SmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('rune_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.runeset')),
+            ],
+            options={
+                'unique_together': {('rune_set', 'slot', 'stars', 'quality', 'quality_original', 'primary', 'upgrade_curr')},
+            },
+        ),
+    ]
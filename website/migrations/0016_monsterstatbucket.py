@@ -0,0 +1,30 @@
+# Generated by Django 3.1.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0015_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonsterStatBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stars', models.SmallIntegerField()),
+                ('stat', models.CharField(max_length=20)),
+                ('bucket', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_sq', models.FloatField(default=0)),
+                ('base_monster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.monsterbase')),
+            ],
+            options={
+                'unique_together': {('base_monster', 'stars', 'stat', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0016_monsterstatbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wizard',
+            name='profile_tvalue',
+            field=models.DateTimeField(blank=True, null=True, default=None),
+        ),
+    ]
@@ -124,11 +124,33 @@ class Wizard(models.Model):
     guild = models.ForeignKey(
         Guild, blank=True, null=True, on_delete=models.SET_NULL)
     last_update = models.DateTimeField()
+    # tvalue of last fully saved HubUserLogin, written only by profile ingest (battles move last_update as well)
+    profile_tvalue = models.DateTimeField(blank=True, null=True, default=None)
 
     def __str__(self):
         return str(self.id)
 
 
+class ProfileIngest(models.Model):
+    """HubUserLogin ingest committed in chunks (PROFILE_CHUNKED), exists until profile is fully saved.
+
+    It's removed as well when newer profile is saved at once or its payload expired before ingest was resumed.
+
+    Wizard's profile_tvalue is moved to upload's tvalue only in the last chunk, together with deleting this marker;
+    until then readers (tables, dashboards, reports, comparison) leave out wizard's runes, artifacts & monsters.
+    """
+    wizard = models.OneToOneField(
+        Wizard, on_delete=models.CASCADE, primary_key=True)
+    payload = models.CharField(max_length=64, blank=True)  # payload store key
+    tvalue = models.DateTimeField()
+    batch_size = models.IntegerField()  # items per chunk, resumed ingest has to cut payload the same way
+    chunks = models.IntegerField(default=0)  # committed runes/artifacts/monsters batches
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.wizard_id) + ' (' + str(self.chunks) + ' chunks)'
+
+
 class RuneSet(models.Model):
     id = models.IntegerField(primary_key=True, unique=True)
     name = models.CharField(max_length=30)
@@ -1528,3 +1550,58 @@ class DimensionHoleRun(models.Model):
         filters['win'] = [0, 0]
 
         return filters
+
+
+# Rollups: row counts of the biggest tables per combination of dashboard dimensions, kept up-to-date by ingest
+# (website.rollups) and rebuilt by `python manage.py rebuild_rollups`. NULL dimensions are stored as 0.
+class RuneRollup(models.Model):
+    rune_set = models.ForeignKey(RuneSet, on_delete=models.CASCADE)
+    slot = models.SmallIntegerField()
+    stars = models.SmallIntegerField()
+    quality = models.SmallIntegerField()
+    quality_original = models.SmallIntegerField()
+    primary = models.SmallIntegerField()
+    upgrade_curr = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['rune_set', 'slot', 'stars', 'quality',
+                           'quality_original', 'primary', 'upgrade_curr']
+
+
+class ArtifactRollup(models.Model):
+    rtype = models.SmallIntegerField()
+    attribute = models.SmallIntegerField()
+    archetype = models.SmallIntegerField()
+    quality = models.SmallIntegerField()
+    quality_original = models.SmallIntegerField()
+    primary = models.SmallIntegerField()
+    level = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['rtype', 'attribute', 'archetype', 'quality',
+                           'quality_original', 'primary', 'level']
+
+
+class MonsterRollup(models.Model):
+    base_monster = models.ForeignKey(MonsterBase, on_delete=models.CASCADE)
+    stars = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['base_monster', 'stars']
+
+
+class MonsterStatBucket(models.Model):
+    """Log-bucketed histogram (DDSketch) of monster stat per base monster & stars, see website.sketches."""
+    base_monster = models.ForeignKey(MonsterBase, on_delete=models.CASCADE)
+    stars = models.SmallIntegerField()
+    stat = models.CharField(max_length=20)
+    bucket = models.IntegerField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)  # sum of values, for exact average
+    total_sq = models.FloatField(default=0)  # sum of squared values, for exact std
+
+    class Meta:
+        unique_together = ['base_monster', 'stars', 'stat', 'bucket']
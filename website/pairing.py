@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import transaction
+
+from . import metrics
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Raid & rift start uploads wait here (for BATTLE_PAIRING_TTL seconds) for their results,
+# so only one complete RaidDungeonRun/RiftDungeonRun row is written. Unmatched starts just expire.
+KEY_PREFIX = 'swstats:pair:'
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def _key(kind, battle_key):
+    return f'{KEY_PREFIX}{kind}:{battle_key}'
+
+
+def hold_starts(kind, uploads):
+    """Stores {battle_key: [command, response, request]} start uploads until their results arrive."""
+    if not uploads:
+        return
+    pipe = _redis().pipeline()
+    for battle_key, upload in uploads.items():
+        pipe.set(_key(kind, battle_key), json.dumps(
+            upload, separators=(',', ':')), ex=settings.BATTLE_PAIRING_TTL)
+    pipe.execute()
+    metrics.incr_counter('battles.held', len(uploads))
+
+
+def take_starts(kind, battle_keys):
+    """Held start uploads of given battles, removed from store once current transaction is committed."""
+    battle_keys = list(battle_keys)
+    if not battle_keys:
+        return dict()
+    keys = [_key(kind, battle_key) for battle_key in battle_keys]
+    found = {battle_key: json.loads(value) for battle_key, value in zip(
+        battle_keys, _redis().mget(keys)) if value is not None}
+    if found:
+        taken = [_key(kind, battle_key) for battle_key in found.keys()]
+        transaction.on_commit(lambda: _redis().delete(*taken))
+        metrics.incr_counter('battles.paired', len(found))
+    return found
@@ -0,0 +1,102 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
+
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd bodies are rejected with 415 then
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+IDENTITY = ['', 'identity']
+ZLIB_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+DECOMPRESS_ERRORS = (zlib.error, EOFError) + \
+    ((zstandard.ZstdError, ) if zstandard is not None else tuple())
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body is too large.'
+    default_code = 'payload_too_large'
+
+
+def _iter_stream(stream):
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_zlib(stream, wbits):
+    decompressor = zlib.decompressobj(wbits)
+    for chunk in _iter_stream(stream):
+        # max_length keeps memory bounded even for highly compressed chunks
+        data = decompressor.decompress(chunk, CHUNK_SIZE)
+        yield data
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE)
+        if decompressor.eof:
+            break
+    yield decompressor.flush()
+
+
+def _iter_zstd(stream):
+    reader = zstandard.ZstdDecompressor().stream_reader(stream)
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_body(stream, encoding=None, max_size=None):
+    """Reads (and decompresses, according to Content-Encoding) request body, up to `max_size` bytes after decompression."""
+    encoding = (encoding or '').strip().lower()
+    max_size = max_size or settings.UPLOAD_MAX_DECOMPRESSED_SIZE
+    if stream is None:
+        return b''
+
+    if encoding in IDENTITY:
+        chunks = _iter_stream(stream)
+    elif encoding in ZLIB_WBITS:
+        chunks = _iter_zlib(stream, ZLIB_WBITS[encoding])
+    elif encoding == 'zstd' and zstandard is not None:
+        chunks = _iter_zstd(stream)
+    else:
+        raise UnsupportedMediaType(
+            encoding, detail=f'Unsupported Content-Encoding "{encoding}".')
+
+    body = bytearray()
+    try:
+        for chunk in chunks:
+            body += chunk
+            if len(body) > max_size:
+                raise PayloadTooLarge()
+    except DECOMPRESS_ERRORS as e:
+        raise ParseError(f'Invalid {encoding} body - {e}')
+
+    return bytes(body)
+
+
+class CompressedJSONParser(JSONParser):
+    """JSON parser which accepts `Content-Encoding: gzip/deflate/zstd` bodies (SWEX uploads)."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context['request'].META.get(
+            'HTTP_CONTENT_ENCODING') if 'request' in parser_context else None
+        charset = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            return json.loads(read_body(stream, encoding).decode(charset))
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
@@ -0,0 +1,188 @@
+from django.conf import settings
+
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Upload payloads (HubUserLogin, VisitFriend) are stored compressed under their content hash,
+# so Celery messages contain only the key. Identical payloads are stored once.
+KEY_PREFIX = 'swstats:payload:'
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def _path(key):
+    return os.path.join(settings.PAYLOAD_STORE_DIR, key[:2], key + '.json.z')
+
+
+def store_payload(data=None, raw=None):
+    """Stores JSON-serializable `data` (or already serialized `raw` bytes), returns its key."""
+    if raw is None:
+        raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    key = hashlib.blake2b(raw, digest_size=20).hexdigest()
+
+    if settings.PAYLOAD_STORE == 'disk':
+        path = _path(key)
+        if os.path.exists(path):
+            os.utime(path)  # extends TTL
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(raw, 6))
+        os.replace(tmp_path, path)
+        return key
+
+    conn = _redis()
+    if not conn.set(KEY_PREFIX + key, zlib.compress(raw, 6), ex=settings.PAYLOAD_STORE_TTL, nx=True):
+        conn.expire(KEY_PREFIX + key, settings.PAYLOAD_STORE_TTL)
+    return key
+
+
+def load_payload_raw(key):
+    if settings.PAYLOAD_STORE == 'disk':
+        try:
+            with open(_path(key), 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            blob = None
+    else:
+        blob = _redis().get(KEY_PREFIX + key)
+
+    if blob is None:
+        raise KeyError(f"Payload {key} does not exist or has expired")
+    return zlib.decompress(blob)
+
+
+def payload_exists(key):
+    if settings.PAYLOAD_STORE == 'disk':
+        return os.path.exists(_path(key))
+    return bool(_redis().exists(KEY_PREFIX + key))
+
+
+def load_payload(key):
+    return json.loads(load_payload_raw(key))
+
+
+def open_payload(key, chunk_size=64 * 1024):
+    """File-like object with decompressed payload, decompressed while being read."""
+    if settings.PAYLOAD_STORE == 'disk':
+        try:
+            f = open(_path(key), 'rb')
+        except FileNotFoundError:
+            raise KeyError(f"Payload {key} does not exist or has expired")
+    else:
+        blob = _redis().get(KEY_PREFIX + key)
+        if blob is None:
+            raise KeyError(f"Payload {key} does not exist or has expired")
+        f = io.BytesIO(blob)
+
+    return io.BufferedReader(_ZlibReader(f, chunk_size), buffer_size=chunk_size)
+
+
+class _ZlibReader(io.RawIOBase):
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj()
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and not self.decompressor.eof:
+            chunk = self.f.read(self.chunk_size)
+            if not chunk:
+                self.buffer = self.decompressor.flush()
+                break
+            self.buffer = self.decompressor.decompress(chunk)
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def iter_payload(key, items=(), skip=(), values=True):
+    """Streams top-level object of stored payload without loading it whole.
+
+    Yields (name, item) for every item of `items` arrays and, if `values`,
+    (name, value) for all other top-level keys except `skip` ones.
+    """
+    import ijson
+    from ijson.common import ObjectBuilder
+
+    name, current, builder = None, None, None
+    with open_payload(key) as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == current and event in ['end_map', 'end_array']:
+                    yield name, builder.value
+                    builder = None
+                continue
+
+            if prefix == '':
+                if event == 'map_key':
+                    name = value
+                continue
+            if name in skip:
+                continue
+            if name in items:
+                if prefix != name + '.item':  # array itself
+                    continue
+            elif not values:
+                continue
+
+            if event in ['start_map', 'start_array']:
+                current = prefix
+                builder = ObjectBuilder()
+                builder.event(event, value)
+            else:
+                yield name, value
+
+
+def get_payload_value(key, path):
+    """Single value from stored payload (i.e. `wizard_info.wizard_id`), stops reading as soon as it's found."""
+    import ijson
+
+    with open_payload(key) as f:
+        for value in ijson.items(f, path, use_float=True):
+            return value
+    raise KeyError(f"Payload {key} has no {path}")
+
+
+def resolve_payload(data):
+    """Tasks accept both payload key and payload itself (messages queued before payload store)."""
+    return load_payload(data) if isinstance(data, str) else data
+
+
+def purge_payloads():
+    """Removes expired payloads from disk store, Redis expires them by itself."""
+    if settings.PAYLOAD_STORE != 'disk':
+        return 0
+    removed = 0
+    expired = time.time() - settings.PAYLOAD_STORE_TTL
+    for path in glob.glob(os.path.join(settings.PAYLOAD_STORE_DIR, '*', '*.json.z')):
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    logger.debug(f"Removed {removed} expired payloads")
+    return removed
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+
+from .models import MonsterBase, MonsterSource, RuneSet, Building, HomunculusBuild
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Static game data used while parsing uploads, loaded lazily once per worker process.
+# Version is shared through cache, so every *UploadViewSet which changes those tables
+# makes all workers reload them on their next `refresh()`.
+VERSION_KEY = 'references_version'
+
+_references = {'version': None}
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def refresh():
+    """Drops process-local data if it's outdated, called once per task."""
+    version = cache.get(VERSION_KEY, 0)
+    if version != _references['version']:
+        if _references['version'] is not None:
+            logger.debug(
+                f"Reference data changed ({_references['version']} -> {version}), reloading")
+        _references.clear()
+        _references['version'] = version
+
+
+def _get(name, loader):
+    if name not in _references:
+        _references[name] = loader()
+    return _references[name]
+
+
+def _get_one(name, loader, model, key, **lookup):
+    items = _get(name, loader)
+    if key not in items:
+        # added after references were loaded, but cache wasn't invalidated (i.e. directly through DB)
+        items[key] = model.objects.get(**lookup)
+    return items[key]
+
+
+def get_rune_sets():
+    return _get('rune_sets', lambda: {rs.id: rs for rs in RuneSet.objects.all()})
+
+
+def get_rune_set(rune_set_id):
+    return _get_one('rune_sets', lambda: {rs.id: rs for rs in RuneSet.objects.all()}, RuneSet, rune_set_id, id=rune_set_id)
+
+
+def get_monster_base(monster_base_id):
+    return _get_one('monster_bases', lambda: {mb.id: mb for mb in MonsterBase.objects.all()}, MonsterBase, monster_base_id, id=monster_base_id)
+
+
+def get_monster_source(monster_source_id):
+    return _get_one('monster_sources', lambda: {ms.id: ms for ms in MonsterSource.objects.all()}, MonsterSource, monster_source_id, id=monster_source_id)
+
+
+def get_buildings():
+    return _get('buildings', lambda: {b.id: b for b in Building.objects.all()})
+
+
+def get_homunculus_build(depth_1, depth_2, depth_3, depth_4, depth_5):
+    depths = (depth_1, depth_2, depth_3, depth_4, depth_5)
+    return _get_one('homunculus_builds', lambda: {
+        (hb.depth_1_id, hb.depth_2_id, hb.depth_3_id, hb.depth_4_id, hb.depth_5_id): hb for hb in HomunculusBuild.objects.all()
+    }, HomunculusBuild, depths, depth_1=depth_1, depth_2=depth_2, depth_3=depth_3, depth_4=depth_4, depth_5=depth_5)
@@ -0,0 +1,184 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+from .models import Rune, Artifact, Monster, RuneRollup, ArtifactRollup, MonsterRollup
+from . import signals
+
+from collections import Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rows are keyed by dimension values, NULL dimension (e.g. rune w/o set) is counted as 0 - both by deltas (_key)
+# and by rebuild (COALESCE), so rollups can be filtered like source tables except for `__isnull`.
+# Deltas are applied after ingest commits, so a rebuild can count rows of a transaction whose delta isn't applied yet.
+# Rebuild & delta application are serialized by advisory lock of rollup table and rebuild leaves the snapshot it read
+# source table with in Redis, so deltas of transactions it already counted are skipped (see rebuild_table).
+# Rollups count every saved row, also items of wizards with chunked ingest in progress (ProfileIngest) which
+# tables leave out, so counts read from them are approximate, same as planner's estimate in count_rows.
+KEY_PREFIX = 'swstats:rollups:'
+REBUILDS_KEPT = 5
+
+# model: (rollup model, dimension fields - same names in both models)
+ROLLUPS = {
+    Rune: (RuneRollup, ['rune_set', 'slot', 'stars', 'quality', 'quality_original', 'primary', 'upgrade_curr']),
+    Artifact: (ArtifactRollup, ['rtype', 'attribute', 'archetype', 'quality', 'quality_original', 'primary', 'level']),
+    Monster: (MonsterRollup, ['base_monster', 'stars']),
+}
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def _rebuilds_key(table):
+    return f'{KEY_PREFIX}rebuilds:{table}'
+
+
+def current_txid():
+    """ID of current (ingest) transaction, its deltas are checked against rebuild snapshots by execute_deltas."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT txid_current()')
+        return cursor.fetchone()[0]
+
+
+def execute_deltas(rollup, txid, sql, values):
+    """Adds deltas of committed transaction `txid` to `rollup` table (execute_values of `sql`), returns False if skipped.
+
+    Deltas are skipped if one of last rebuilds of the table has already counted rows of that transaction.
+    """
+    from psycopg2.extras import execute_values
+
+    table = rollup._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock_shared(hashtext(%s))', [table])
+        # read under the lock, rebuild leaves its snapshot before it commits
+        rebuilds = [marker.decode('utf-8').split(' ')
+                    for marker in _redis().lrange(_rebuilds_key(table), 0, -1)]
+        if rebuilds:
+            cursor.execute(
+                "SELECT COALESCE(BOOL_OR(txid_visible_in_snapshot(%s, snapshot::txid_snapshot) AND txid_status(txid) = 'committed'), FALSE) "
+                "FROM UNNEST(%s::bigint[], %s::text[]) AS rebuild(txid, snapshot)",
+                [txid, [int(rebuild_txid) for rebuild_txid, _ in rebuilds], [snapshot for _, snapshot in rebuilds]])
+            if cursor.fetchone()[0]:
+                logger.debug(
+                    f"Deltas of transaction {txid} skipped, already counted by rebuild of {rollup.__name__}")
+                return False
+        execute_values(cursor.cursor, sql, values)
+    return True
+
+
+def rebuild_table(rollup, sql, params=None):
+    """Replaces all rows of `rollup` table with the ones inserted by `sql` (INSERT ... SELECT), returns number of rows.
+
+    Holds exclusive advisory lock of the table, so no deltas are applied meanwhile, and leaves snapshot of the INSERT
+    (and ID of rebuild transaction, so aborted rebuild is ignored) for execute_deltas.
+    """
+    table = rollup._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [table])
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(table)}')
+        # one statement, so the snapshot is the one source table was read with
+        cursor.execute(
+            f'WITH rebuilt AS ({sql} RETURNING 1) SELECT txid_current(), txid_current_snapshot()::text, (SELECT COUNT(*) FROM rebuilt)', params)
+        txid, snapshot, rows = cursor.fetchone()
+        pipe = _redis().pipeline()
+        pipe.lpush(_rebuilds_key(table), f'{txid} {snapshot}')
+        pipe.ltrim(_rebuilds_key(table), 0, REBUILDS_KEPT - 1)
+        pipe.execute()
+    return rows
+
+
+def _dimensions(model, rollup=False):
+    """Dimension fields of source model (or of its rollup)."""
+    return [(ROLLUPS[model][0] if rollup else model)._meta.get_field(name) for name in ROLLUPS[model][1]]
+
+
+def _key(values):
+    return tuple(0 if value is None else value for value in values)
+
+
+def get_dimensions(model, ids):
+    """{id: dimension values} of stored rows."""
+    attnames = [field.attname for field in _dimensions(model)]
+    return {row[0]: _key(row[1:]) for row in model.objects.filter(pk__in=list(ids)).values_list('pk', *attnames)}
+
+
+def track_upsert(model, rows, update=True):
+    """Rollup deltas of rows ({pk: row dict}) about to be saved by bulk_upsert, applied once transaction commits."""
+    if not settings.ROLLUPS or model not in ROLLUPS or not rows:
+        return
+    fields = _dimensions(model)
+    stored = get_dimensions(model, rows.keys())
+    deltas = Counter()
+    for pk, row in rows.items():
+        old = stored.get(pk)
+        if old is not None and not update:
+            continue
+        obj = model(**row)
+        new = _key(getattr(obj, field.attname) if field.name in row or field.attname in row or old is None else old[i]
+                   for i, field in enumerate(fields))
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] -= 1
+        deltas[new] += 1
+    schedule(model, deltas)
+
+
+def track_delete(model, ids):
+    """Rollup deltas of rows about to be deleted, applied once transaction commits."""
+    if not settings.ROLLUPS or model not in ROLLUPS or not ids:
+        return
+    schedule(model, Counter({key: -count for key, count in Counter(
+        get_dimensions(model, ids).values()).items()}))
+
+
+@receiver(signals.pre_bulk_upsert)
+def on_bulk_upsert(sender, rows, update=True, **kwargs):
+    track_upsert(sender, rows, update)
+
+
+@receiver(signals.pre_bulk_delete)
+def on_bulk_delete(sender, ids, **kwargs):
+    track_delete(sender, ids)
+
+
+def schedule(model, deltas):
+    # applied outside of ingest transaction, so concurrent uploads don't wait for each other on rollup rows
+    deltas = {key: count for key, count in deltas.items() if count}
+    if deltas:
+        txid = current_txid()
+        transaction.on_commit(lambda: apply_deltas(model, deltas, txid))
+
+
+def apply_deltas(model, deltas, txid):
+    rollup = ROLLUPS[model][0]
+    qn = connection.ops.quote_name
+    table = qn(rollup._meta.db_table)
+    columns = [qn(field.column) for field in _dimensions(model, True)]
+    # sorted, so concurrent updates lock rollup rows in the same order
+    values = [key + (count,) for key, count in sorted(deltas.items())]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}, {qn('count')}) VALUES %s ON CONFLICT ({', '.join(columns)}) "
+    sql += f"DO UPDATE SET {qn('count')} = {table}.{qn('count')} + EXCLUDED.{qn('count')}"
+    try:
+        execute_deltas(rollup, txid, sql, values)
+    except Exception as e:  # rollups can be rebuilt, they should never break an upload
+        logger.warning(f"Couldn't update {rollup.__name__}: {e}")
+
+
+def rebuild_rollups():
+    """Recounts all rollups from source tables, returns {rollup name: number of rows}."""
+    qn = connection.ops.quote_name
+    rebuilt = dict()
+    for model, (rollup, _) in ROLLUPS.items():
+        columns = [qn(field.column) for field in _dimensions(model, True)]
+        source = ', '.join(f'COALESCE({qn(field.column)}, 0)' for field in _dimensions(model))
+        rebuilt[rollup.__name__] = rebuild_table(
+            rollup,
+            f"INSERT INTO {qn(rollup._meta.db_table)} ({', '.join(columns)}, {qn('count')}) "
+            f"SELECT {source}, COUNT(*) FROM {qn(model._meta.db_table)} GROUP BY {', '.join(str(i + 1) for i in range(len(columns)))}")
+    return rebuilt
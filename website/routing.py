@@ -0,0 +1,38 @@
+from django.conf import settings
+
+# Wizard-scoped upload tasks go to one of INGEST_SHARDS queues (ingest.0, ingest.1, ...) chosen by wizard ID,
+# every queue is consumed by a single worker process, so uploads of the same wizard never run concurrently.
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach), adding a shard moves only 1/n of the keys."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def get_ingest_queue(wizard_id):
+    """Queue for tasks of given wizard, None (default queue) if sharding is disabled."""
+    if not settings.INGEST_SHARDS or wizard_id is None:
+        return None
+    return f'{settings.INGEST_QUEUE_PREFIX}{jump_hash(int(wizard_id), settings.INGEST_SHARDS)}'
+
+
+def get_upload_wizard_id(data):
+    """Wizard whose rows are changed by SWEX upload."""
+    if data['command'] == 'HubUserLogin':
+        return data.get('wizard_info', dict()).get('wizard_id')
+    if data['command'] == 'VisitFriend':
+        return data.get('friend', dict()).get('wizard_id')
+    if data['command'] == 'GetLobbyWizardLog':
+        return data.get('request', dict()).get('target_wizard_id')
+    return data.get('request', dict()).get('wizard_id')
+
+
+def send_ingest(task, wizard_id, *args, queue=None, priority=None):
+    """Sends task to ingest queue of given wizard, `queue` is used if sharding is disabled."""
+    return task.apply_async(args, queue=get_ingest_queue(wizard_id) or queue, priority=priority)
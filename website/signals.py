@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent by website.functions.bulk_upsert before rows are written, so receivers can still read stored versions.
+# Arguments: sender (model), rows ({pk: merged row dict}), update (False if existing rows are left untouched).
+pre_bulk_upsert = Signal()
+
+# Sent before rows are deleted by ingest (e.g. reconcile_profile_items). Arguments: sender (model), ids.
+pre_bulk_delete = Signal()
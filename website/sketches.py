@@ -0,0 +1,180 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+from .models import Monster, MonsterStatBucket
+from . import rollups, signals
+
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# DDSketch: every positive value goes to bucket i, where GAMMA^(i-1) < value <= GAMMA^i, and is represented
+# by 2 * GAMMA^i / (GAMMA + 1), so min, max & percentiles read from buckets are within RELATIVE_ACCURACY
+# of the exact value (i.e. 1%). Zero & negative values share ZERO_BUCKET (represented by 0). Sums & sums of squares
+# are kept per bucket, so average & std are exact. Buckets of different base monsters/stars merge by adding counts.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+ZERO_BUCKET = -1000000
+
+MONSTER_STATS = ['hp', 'attack', 'defense', 'speed', 'res',
+                 'acc', 'crit_rate', 'crit_dmg', 'avg_eff_total', 'eff_hp']
+SUMMARY = ['avg', 'stddev', 'min', 'perc25', 'median', 'perc75', 'max']
+
+
+def get_bucket(value):
+    if value <= 0:
+        return ZERO_BUCKET
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+def get_bucket_value(bucket):
+    if bucket == ZERO_BUCKET:
+        return 0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def _fields():
+    return [Monster._meta.get_field(name) for name in ['base_monster', 'stars'] + MONSTER_STATS]
+
+
+def _attnames():
+    return [field.attname for field in _fields()]
+
+
+def track_upsert(model, rows, update=True):
+    """Stat bucket deltas of monsters ({pk: row dict}) about to be saved by bulk_upsert, applied once transaction commits."""
+    if not settings.ROLLUPS or model is not Monster or not rows:
+        return
+    stored = {row[0]: row[1:] for row in Monster.objects.filter(
+        pk__in=list(rows.keys())).values_list('pk', *_attnames())}
+    deltas = dict()
+    for pk, row in rows.items():
+        old = stored.get(pk)
+        if old is not None and not update:
+            continue
+        obj = Monster(**row)
+        # prepared like bulk_upsert saves them, e.g. eff_hp is cut to int
+        new = tuple(field.get_prep_value(getattr(obj, field.attname)) if field.name in row or field.attname in row or old is None else old[i]
+                    for i, field in enumerate(_fields()))
+        if old == new:
+            continue
+        if old is not None:
+            _add(deltas, old, -1)
+        _add(deltas, new, 1)
+    schedule(deltas)
+
+
+def track_delete(model, ids):
+    """Stat bucket deltas of monsters about to be deleted, applied once transaction commits."""
+    if not settings.ROLLUPS or model is not Monster or not ids:
+        return
+    deltas = dict()
+    for values in Monster.objects.filter(pk__in=list(ids)).values_list(*_attnames()):
+        _add(deltas, values, -1)
+    schedule(deltas)
+
+
+@receiver(signals.pre_bulk_upsert)
+def on_bulk_upsert(sender, rows, update=True, **kwargs):
+    track_upsert(sender, rows, update)
+
+
+@receiver(signals.pre_bulk_delete)
+def on_bulk_delete(sender, ids, **kwargs):
+    track_delete(sender, ids)
+
+
+def _add(deltas, values, sign):
+    base_monster_id, stars = values[:2]
+    for stat, value in zip(MONSTER_STATS, values[2:]):
+        if value is None:
+            continue
+        delta = deltas.setdefault(
+            (base_monster_id, stars, stat, get_bucket(value)), [0, 0, 0])
+        delta[0] += sign
+        delta[1] += sign * value
+        delta[2] += sign * value * value
+
+
+def schedule(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta[0]}
+    if deltas:
+        txid = rollups.current_txid()
+        transaction.on_commit(lambda: apply_deltas(deltas, txid))
+
+
+def apply_deltas(deltas, txid):
+    qn = connection.ops.quote_name
+    table = qn(MonsterStatBucket._meta.db_table)
+    # sorted, so concurrent updates lock bucket rows in the same order
+    values = [key + tuple(delta) for key, delta in sorted(deltas.items())]
+    sql = f"INSERT INTO {table} (base_monster_id, stars, stat, bucket, {qn('count')}, total, total_sq) VALUES %s "
+    sql += "ON CONFLICT (base_monster_id, stars, stat, bucket) DO UPDATE SET "
+    sql += ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}'
+                     for column in [qn('count'), 'total', 'total_sq'])
+    try:
+        rollups.execute_deltas(MonsterStatBucket, txid, sql, values)
+    except Exception as e:  # sketches can be rebuilt, they should never break an upload
+        logger.warning(f"Couldn't update monster stat buckets: {e}")
+
+
+def rebuild_sketches():
+    """Recounts all monster stat buckets in one scan of monsters (serialized with deltas like rollups), returns number of rows."""
+    qn = connection.ops.quote_name
+    table = qn(MonsterStatBucket._meta.db_table)
+    stats = ', '.join(
+        f"('{stat}', m.{qn(stat)}::float8)" for stat in MONSTER_STATS)
+    return rollups.rebuild_table(
+        MonsterStatBucket,
+        f"INSERT INTO {table} (base_monster_id, stars, stat, bucket, {qn('count')}, total, total_sq) "
+        f"SELECT m.base_monster_id, m.stars, s.stat, CASE WHEN s.value > 0 THEN CEIL(LN(s.value) / %s)::int ELSE %s END, "
+        f"COUNT(*), SUM(s.value), SUM(s.value * s.value) "
+        f"FROM {qn(Monster._meta.db_table)} AS m CROSS JOIN LATERAL (VALUES {stats}) AS s(stat, value) "
+        f"WHERE s.value IS NOT NULL GROUP BY 1, 2, 3, 4", [LOG_GAMMA, ZERO_BUCKET])
+
+
+def summarize(rows):
+    """{stat: {summary: value}} (see SUMMARY) from merged buckets, given as (stat, bucket, count, total, total_sq) rows.
+
+    Percentiles are interpolated like PERCENTILE_CONT; min, max & percentiles are within RELATIVE_ACCURACY.
+    """
+    buckets = dict()
+    for stat, bucket, count, total, total_sq in rows:
+        if count > 0:
+            buckets.setdefault(stat, list()).append(
+                (bucket, count, total, total_sq))
+
+    summary = dict()
+    for stat, stat_buckets in buckets.items():
+        stat_buckets.sort()
+        n = sum(bucket[1] for bucket in stat_buckets)
+        avg = sum(bucket[2] for bucket in stat_buckets) / n
+        variance = sum(bucket[3] for bucket in stat_buckets) / n - avg ** 2
+
+        def value_at(rank):
+            seen = 0
+            for bucket, count, _, _ in stat_buckets:
+                seen += count
+                if rank < seen:
+                    return get_bucket_value(bucket)
+            return get_bucket_value(stat_buckets[-1][0])
+
+        def percentile(fraction):
+            rank = fraction * (n - 1)
+            lower, upper = value_at(math.floor(rank)), value_at(math.ceil(rank))
+            return lower + (upper - lower) * (rank - math.floor(rank))
+
+        summary[stat] = {
+            'avg': avg,
+            'stddev': math.sqrt(max(variance, 0)),  # population, like StdDev
+            'min': value_at(0),
+            'perc25': percentile(0.25),
+            'median': percentile(0.5),
+            'perc75': percentile(0.75),
+            'max': value_at(n - 1),
+        }
+
+    return summary
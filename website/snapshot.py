@@ -0,0 +1,349 @@
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Rune, Monster
+from . import metrics, signals
+
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Analytical columns of runes & monsters, exported to SNAPSHOT_DIR/<table>/<version>/ as one .npy file per column,
+# read memory-mapped by profile comparison & dashboards instead of scanning tables which ingest is writing to.
+# Text columns are dictionary-encoded (int codes + dictionaries.json), NULL numbers are stored as 0 (like rollups),
+# substat columns hold sum of rune's substat array (value + grind), 0 if rune doesn't have that substat.
+# Ingest marks IDs of saved/deleted rows in Redis, so incremental export reads only them from DB.
+KEY_PREFIX = 'swstats:snapshot:'
+CATEGORY = 'category'
+SUBSTAT = 'substat'
+
+RUNE_SUBSTATS = ['sub_hp', 'sub_hp_flat', 'sub_atk', 'sub_atk_flat', 'sub_def', 'sub_def_flat',
+                 'sub_speed', 'sub_res', 'sub_acc', 'sub_crit_rate', 'sub_crit_dmg']
+MONSTER_STATS = ['hp', 'attack', 'defense', 'speed', 'res', 'acc', 'crit_rate', 'crit_dmg']
+
+# table: (model, {column - field path: NumPy dtype, CATEGORY or SUBSTAT})
+TABLES = {
+    'runes': (Rune, {
+        'id': 'i8', 'wizard_id': 'i8', 'slot': 'i1', 'stars': 'i1', 'quality': 'i1', 'quality_original': 'i1',
+        'rune_set_id': 'i2', 'rune_set__name': CATEGORY, 'upgrade_curr': 'i1', 'primary': 'i1', 'innate': 'i1',
+        'efficiency': 'f8', 'equipped': '?', 'equipped_rta': '?', 'locked': '?',
+        **{substat: SUBSTAT for substat in RUNE_SUBSTATS},
+    }),
+    'monsters': (Monster, {
+        'id': 'i8', 'wizard_id': 'i8', 'base_monster_id': 'i4', 'base_monster__name': CATEGORY,
+        'base_monster__family': 'i4', 'base_monster__family__name': CATEGORY, 'base_monster__base_class': 'i1',
+        'base_monster__attribute': 'i1', 'base_monster__archetype': 'i1', 'base_monster__awaken': 'i1',
+        'stars': 'i1', 'locked': '?', **{stat: 'i4' for stat in MONSTER_STATS}, 'avg_eff_total': 'f8', 'eff_hp': 'i4',
+    }),
+}
+MODELS = {model: name for name, (model, _) in TABLES.items()}
+
+LOOKUPS = ['exact', 'in', 'gt', 'gte', 'lt', 'lte', 'isnull', 'icontains']
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def _dirty_key(name):
+    return f'{KEY_PREFIX}dirty:{name}'
+
+
+def _split(key):
+    """(column, lookup) of Django-like filter key."""
+    column, _, lookup = key.rpartition('__')
+    if lookup in LOOKUPS:
+        return column, lookup
+    return key, 'exact'
+
+
+def _python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def track(model, ids):
+    """Marks rows (saved or deleted) for next incremental export, once transaction commits."""
+    if not settings.SNAPSHOT or model not in MODELS or not ids:
+        return
+    ids = list(ids)
+    transaction.on_commit(lambda: mark(MODELS[model], ids))
+
+
+@receiver(signals.pre_bulk_upsert)
+def on_bulk_upsert(sender, rows, **kwargs):
+    track(sender, rows.keys())
+
+
+@receiver(signals.pre_bulk_delete)
+def on_bulk_delete(sender, ids, **kwargs):
+    track(sender, ids)
+
+
+def mark(name, ids):
+    try:
+        _redis().sadd(_dirty_key(name), *ids)
+    except Exception as e:  # nightly full export catches up, it should never break an upload
+        logger.warning(f"Couldn't mark {name} for snapshot: {e}")
+
+
+def _take_dirty(name):
+    """IDs marked since last export, kept aside (and retried by next export) until _release_dirty."""
+    key = _dirty_key(name)
+    pipe = _redis().pipeline()
+    pipe.sunionstore(key + ':taken', [key + ':taken', key])
+    pipe.delete(key)
+    pipe.smembers(key + ':taken')
+    return {int(id_) for id_ in pipe.execute()[-1]}
+
+
+def _release_dirty(name):
+    _redis().delete(_dirty_key(name) + ':taken')
+
+
+def _encode(values, dtype, dictionary):
+    if dtype == CATEGORY:
+        return np.array([-1 if value is None else dictionary.setdefault(value, len(dictionary)) for value in values], dtype='i4')
+    if dtype == SUBSTAT:
+        return np.array([sum(value) if value else 0 for value in values], dtype='i2')
+    return np.array([value or 0 for value in values], dtype=dtype)
+
+
+def read_columns(name, dictionaries=None, **lookups):
+    """Column arrays of rows matching lookups, read from DB in SNAPSHOT_CHUNK_SIZE chunks & encoded like snapshot.
+
+    `dictionaries` ({column: {value: code}}) are extended with new values of CATEGORY columns.
+    """
+    model, columns = TABLES[name]
+    dictionaries = dictionaries if dictionaries is not None else dict()
+    chunks = {column: list() for column in columns}
+    query = model.objects.filter(**lookups).order_by().values_list(*columns)
+    rows = list()
+
+    def flush():
+        for column, values in zip(columns, zip(*rows) if rows else [list()] * len(columns)):
+            dictionary = dictionaries.setdefault(
+                column, dict()) if columns[column] == CATEGORY else None
+            chunks[column].append(_encode(values, columns[column], dictionary))
+        rows.clear()
+
+    for row in query.iterator(chunk_size=settings.SNAPSHOT_CHUNK_SIZE):
+        rows.append(row)
+        if len(rows) >= settings.SNAPSHOT_CHUNK_SIZE:
+            flush()
+    flush()
+    return {column: np.concatenate(arrays) for column, arrays in chunks.items()}
+
+
+def read_frame(name, **lookups):
+    """Rows matching lookups read from DB, shaped like SnapshotTable.frame (e.g. just uploaded profile)."""
+    dictionaries = dict()
+    arrays = read_columns(name, dictionaries, **lookups)
+    return pd.DataFrame({column: _decode(array, list(dictionaries[column])) if column in dictionaries else array
+                         for column, array in arrays.items()})
+
+
+def _decode(codes, dictionary):
+    return np.array(dictionary + [None], dtype=object)[codes]
+
+
+def _write(name, arrays, dictionaries, meta):
+    root = os.path.join(settings.SNAPSHOT_DIR, name)
+    version = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+    path = os.path.join(root, version)
+    os.makedirs(path)
+    for column, array in arrays.items():
+        np.save(os.path.join(path, column + '.npy'), array)
+    with open(os.path.join(path, 'dictionaries.json'), 'w') as f:
+        json.dump({column: list(dictionary)
+                   for column, dictionary in dictionaries.items()}, f)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # readers follow CURRENT, files of older versions stay readable through already opened memory maps
+    with open(os.path.join(root, 'CURRENT.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(root, 'CURRENT.tmp'),
+               os.path.join(root, 'CURRENT'))
+    for old in os.listdir(root):
+        if old != version and os.path.isdir(os.path.join(root, old)):
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def export_table(name, full=False):
+    """Exports table to SNAPSHOT_DIR, whole or just rows marked since last export (merged by ID), returns number of rows."""
+    lock = _redis().lock(f'{KEY_PREFIX}lock:{name}',
+                         timeout=60 * 60 * 6, blocking_timeout=0)
+    if not lock.acquire():
+        return None
+    try:
+        ids = _take_dirty(name)
+        current = None if full else load_table(name, fresh=False)
+        now = time.time()
+        if current is None:
+            dictionaries = dict()
+            arrays = read_columns(name, dictionaries)
+            meta = {'rows': len(arrays['id']), 'exported': now, 'full': now}
+            metrics.incr_counter(f'snapshot.{name}.full')
+        elif ids:
+            dictionaries = {column: {value: code for code, value in enumerate(dictionary)}
+                            for column, dictionary in current.dictionaries.items()}
+            ids = sorted(ids)
+            fresh = [read_columns(name, dictionaries, pk__in=ids[i:i + settings.SNAPSHOT_CHUNK_SIZE])
+                     for i in range(0, len(ids), settings.SNAPSHOT_CHUNK_SIZE)]
+            # rows of marked IDs are replaced by their current version, deleted ones are just dropped
+            kept = ~np.isin(current.columns['id'], np.array(ids, dtype='i8'))
+            arrays = {column: np.concatenate([current.columns[column][kept]] + [chunk[column] for chunk in fresh])
+                      for column in current.columns}
+            meta = {**current.meta, 'rows': len(arrays['id']), 'exported': now}
+            metrics.incr_counter(f'snapshot.{name}.rows', len(ids))
+        else:
+            # nothing was saved since last export, current version is still up-to-date (see load_table)
+            os.utime(os.path.join(settings.SNAPSHOT_DIR, name, 'CURRENT'))
+            return len(current)
+
+        _write(name, arrays, dictionaries, meta)
+        _release_dirty(name)
+        return meta['rows']
+    finally:
+        lock.release()
+
+
+def export_snapshot(full=False):
+    """Exports all snapshot tables, returns {table: number of rows} (None if other export of table is running)."""
+    return {name: export_table(name, full) for name in TABLES.keys()}
+
+
+class SnapshotTable:
+    """Memory-mapped columns of exported table, filtered with Django-like lookups & aggregated in-process."""
+
+    def __init__(self, name, path):
+        self.name = name
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, 'dictionaries.json')) as f:
+            self.dictionaries = json.load(f)
+        self.columns = {column: np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+                        for column in TABLES[name][1]}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def covers(self, lookups):
+        """True if every lookup (field__lookup: value) can be evaluated on snapshot columns."""
+        return all(_split(key)[0] in self.columns for key in lookups.keys())
+
+    def _codes(self, column, values):
+        dictionary = self.dictionaries[column]
+        return [dictionary.index(value) for value in values if value in dictionary]
+
+    def mask(self, **lookups):
+        """Boolean array of rows matching all lookups (exact, in, gt, gte, lt, lte, isnull, icontains)."""
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in lookups.items():
+            column, lookup = _split(key)
+            array = self.columns[column]
+            if column in self.dictionaries:
+                if lookup == 'icontains':
+                    value = [code for code, text in enumerate(self.dictionaries[column])
+                             if text is not None and value.lower() in text.lower()]
+                    lookup = 'in'
+                elif lookup in ['exact', 'in']:
+                    value = self._codes(
+                        column, [value] if lookup == 'exact' else value)
+                    lookup = 'in'
+            if lookup == 'in':
+                mask &= np.isin(array, np.array(
+                    list(value)).astype(array.dtype))
+            elif lookup == 'exact':
+                mask &= array == np.array(value).astype(array.dtype)
+            elif lookup == 'isnull':  # NULLs are stored as 0
+                mask &= (array == 0) if value else (array != 0)
+            elif lookup == 'gt':
+                mask &= array > value
+            elif lookup == 'gte':
+                mask &= array >= value
+            elif lookup == 'lt':
+                mask &= array < value
+            elif lookup == 'lte':
+                mask &= array <= value
+            else:
+                raise ValueError(f'Unsupported snapshot lookup: {key}')
+        return mask
+
+    def frame(self, columns=None, mask=None):
+        """DataFrame of (masked) rows, dictionary-encoded columns decoded to their values."""
+        data = dict()
+        for column in columns or self.columns.keys():
+            array = self.columns[column] if mask is None else self.columns[column][mask]
+            data[column] = _decode(array, self.dictionaries[column]) if column in self.dictionaries else np.asarray(array)
+        return pd.DataFrame(data)
+
+    def count_grouping_sets(self, grouping_sets, mask):
+        """Like swstats_web.aggregations.count_grouping_sets, for rows in mask."""
+        results = list()
+        for grouping_set in grouping_sets:
+            if not grouping_set:
+                results.append([{'count': int(mask.sum())}])
+                continue
+            counts = self.frame(grouping_set, mask).groupby(
+                list(grouping_set)).size()
+            results.append([{**{field: _python(value) for field, value in zip(grouping_set, key if len(grouping_set) > 1 else (key, ))},
+                             'count': int(count)} for key, count in counts.items()])
+        return results
+
+    def describe(self, columns, mask):
+        """{column: {summary: value}} (like website.sketches.summarize) of rows in mask, percentiles like PERCENTILE_CONT."""
+        summary = dict()
+        for column in columns:
+            values = np.asarray(self.columns[column][mask], dtype='f8')
+            if not len(values):
+                continue
+            perc25, median, perc75 = np.percentile(values, [25, 50, 75])
+            summary[column] = {
+                'avg': float(values.mean()),
+                'stddev': float(values.std()),  # population, like StdDev
+                'min': float(values.min()),
+                'perc25': float(perc25),
+                'median': float(median),
+                'perc75': float(perc75),
+                'max': float(values.max()),
+            }
+        return summary
+
+
+_tables = dict()
+
+
+def load_table(name, fresh=True):
+    """Current snapshot of table (cached per process until next export), None if there's none.
+
+    If `fresh`, snapshot not exported in last SNAPSHOT_MAX_AGE seconds (stopped exports) is ignored as well;
+    CURRENT is touched by every export, also by the one which found nothing to export.
+    """
+    root = os.path.join(settings.SNAPSHOT_DIR, name)
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            version = f.read().strip()
+            checked = os.fstat(f.fileno()).st_mtime
+        if name not in _tables or _tables[name][0] != version:
+            _tables[name] = (version, SnapshotTable(
+                name, os.path.join(root, version)))
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning(f"Couldn't load {name} snapshot: {e}")
+        return None
+
+    table = _tables[name][1]
+    if fresh and checked < time.time() - settings.SNAPSHOT_MAX_AGE:
+        return None
+    return table
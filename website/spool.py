@@ -0,0 +1,161 @@
+from django.conf import settings
+from django.db import transaction
+
+from .functions import parse_battles, get_battle_key, log_exception
+from . import dedup
+
+import glob
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# Battle results (see BATTLE_COMMANDS) are appended here instead of creating Celery task per upload,
+# `consume_battle_spool` command saves them in micro-batches of UPLOAD_SPOOL_BATCH_SIZE runs or UPLOAD_SPOOL_BATCH_MS.
+STREAM_KEY = 'swstats:spool:battles'
+GROUP = 'battles'
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
+def spool_battle(command, data_resp, data_req):
+    record = json.dumps([command, data_resp, data_req],
+                        separators=(',', ':'))
+    if settings.UPLOAD_SPOOL == 'redis':
+        _redis().xadd(STREAM_KEY, {'battle': record})
+        return
+
+    os.makedirs(os.path.dirname(settings.UPLOAD_SPOOL_FILE), exist_ok=True)
+    # single write() with O_APPEND, so lines from different processes don't interleave
+    fd = os.open(settings.UPLOAD_SPOOL_FILE, os.O_WRONLY |
+                 os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (record + '\n').encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def save_battles(battles):
+    """Saves batch in one transaction, falls back to one-by-one if anything in it is broken."""
+    try:
+        with transaction.atomic():
+            return parse_battles(battles)
+    except Exception:
+        logger.warning(
+            f"Spooled batch of {len(battles)} battles failed, saving one by one")
+
+    saved = 0
+    for command, data_resp, data_req in battles:
+        try:
+            with transaction.atomic():
+                saved += parse_battles([(command, data_resp, data_req)])
+        except Exception as e:
+            dedup.release(get_battle_key(command, data_resp, data_req))
+            log_exception(e, data_resp=data_resp, data_req=data_req)
+    return saved
+
+
+def claim_idle(conn, consumer, count):
+    """Takes over entries other consumers didn't ack for UPLOAD_SPOOL_CLAIM_IDLE_MS (crashed or restarted with new PID)."""
+    pending = conn.xpending_range(STREAM_KEY, GROUP, '-', '+', count)
+    idle = [entry['message_id'] for entry in pending
+            if entry['time_since_delivered'] >= settings.UPLOAD_SPOOL_CLAIM_IDLE_MS]
+    if not idle:
+        return list()
+    claimed = [(entry_id, fields) for entry_id, fields in conn.xclaim(
+        STREAM_KEY, GROUP, consumer, settings.UPLOAD_SPOOL_CLAIM_IDLE_MS, idle) if entry_id is not None and fields]
+    # claimed entry which was deleted from stream in the meantime comes back empty, it's just removed from pending list
+    deleted = set(idle) - {entry_id for entry_id, _ in claimed}
+    if deleted:
+        conn.xack(STREAM_KEY, GROUP, *deleted)
+    if claimed:
+        logger.warning(
+            f"Claimed {len(claimed)} spooled battles not saved by other consumers")
+    return claimed
+
+
+def flush_redis(batch_size, batch_ms, consumer=None):
+    conn = _redis()
+    consumer = consumer or socket.gethostname() + '-' + str(os.getpid())
+    try:
+        conn.xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except Exception as e:  # BUSYGROUP, already exists
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+    # delivered to this consumer before, but never saved (i.e. killed in the middle of batch)
+    response = conn.xreadgroup(
+        GROUP, consumer, {STREAM_KEY: '0'}, count=batch_size)
+    entries = list(response[0][1]) if response else list()
+    if len(entries) < batch_size:
+        entries += claim_idle(conn, consumer, batch_size - len(entries))
+
+    deadline = time.monotonic() + batch_ms / 1000
+    while len(entries) < batch_size:
+        block = int((deadline - time.monotonic()) * 1000)
+        if block <= 0:
+            break
+        response = conn.xreadgroup(GROUP, consumer, {
+                                   STREAM_KEY: '>'}, count=batch_size - len(entries), block=block)
+        if not response:
+            break
+        entries += response[0][1]
+
+    if not entries:
+        return 0
+
+    save_battles([json.loads(fields[b'battle']) for _, fields in entries])
+    ids = [entry_id for entry_id, _ in entries]
+    conn.xack(STREAM_KEY, GROUP, *ids)
+    conn.xdel(STREAM_KEY, *ids)
+    return len(entries)
+
+
+def flush_file(batch_size, batch_ms, grace_ms=1000):
+    path = settings.UPLOAD_SPOOL_FILE
+    time.sleep(batch_ms / 1000)
+
+    # new uploads go to a new file, renamed one is read after `grace_ms`,
+    # so every process which opened it just before rename has already written its line
+    if os.path.exists(path) and os.path.getsize(path):
+        try:
+            os.rename(path, f'{path}.{int(time.time() * 1000000)}')
+        except OSError:  # Windows, file opened by writer
+            pass
+
+    count = 0
+    for rotated in sorted(glob.glob(f'{path}.*')):
+        rotated_at = int(rotated.rsplit('.', 1)[1]) / 1000000
+        if (time.time() - rotated_at) * 1000 < grace_ms:
+            continue
+        with open(rotated, encoding='utf-8') as f:
+            battles = list()
+            for line in f:
+                if not line.strip():
+                    continue
+                battles.append(json.loads(line))
+                if len(battles) >= batch_size:
+                    save_battles(battles)
+                    count += len(battles)
+                    battles = list()
+            if battles:
+                save_battles(battles)
+                count += len(battles)
+        os.remove(rotated)
+
+    return count
+
+
+def flush(batch_size=None, batch_ms=None):
+    """Saves one micro-batch of spooled battles, returns number of processed uploads."""
+    batch_size = batch_size or settings.UPLOAD_SPOOL_BATCH_SIZE
+    batch_ms = batch_ms or settings.UPLOAD_SPOOL_BATCH_MS
+    if settings.UPLOAD_SPOOL == 'redis':
+        return flush_redis(batch_size, batch_ms)
+    return flush_file(batch_size, batch_ms)
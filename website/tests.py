@@ -0,0 +1,1148 @@
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from .models import Arena, Artifact, Deck, Guild, Monster, MonsterStatBucket, ProfileIngest, RaidDungeonRun, Rune, SiegeRecord, Wizard, WizardBuilding, WizardHomunculus
+from .functions import calc_efficiencies, calc_efficiencies_artifact, calc_efficiency, calc_efficiency_artifact, calc_monster_stats, calc_stats_batch, get_monster_runes, iter_profile_batches, parse_battles, parse_friend_items, parse_profile, parse_profile_chunked, parse_profile_links, parse_profile_wizard, parse_siege_defenses, read_profile_header
+from .tasks import handle_dungeon_run_upload_task, handle_friend_upload_task, handle_profile_upload_task, ingest_profile_task, resume_profile_ingests_task
+from swstats_web.functions import exclude_ingesting
+from . import coalesce, dedup, metrics, pairing, payloads, references, routing, signals, sketches, spool, uploads
+
+import copy
+import datetime
+import itertools
+import math
+import numpy as np
+import os
+import tempfile
+from unittest import mock
+
+
+def rune(rune_id, slot, set_id, pri_eff, prefix_eff, *sec_eff):
+    return {'rune_id': rune_id, 'slot_no': slot, 'set_id': set_id, 'pri_eff': list(pri_eff),
+            'prefix_eff': list(prefix_eff), 'sec_eff': [list(sub) for sub in sec_eff]}
+
+
+def monster(unit_id, runes, artifacts, con=700, atk=650, defense=600, spd=101):
+    return {'unit_id': unit_id, 'con': con, 'atk': atk, 'def': defense, 'spd': spd, 'resist': 15, 'accuracy': 0,
+            'critical_rate': 15, 'critical_damage': 50, 'runes': runes, 'artifacts': artifacts}
+
+
+# sets: 1 Energy (2), 2 Guard (2), 3 Swift (4), 4 Blade (2), 5 Rage (4), 6 Focus (2), 7 Endure (2), 8 Fatal (4), 13 Violent (4), 15 Will (2)
+STATS_MONSTERS = [
+    # Swift (4) + Energy (2), every stat type on runes
+    monster(1, [
+        rune(11, 1, 3, (3, 160), (0, 0), (4, 8, 0, 4), (8, 6, 0, 0), (9, 5, 0, 0), (10, 7, 0, 0)),
+        rune(12, 2, 3, (8, 42), (2, 8), (1, 300, 0, 120), (6, 5, 0, 0), (11, 6, 0, 0), (12, 7, 0, 0)),
+        rune(13, 3, 3, (5, 160), (9, 4), (2, 5, 0, 6), (3, 20, 0, 0), (10, 12, 0, 0)),
+        rune(14, 4, 3, (10, 80), (0, 0), (4, 13, 0, 5), (8, 17, 0, 0)),
+        rune(15, 5, 1, (1, 2448), (12, 5), (2, 7, 0, 0), (6, 10, 0, 5), (9, 4, 0, 0), (11, 4, 0, 0)),
+        rune(16, 6, 1, (4, 63), (0, 0), (3, 15, 0, 0), (5, 20, 0, 0), (8, 5, 0, 0)),
+    ], [{'rid': 101}, {'rid': 102}]),
+    # Fatal (4) + Blade (2)
+    monster(2, [
+        rune(21, 1, 8, (3, 160), (0, 0), (4, 20, 0, 0), (9, 15, 0, 0)),
+        rune(22, 2, 8, (4, 63), (0, 0), (9, 6, 0, 0)),
+        rune(23, 3, 8, (5, 160), (0, 0), (4, 7, 0, 0)),
+        rune(24, 4, 8, (10, 80), (0, 0), (2, 5, 0, 0)),
+        rune(25, 5, 4, (1, 2448), (0, 0), (4, 5, 0, 0)),
+        rune(26, 6, 4, (4, 63), (0, 0), (9, 5, 0, 0)),
+    ], [{'rid': 103}], atk=901),
+    # 3x Guard
+    monster(3, [
+        rune(31, 1, 2, (3, 160), (0, 0), (6, 8, 0, 0)),
+        rune(32, 2, 2, (6, 63), (0, 0), (6, 8, 0, 0)),
+        rune(33, 3, 2, (5, 160), (0, 0), (6, 8, 0, 0)),
+        rune(34, 4, 2, (6, 63), (0, 0), (6, 8, 0, 0)),
+        rune(35, 5, 2, (1, 2448), (0, 0), (6, 8, 0, 0)),
+        rune(36, 6, 2, (6, 63), (0, 0), (6, 8, 0, 0)),
+    ], list(), defense=777),
+    # broken sets: Rage (3 of 4), single Focus, Endure & Energy runes
+    monster(4, [
+        rune(41, 1, 5, (3, 160), (0, 0), (10, 7, 0, 0)),
+        rune(42, 2, 5, (8, 42), (0, 0), (10, 7, 0, 0)),
+        rune(43, 3, 5, (5, 160), (0, 0), (10, 7, 0, 0)),
+        rune(44, 4, 6, (10, 80), (0, 0), (12, 8, 0, 0)),
+        rune(45, 5, 7, (1, 2448), (0, 0), (11, 8, 0, 0)),
+        rune(46, 6, 1, (2, 63), (0, 0), (2, 8, 0, 0)),
+    ], list()),
+    # Rage (4) + Focus (2) next to sets without stat bonus: Violent (4) + Will (2) in the same profile
+    monster(5, [
+        rune(51, 1, 5, (3, 160), (0, 0)),
+        rune(52, 2, 5, (8, 42), (0, 0)),
+        rune(53, 3, 5, (5, 160), (0, 0)),
+        rune(54, 4, 5, (10, 80), (0, 0)),
+        rune(55, 5, 6, (1, 2448), (0, 0)),
+        rune(56, 6, 6, (12, 64), (0, 0)),
+    ], [{'rid': 104}]),
+    monster(6, [
+        rune(61, 1, 13, (3, 160), (0, 0), (8, 20, 0, 0)),
+        rune(62, 2, 13, (8, 42), (0, 0), (8, 20, 0, 0)),
+        rune(63, 3, 13, (5, 160), (0, 0)),
+        rune(64, 4, 13, (11, 64), (0, 0)),
+        rune(65, 5, 15, (1, 2448), (0, 0)),
+        rune(66, 6, 15, (2, 63), (0, 0)),
+    ], list(), spd=99),
+    # Endure (2) + Energy (2) + Focus (2), 2 of 6 slots empty in another monster
+    monster(7, [
+        rune(71, 1, 7, (3, 160), (0, 0)),
+        rune(72, 2, 7, (11, 64), (0, 0)),
+        rune(73, 3, 1, (5, 160), (0, 0)),
+        rune(74, 4, 1, (2, 63), (0, 0)),
+        rune(75, 5, 6, (1, 2448), (0, 0)),
+        rune(76, 6, 6, (12, 64), (0, 0)),
+    ], list(), con=701),
+    monster(8, [
+        rune(81, 2, 3, (8, 42), (0, 0), (8, 10, 0, 0)),
+        rune(82, 4, 3, (2, 63), (0, 0)),
+        rune(83, 5, 3, (1, 2448), (0, 0)),
+        rune(84, 6, 3, (4, 63), (0, 0)),
+    ], list()),
+    # no runes, with & without artifacts
+    monster(9, list(), list()),
+    monster(10, list(), [{'rid': 105}, {'rid': 106}]),
+]
+
+# efficiencies of stored runes & artifacts, like rows saved before monsters are parsed
+STATS_RUNE_EFFICIENCIES = {
+    11: 101.43, 12: 97.2, 13: 80.0, 14: 64.29, 15: 118.57, 16: 55.71,
+    21: 60.0, 22: 43.1, 23: 49.52, 24: 58.06, 25: 46.67, 26: 39.88,
+    31: 55.71, 32: 55.71, 33: 55.71, 34: 55.71, 35: 55.71, 36: 55.72,
+    41: 47.62, 42: 47.62, 43: 47.62, 44: 50.48, 45: 47.62, 46: 50.0,
+    51: 35.71, 52: 35.71, 53: 35.71, 54: 35.71, 55: 35.71, 56: 35.71,
+    61: 83.33, 62: 83.33, 63: 35.71, 64: 35.71, 65: 35.71, 66: 35.71,
+    71: 35.71, 72: 35.71, 73: 35.71, 74: 35.71, 75: 35.71, 76: 35.71,
+    81: 59.52, 82: 35.71, 83: 35.71, 84: 35.71,
+}
+STATS_ARTIFACT_EFFICIENCIES = {101: 65.38, 102: 88.46, 103: 38.46, 104: 100.0, 105: 50.77, 106: 71.79}
+
+
+class MonsterStatsBatchTestCase(TestCase):
+    """calc_stats_batch has to give exactly the same monsters (values & types) as calc_monster_stats."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+        self.runes = {temp_rune['rune_id']: {'id': temp_rune['rune_id'], 'slot': temp_rune['slot_no'], 'efficiency': STATS_RUNE_EFFICIENCIES[temp_rune['rune_id']]}
+                      for temp_monster in STATS_MONSTERS for temp_rune in temp_monster['runes']}
+        self.artifacts = {artifact_id: {'id': artifact_id, 'efficiency': efficiency}
+                          for artifact_id, efficiency in STATS_ARTIFACT_EFFICIENCIES.items()}
+
+    def assertSameStats(self, temp_monsters):
+        expected = [calc_monster_stats(temp_monster, self.runes, self.artifacts)
+                    for temp_monster in temp_monsters]
+        calculated = calc_stats_batch(temp_monsters, self.runes, self.artifacts)
+        self.assertEqual(len(expected), len(calculated))
+        for temp_monster, monster_expected, monster_calculated in zip(temp_monsters, expected, calculated):
+            self.assertEqual(monster_expected, monster_calculated,
+                             f"Monster {temp_monster['unit_id']}")
+            for key in monster_expected:
+                self.assertIs(type(monster_expected[key]), type(monster_calculated[key]),
+                              f"Monster {temp_monster['unit_id']}, {key}")
+
+    def test_profile(self):
+        self.assertSameStats(copy.deepcopy(STATS_MONSTERS))
+
+    def test_set_bonuses(self):
+        monsters = dict(zip([temp_monster['unit_id'] for temp_monster in STATS_MONSTERS],
+                            calc_stats_batch(copy.deepcopy(STATS_MONSTERS), self.runes, self.artifacts)))
+        # Swift (4): +25% of base SPD, on top of runes' SPD (42 + 6 + 17 + 5)
+        self.assertEqual(monsters[1]['speed'], math.ceil(101 + 42 + 6 + 17 + 5 + 101 * 0.25))
+        # Fatal (4): +35% of base ATK, Blade (2): +12% Crit Rate
+        self.assertEqual(monsters[2]['attack'], math.ceil(901 + 160 + 901 * (0.2 + 0.63 + 0.07 + 0.05 + 0.63) + 901 * 0.35))
+        self.assertEqual(monsters[2]['crit_rate'], 15 + 15 + 6 + 5 + 12)
+        # 3x Guard: 3 times +15% of base DEF
+        self.assertEqual(monsters[3]['defense'], math.ceil(777 + 160 + 777 * (3 * 0.63 + 6 * 0.08 + 3 * 0.15)))
+        # broken sets give nothing
+        self.assertEqual(monsters[4]['crit_dmg'], 50 + 80 + 3 * 7)
+        self.assertEqual(monsters[4]['acc'], 8)
+        self.assertEqual(monsters[4]['res'], 15 + 8)
+        # Rage (4) + Focus (2)
+        self.assertEqual(monsters[5]['crit_dmg'], 50 + 80 + 40)
+        self.assertEqual(monsters[5]['acc'], 64 + 20)
+        # Violent & Will don't add stats
+        self.assertEqual(monsters[6]['speed'], 99 + 42 + 40)
+        # Endure (2) + Energy (2) + Focus (2)
+        self.assertEqual(monsters[7]['res'], 15 + 64 + 20)
+        self.assertEqual(monsters[7]['hp'], math.ceil(10515 + 2448 + 10515 * 0.63 + 10515 * 0.15))
+        self.assertEqual(monsters[7]['acc'], 64 + 20)
+        # Swift needs 4 runes, 4 runes on 2nd, 4th, 5th & 6th slot still make it
+        self.assertEqual(monsters[8]['speed'], math.ceil(101 + 42 + 10 + 101 * 0.25))
+        self.assertEqual(monsters[8]['runes'], [81, 82, 83, 84])
+
+    def test_no_runes(self):
+        temp_monsters = copy.deepcopy(STATS_MONSTERS[-2:])
+        # no rune list at all, artifacts still count
+        del temp_monsters[1]['runes']
+        self.assertSameStats(temp_monsters)
+
+        monsters = calc_stats_batch(temp_monsters, self.runes, self.artifacts)
+        self.assertEqual(monsters[0]['hp'], 700 * 15)
+        self.assertEqual(monsters[0]['avg_eff'], 0.0)
+        self.assertEqual(monsters[0]['avg_eff_total'], 0.0)
+        self.assertNotIn('hp', monsters[1])
+        self.assertEqual(monsters[1]['avg_eff_artifacts'], round((50.77 + 71.79) / 2, 2))
+        self.assertEqual(monsters[1]['artifacts'], [105, 106])
+
+    def test_artifacts(self):
+        temp_monsters = copy.deepcopy(STATS_MONSTERS)
+        monsters = calc_stats_batch(temp_monsters, self.runes, self.artifacts)
+        # artifacts don't add stats, only efficiency
+        self.assertEqual(monsters[4]['hp'], math.ceil(10500 + 2448))
+        self.assertEqual(monsters[0]['avg_eff_artifacts'], round((65.38 + 88.46) / 2, 2))
+        avg_eff = round(sum(STATS_RUNE_EFFICIENCIES[rune_id] for rune_id in range(11, 17)) / 6, 2)
+        self.assertEqual(monsters[0]['avg_eff'], avg_eff)
+        self.assertEqual(monsters[0]['avg_eff_total'], round(
+            (avg_eff * 6 + round((65.38 + 88.46) / 2, 2) * 2) / 8, 2))
+        self.assertEqual(monsters[0]['artifacts'], [101, 102])
+
+        # artifact which wasn't saved fails the same way
+        temp_monsters = [monster(11, list(), [{'rid': 999}])]
+        with self.assertRaises(Artifact.DoesNotExist):
+            calc_monster_stats(temp_monsters[0], self.runes, self.artifacts)
+        with self.assertRaises(Artifact.DoesNotExist):
+            calc_stats_batch(temp_monsters, self.runes, self.artifacts)
+
+    def test_runes_by_slot(self):
+        # runes keyed by slot, one of them not saved (doesn't count to efficiency)
+        temp_monster = monster(12, {
+            '3': rune(91, 3, 3, (3, 160), (0, 0), (8, 5, 0, 0)),
+            '5': rune(92, 5, 3, (2, 63), (0, 0)),
+        }, list())
+        self.runes[91] = {'id': 91, 'slot': 3, 'efficiency': 70.0}
+        self.assertSameStats([temp_monster])
+        monsters = calc_stats_batch([copy.deepcopy(temp_monster)], self.runes, self.artifacts)
+        self.assertEqual(monsters[0]['runes'], [91])
+        self.assertEqual(monsters[0]['avg_eff'], 70.0)
+
+    def test_eff_hp(self):
+        temp_monsters = copy.deepcopy(STATS_MONSTERS[2:3] + STATS_MONSTERS[-2:-1])
+        self.assertSameStats(temp_monsters)
+
+        monsters = calc_stats_batch(temp_monsters, self.runes, self.artifacts)
+        defense = math.ceil(777 + 160 + 777 * (3 * 0.63 + 6 * 0.08 + 3 * 0.15))
+        self.assertEqual(monsters[0]['eff_hp'],
+                         math.ceil(10500 + 2448) * (1140 + defense * 1 * 3.5) / 1000)
+        self.assertEqual(monsters[1]['eff_hp'],
+                         10500 * (1140 + 600 * 1 * 3.5) / 1000)
+
+
+# HubUserLogin profile trimmed to what parse_profile reads: wizard without guild,
+# 1 monster with 2 runes & 1 artifact equipped, 1 rune in inventory
+PROFILE = {
+    'command': 'HubUserLogin',
+    'tvalue': 1600000000,
+    'wizard_info': {'wizard_id': 9001, 'wizard_mana': 1000, 'wizard_crystal': 100, 'wizard_level': 50, 'rep_unit_id': 101},
+    'guild': {'guild_info': None},
+    'unit_list': [{
+        'unit_id': 101, 'wizard_id': 9001, 'unit_master_id': 10101, 'unit_level': 40, 'class': 6,
+        'con': 700, 'atk': 650, 'def': 600, 'spd': 101, 'resist': 15, 'accuracy': 0, 'critical_rate': 15, 'critical_damage': 50,
+        'skills': [[1, 1], [2, 1]], 'create_time': '2020-01-01 00:00:00', 'source': 1,
+        'runes': [
+            {'rune_id': 1001, 'wizard_id': 9001, 'occupied_type': 1, 'occupied_id': 101, 'slot_no': 1, 'rank': 5, 'class': 6, 'set_id': 3,
+             'upgrade_curr': 12, 'base_value': 10000, 'sell_value': 5000, 'pri_eff': [3, 160], 'prefix_eff': [0, 0],
+             'sec_eff': [[4, 10, 0, 0], [8, 5, 0, 0]], 'extra': 5},
+            {'rune_id': 1002, 'wizard_id': 9001, 'occupied_type': 1, 'occupied_id': 101, 'slot_no': 2, 'rank': 5, 'class': 6, 'set_id': 3,
+             'upgrade_curr': 15, 'base_value': 10000, 'sell_value': 5000, 'pri_eff': [8, 42], 'prefix_eff': [2, 8],
+             'sec_eff': [[4, 12, 0, 0], [9, 6, 0, 0], [10, 7, 0, 0]], 'extra': 5},
+        ],
+        'artifacts': [
+            {'rid': 5001, 'wizard_id': 9001, 'occupied_id': 101, 'type': 1, 'attribute': 1, 'unit_style': 0, 'level': 12, 'rank': 5,
+             'natural_rank': 5, 'locked': 0, 'pri_effect': [100, 1500, 0, 0, 0], 'sec_effects': [[200, 5, 0, 0, 0], [214, 4, 0, 0, 0]]},
+        ],
+    }],
+    'runes': [
+        {'rune_id': 1003, 'wizard_id': 9001, 'occupied_type': 0, 'occupied_id': 0, 'slot_no': 3, 'rank': 4, 'class': 5, 'set_id': 1,
+         'upgrade_curr': 6, 'base_value': 5000, 'sell_value': 2500, 'pri_eff': [5, 100], 'prefix_eff': [0, 0],
+         'sec_eff': [[1, 100, 0, 0]], 'extra': 4},
+    ],
+    'artifacts': [],
+}
+
+
+def make_profile(tvalue=PROFILE['tvalue']):
+    data = copy.deepcopy(PROFILE)
+    data['tvalue'] = tvalue
+    return data
+
+
+def upload_profile(data):
+    """Profile upload the way handle_profile_upload_task saves it without chunking."""
+    with transaction.atomic():
+        wizard, wizard_exists = parse_profile_wizard(data)
+        if wizard is not None:
+            parse_profile(data, data, wizard, wizard_exists)
+    return wizard
+
+
+class UpsertRecorder:
+    """Collects primary keys of rows given to bulk_upsert, per model."""
+
+    def __init__(self):
+        self.upserted = dict()
+
+    def __enter__(self):
+        signals.pre_bulk_upsert.connect(self.receive)
+        return self
+
+    def __exit__(self, *args):
+        signals.pre_bulk_upsert.disconnect(self.receive)
+
+    def receive(self, sender, rows, **kwargs):
+        self.upserted.setdefault(sender, set()).update(rows.keys())
+
+
+# fingerprints are cached on commit, so the test can't run inside of a transaction
+@override_settings(PROFILE_FINGERPRINTS=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProfileChangesTestCase(TransactionTestCase):
+    """Profile upload skips stale profiles & rows which haven't changed since the last upload."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+        upload_profile(make_profile())
+
+    def test_stale_profile(self):
+        data = make_profile(PROFILE['tvalue'] - 60)
+        data['wizard_info']['wizard_mana'] = 5
+        data['runes'][0]['upgrade_curr'] = 9
+        with UpsertRecorder() as recorder:
+            self.assertIsNone(upload_profile(data))
+        self.assertEqual(recorder.upserted, dict())
+        self.assertEqual(Wizard.objects.get(id=9001).mana, 1000)
+        self.assertEqual(Rune.objects.get(id=1003).upgrade_curr, 6)
+
+    def test_unchanged_profile(self):
+        with UpsertRecorder() as recorder:
+            wizard = upload_profile(make_profile(PROFILE['tvalue'] + 60))
+        self.assertEqual(recorder.upserted, dict())
+        self.assertEqual(wizard.profile_tvalue,
+                         datetime.datetime.utcfromtimestamp(PROFILE['tvalue'] + 60))
+        self.assertEqual(Rune.objects.filter(wizard=wizard).count(), 3)
+        self.assertEqual(Monster.objects.get(id=101).runes.count(), 2)
+
+    def test_changed_items(self):
+        data = make_profile(PROFILE['tvalue'] + 60)
+        data['runes'][0]['upgrade_curr'] = 9
+        data['unit_list'][0]['unit_level'] = 35
+        with UpsertRecorder() as recorder:
+            upload_profile(data)
+        self.assertEqual(recorder.upserted, {Rune: {1003}, Monster: {101}})
+        self.assertEqual(Rune.objects.get(id=1003).upgrade_curr, 9)
+        self.assertEqual(Monster.objects.get(id=101).level, 35)
+        self.assertEqual(Monster.objects.get(id=101).runes.count(), 2)
+
+        # rune lock is outside of rune dict, but it changes saved row too
+        data = make_profile(PROFILE['tvalue'] + 120)
+        data['runes'][0]['upgrade_curr'] = 9
+        data['unit_list'][0]['unit_level'] = 35
+        data['rune_lock_list'] = [1001]
+        with UpsertRecorder() as recorder:
+            upload_profile(data)
+        self.assertEqual(recorder.upserted, {Rune: {1001}})
+        self.assertTrue(Rune.objects.get(id=1001).locked)
+
+
+class EfficiencyBatchTestCase(SimpleTestCase):
+    """calc_efficiencies & calc_efficiencies_artifact have to give exactly the same values as calc_efficiency & calc_efficiency_artifact."""
+
+    def assertSameEfficiencies(self, scalar, batch, items):
+        expected = [scalar(item) for item in items]
+        eff_curr, eff_max = batch(items)
+        self.assertEqual(expected, list(zip(eff_curr.tolist(), eff_max.tolist())))
+
+    def test_runes(self):
+        substats = [
+            list(),
+            [[9, 6, 0, 0]],
+            [[1, 375, 0, 0], [2, 7, 0, 5]],
+            [[3, 19, 0, 0], [8, 18, 0, 0], [11, 8, 0, 0]],
+            [[4, 10, 1, 10], [6, 13, 0, 10], [10, 7, 0, 0], [12, 6, 0, 0]],
+        ]
+        runes = list()
+        # every main stat of every class (ancient too), with & without innate, all upgrade levels
+        for primary, rune_class in itertools.product([1, 2, 3, 4, 5, 6, 8, 9, 10, 11, 12], [1, 2, 3, 4, 5, 6, 11, 15, 16]):
+            for upgrade_curr in range(0, 16, 3):
+                runes.append({
+                    'pri_eff': [primary, 10],
+                    'class': rune_class,
+                    'prefix_eff': [0, 0] if upgrade_curr % 2 else [12, 4],
+                    'sec_eff': substats[len(runes) % len(substats)],
+                    'upgrade_curr': upgrade_curr,
+                })
+        self.assertSameEfficiencies(calc_efficiency, calc_efficiencies, runes)
+        self.assertSameEfficiencies(calc_efficiency, calc_efficiencies, list())
+
+        # unknown stat fails the same way
+        rune = {'pri_eff': [7, 10], 'class': 6, 'prefix_eff': [0, 0], 'sec_eff': list(), 'upgrade_curr': 0}
+        with self.assertRaises(KeyError):
+            calc_efficiency(rune)
+        with self.assertRaises(KeyError):
+            calc_efficiencies([rune])
+        rune = {'pri_eff': [1, 10], 'class': 6, 'prefix_eff': [0, 0], 'sec_eff': [[13, 1, 0, 0]], 'upgrade_curr': 0}
+        with self.assertRaises(KeyError):
+            calc_efficiency(rune)
+        with self.assertRaises(KeyError):
+            calc_efficiencies([rune])
+
+    def test_artifacts(self):
+        substats = [
+            list(),
+            [[200, 5, 0, 0, 0]],
+            [[204, 4, 0, 0, 0], [214, 3.5, 0, 0, 0]],
+            [[219, 12, 0, 0, 0], [300, 5, 0, 0, 0], [407, 6, 0, 0, 0]],
+            [[201, 21, 0, 0, 0], [210, 8, 0, 0, 0], [305, 12, 0, 0, 0], [409, 10, 0, 0, 0]],
+        ]
+        artifacts = [{'sec_effects': sec_effects, 'level': level}
+                     for sec_effects, level in itertools.product(substats, range(0, 16))]
+        self.assertSameEfficiencies(
+            calc_efficiency_artifact, calc_efficiencies_artifact, artifacts)
+        self.assertSameEfficiencies(
+            calc_efficiency_artifact, calc_efficiencies_artifact, list())
+
+        artifact = {'sec_effects': [[199, 5, 0, 0, 0]], 'level': 0}
+        with self.assertRaises(KeyError):
+            calc_efficiency_artifact(artifact)
+        with self.assertRaises(KeyError):
+            calc_efficiencies_artifact([artifact])
+
+
+BATTLE = ['BattleDungeonResult_V2', {'wizard_info': {'wizard_id': 9001}}, {'dungeon_id': 9001}]
+
+
+@override_settings(UPLOAD_SPOOL='redis', UPLOAD_SPOOL_CLAIM_IDLE_MS=60 * 1000)
+@mock.patch('website.spool.STREAM_KEY', 'swstats:tests:spool:battles')
+class SpoolTestCase(TestCase):
+    """Spooled battles are saved once, entries of consumers which died before ack are saved by other ones."""
+
+    def tearDown(self):
+        spool._redis().delete('swstats:tests:spool:battles')
+
+    def battles(self, count):
+        return [[BATTLE[0], BATTLE[1], dict(BATTLE[2], stage_id=i)] for i in range(count)]
+
+    def test_flush(self):
+        for battle in self.battles(3):
+            spool.spool_battle(*battle)
+        with mock.patch('website.spool.save_battles') as save_battles:
+            self.assertEqual(spool.flush_redis(2, 10, 'a'), 2)
+            self.assertEqual(spool.flush_redis(2, 10, 'a'), 1)
+            self.assertEqual(spool.flush_redis(2, 10, 'a'), 0)
+        self.assertEqual([battle for call in save_battles.call_args_list for battle in call[0][0]],
+                         self.battles(3))
+        conn = spool._redis()
+        self.assertEqual(conn.xlen(spool.STREAM_KEY), 0)
+        self.assertEqual(conn.xpending(spool.STREAM_KEY, spool.GROUP)['pending'], 0)
+
+    def test_claim(self):
+        for battle in self.battles(2):
+            spool.spool_battle(*battle)
+        with mock.patch('website.spool.save_battles', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                spool.flush_redis(10, 10, 'dead')
+
+        # not idle long enough, other consumer leaves them
+        with mock.patch('website.spool.save_battles') as save_battles:
+            self.assertEqual(spool.flush_redis(10, 10, 'b'), 0)
+        save_battles.assert_not_called()
+
+        with override_settings(UPLOAD_SPOOL_CLAIM_IDLE_MS=0):
+            with mock.patch('website.spool.save_battles') as save_battles:
+                self.assertEqual(spool.flush_redis(10, 10, 'b'), 2)
+        save_battles.assert_called_once_with(self.battles(2))
+        self.assertEqual(spool._redis().xpending(spool.STREAM_KEY, spool.GROUP)['pending'], 0)
+
+    def test_redelivery(self):
+        for battle in self.battles(2):
+            spool.spool_battle(*battle)
+        with mock.patch('website.spool.save_battles', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                spool.flush_redis(10, 10, 'a')
+        # restarted consumer with the same name saves what it read before
+        with mock.patch('website.spool.save_battles') as save_battles:
+            self.assertEqual(spool.flush_redis(10, 10, 'a'), 2)
+        save_battles.assert_called_once_with(self.battles(2))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(UPLOAD_SPOOL='file', UPLOAD_SPOOL_FILE=os.path.join(spool_dir, 'battles.jsonl')):
+            for battle in self.battles(3):
+                spool.spool_battle(*battle)
+            with mock.patch('website.spool.save_battles') as save_battles:
+                # rotated file is read after grace period only, new uploads go to a new file
+                self.assertEqual(spool.flush_file(2, 10, grace_ms=60 * 1000), 0)
+                spool.spool_battle(*self.battles(4)[3])
+                self.assertEqual(spool.flush_file(2, 10, grace_ms=0), 4)
+            self.assertEqual([call[0][0] for call in save_battles.call_args_list],
+                             [self.battles(2), self.battles(3)[2:], self.battles(4)[3:]])
+            self.assertEqual(os.listdir(spool_dir), list())
+
+    def test_broken_battle(self):
+        battles = self.battles(3)
+
+        def parse_battles(batch):
+            if any(battle[2]['stage_id'] == 1 for battle in batch):
+                raise ValueError
+            return len(batch)
+
+        # broken upload doesn't take the rest of its batch down
+        with mock.patch('website.spool.parse_battles', side_effect=parse_battles), mock.patch('website.spool.log_exception') as log_exception:
+            self.assertEqual(spool.save_battles(battles), 2)
+        log_exception.assert_called_once()
+
+
+@override_settings(PAYLOAD_STORE='redis', PROFILE_STREAMING=True, PROFILE_STREAMING_BATCH_SIZE=1)
+class ProfileStreamingTestCase(TestCase):
+    """Streamed profile is read from payload store in batches and saved the same way as loaded one."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+        self.data = make_profile()
+        self.payload_key = payloads.store_payload(self.data)
+
+    def tearDown(self):
+        payloads._redis().delete(payloads.KEY_PREFIX + self.payload_key)
+
+    def test_batches(self):
+        header = read_profile_header(self.payload_key)
+        self.assertEqual(header, {key: value for key, value in self.data.items()
+                                  if key not in ['runes', 'artifacts', 'unit_list']})
+        # streamed batches come in payload order
+        self.assertEqual(sorted(iter_profile_batches(self.payload_key, 1), key=lambda batch: batch[0]),
+                         sorted(iter_profile_batches(self.data, 1), key=lambda batch: batch[0]))
+        self.assertEqual(list(iter_profile_batches(self.payload_key)),
+                         [('runes', self.data['runes']), ('unit_list', self.data['unit_list'])])
+
+    def test_upload(self):
+        with mock.patch('website.payloads.load_payload') as load_payload:
+            handle_profile_upload_task(self.payload_key)
+        load_payload.assert_not_called()
+
+        wizard = Wizard.objects.get(id=9001)
+        self.assertEqual(wizard.profile_tvalue,
+                         datetime.datetime.utcfromtimestamp(PROFILE['tvalue']))
+        self.assertEqual(set(Rune.objects.filter(wizard=wizard).values_list('id', flat=True)), {1001, 1002, 1003})
+        self.assertEqual(list(Monster.objects.get(id=101).runes.values_list('id', flat=True)), [1001, 1002])
+        self.assertEqual(list(Monster.objects.get(id=101).artifacts.values_list('id', flat=True)), [5001])
+
+        # same rows as profile saved in one go
+        streamed = list(Monster.objects.filter(id=101).values())
+        with override_settings(PROFILE_STREAMING=False):
+            Wizard.objects.filter(id=9001).delete()
+            handle_profile_upload_task(self.payload_key)
+        self.assertEqual(list(Monster.objects.filter(id=101).values()), streamed)
+
+
+@mock.patch('website.coalesce.KEY_PREFIX', 'swstats:tests:ingest:wizard:')
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class CoalesceTestCase(SimpleTestCase):
+    """One ingest task per wizard at a time, it saves only the newest of uploads which came in meanwhile."""
+
+    def tearDown(self):
+        metrics._redis().delete('swstats:tests:ingest:wizard:9001', 'swstats:tests:metrics')
+
+    def state(self):
+        return {key.decode('utf-8'): value.decode('utf-8') for key, value in metrics._redis().hgetall('swstats:tests:ingest:wizard:9001').items()}
+
+    def test_submit(self):
+        token = coalesce.submit(9001, 100, 'p1')
+        self.assertIsNotNone(token)
+        self.assertIsNone(coalesce.submit(9001, 200, 'p2'))
+        self.assertIsNone(coalesce.submit(9001, 150, 'p3'))  # older than pending one
+        self.assertEqual(self.state(), {'state': 'queued', 'payload': 'p2', 'tvalue': '200', 'token': token})
+        self.assertEqual(metrics.get_counters(), {'profile.queued': 1, 'profile.collapsed': 2})
+
+    def test_ingest(self):
+        token = coalesce.submit(9001, 100, 'p1')
+        coalesce.submit(9001, 200, 'p2')
+        ingested = list()
+
+        def handle(payload_key):
+            ingested.append(payload_key)
+            self.assertEqual(self.state()['state'], 'running')
+            if payload_key == 'p2':  # newer upload while the task is running
+                self.assertIsNone(coalesce.submit(9001, 300, 'p3'))
+
+        with mock.patch('website.tasks.handle_profile_upload_task', side_effect=handle):
+            ingest_profile_task(9001, 'p1', token)
+        self.assertEqual(ingested, ['p2', 'p3'])
+        self.assertEqual(self.state(), dict())
+        self.assertIsNotNone(coalesce.submit(9001, 400, 'p4'))
+
+    def test_expired_state(self):
+        # state expired (i.e. worker died), upload which created the task is still saved
+        with mock.patch('website.tasks.handle_profile_upload_task') as handle:
+            ingest_profile_task(9001, 'p1', 'expired')
+        handle.assert_called_once_with('p1')
+
+        # task with expired state doesn't take over the state of newer task
+        token = coalesce.submit(9001, 200, 'p2')
+        self.assertIsNone(coalesce.claim(9001, 'expired'))
+        self.assertFalse(coalesce.finish(9001, 'expired'))
+        self.assertEqual(self.state(), {'state': 'queued', 'payload': 'p2', 'tvalue': '200', 'token': token})
+
+
+class RoutingTestCase(SimpleTestCase):
+    """Uploads of a wizard always go to the same ingest queue, adding a shard moves only keys which go to it."""
+
+    def test_jump_hash(self):
+        # values of the reference implementation
+        self.assertEqual([routing.jump_hash(key, buckets) for key, buckets in [(1, 1), (42, 57), (0xDEAD10CC, 1), (0xDEAD10CC, 666), (256, 1024)]],
+                         [0, 43, 0, 361, 520])
+
+        wizard_ids = range(10000000, 10010000)
+        before = [routing.jump_hash(wizard_id, 8) for wizard_id in wizard_ids]
+        after = [routing.jump_hash(wizard_id, 9) for wizard_id in wizard_ids]
+        self.assertEqual(set(before), set(range(8)))
+        moved = [bucket for bucket_before, bucket in zip(before, after) if bucket_before != bucket]
+        self.assertEqual(set(moved), {8})
+        self.assertAlmostEqual(len(moved) / len(wizard_ids), 1 / 9, delta=0.01)
+
+    def test_queue(self):
+        with override_settings(INGEST_SHARDS=0):
+            self.assertIsNone(routing.get_ingest_queue(9001))
+        with override_settings(INGEST_SHARDS=4, INGEST_QUEUE_PREFIX='ingest.'):
+            self.assertEqual(routing.get_ingest_queue(9001), f'ingest.{routing.jump_hash(9001, 4)}')
+            self.assertEqual(routing.get_ingest_queue('9001'), routing.get_ingest_queue(9001))
+            self.assertIsNone(routing.get_ingest_queue(None))
+
+            task = mock.Mock()
+            routing.send_ingest(task, 9001, 'a', 'b', queue='uploads.profile', priority=0)
+            task.apply_async.assert_called_once_with(
+                ('a', 'b'), queue=routing.get_ingest_queue(9001), priority=0)
+            routing.send_ingest(task, None, 'a', queue='uploads.profile', priority=0)
+            task.apply_async.assert_called_with(('a', ), queue='uploads.profile', priority=0)
+
+    def test_upload_wizard_id(self):
+        self.assertEqual(routing.get_upload_wizard_id(
+            {'command': 'HubUserLogin', 'wizard_info': {'wizard_id': 1}}), 1)
+        self.assertEqual(routing.get_upload_wizard_id(
+            {'command': 'VisitFriend', 'friend': {'wizard_id': 2}}), 2)
+        self.assertEqual(routing.get_upload_wizard_id(
+            {'command': 'GetLobbyWizardLog', 'request': {'wizard_id': 1, 'target_wizard_id': 3}}), 3)
+        self.assertEqual(routing.get_upload_wizard_id(
+            {'command': 'BattleDungeonResult_V2', 'request': {'wizard_id': 4}}), 4)
+        self.assertIsNone(routing.get_upload_wizard_id({'command': 'HubUserLogin'}))
+
+
+DUNGEON_UPLOAD = {
+    'command': 'BattleDungeonResult_V2',
+    'request': {'command': 'BattleDungeonResult_V2', 'wizard_id': 9001, 'dungeon_id': 9001, 'stage_id': 10, 'unit_id_list': [{'unit_id': 101}], 'retry': 1},
+    'response': {'command': 'BattleDungeonResult_V2', 'wizard_info': {'wizard_id': 9001}, 'tvalue': 1600000000, 'win_lose': 1, 'clear_time': {'current_time': 45000}, 'reward': {'crate': dict()}},
+}
+
+
+@override_settings(UPLOAD_SPOOL='', INGEST_SHARDS=0, UPLOAD_COMMAND_QUEUES=True, BATTLE_DEDUP=False, PROFILE_COALESCING=False)
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class UploadDispatchTestCase(TestCase):
+    """SWEX uploads go to handler, queue & priority of their UPLOAD_COMMANDS entry, stripped to what the handler reads."""
+
+    def tearDown(self):
+        metrics._redis().delete('swstats:tests:metrics')
+
+    def test_unknown_command(self):
+        self.assertFalse(uploads.dispatch({'command': 'GetNoticeDungeon'}))
+        self.assertEqual(metrics.get_counters(), {'upload.ignored': 1})
+
+    def test_battle(self):
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.assertTrue(uploads.dispatch(copy.deepcopy(DUNGEON_UPLOAD)))
+        response = {key: value for key, value in DUNGEON_UPLOAD['response'].items() if key not in ['command', 'reward']}
+        request = {key: value for key, value in DUNGEON_UPLOAD['request'].items() if key not in ['command', 'retry']}
+        apply_async.assert_called_once_with((response, request), queue='uploads.battles', priority=6)
+
+        # spooled instead of a task
+        with override_settings(UPLOAD_SPOOL='redis'), mock.patch('website.spool.spool_battle') as spool_battle, \
+                mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.assertTrue(uploads.dispatch(copy.deepcopy(DUNGEON_UPLOAD)))
+        spool_battle.assert_called_once_with('BattleDungeonResult_V2', response, request)
+        apply_async.assert_not_called()
+        self.assertEqual(metrics.get_counters(), {'upload.BattleDungeonResult_V2': 2})
+
+    def test_profile(self):
+        data = make_profile()
+        with override_settings(UPLOAD_COMMAND_QUEUES=False, INGEST_SHARDS=4), mock.patch('website.payloads.store_payload', return_value='key') as store_payload, \
+                mock.patch.object(handle_profile_upload_task, 'apply_async') as apply_async:
+            self.assertTrue(uploads.dispatch(data))
+            queue = routing.get_ingest_queue(9001)
+        store_payload.assert_called_once_with(data)
+        apply_async.assert_called_once_with(('key', ), queue=queue, priority=0)
+
+    def test_friend(self):
+        data = {'command': 'VisitFriend', 'friend': {'wizard_id': 9001}}
+        with mock.patch('website.payloads.store_payload', return_value='key'), \
+                mock.patch.object(handle_friend_upload_task, 'apply_async') as apply_async:
+            self.assertTrue(uploads.dispatch(copy.deepcopy(data)))
+            apply_async.assert_called_once_with(('key', 9001), queue='uploads.profile', priority=3)
+
+            # known wizard is never overwritten by friend data, so it isn't even queued
+            Wizard.objects.create(id=9001, last_update=datetime.datetime.utcfromtimestamp(PROFILE['tvalue']))
+            self.assertTrue(uploads.dispatch(copy.deepcopy(data)))
+            apply_async.assert_called_once()
+        self.assertEqual(metrics.get_counters(), {'upload.VisitFriend': 2, 'upload.VisitFriend.skipped': 1})
+
+
+@override_settings(UPLOAD_SPOOL='', INGEST_SHARDS=0, BATTLE_DEDUP=True)
+@mock.patch('website.dedup.KEY_PREFIX', 'swstats:tests:seen:')
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class BattleDedupTestCase(TestCase):
+    """Retransmits of accepted battle uploads are dropped, unless the first one failed to be queued or saved."""
+
+    def tearDown(self):
+        conn = dedup._redis()
+        conn.delete('swstats:tests:metrics', *conn.keys('swstats:tests:seen:*'))
+
+    def dispatch(self, times=1):
+        for _ in range(times):
+            uploads.dispatch(copy.deepcopy(DUNGEON_UPLOAD))
+
+    def test_retransmit(self):
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.dispatch(3)
+        apply_async.assert_called_once()
+        self.assertEqual(metrics.get_counters()['battles.duplicate'], 2)
+
+    def test_queue_failed(self):
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                self.dispatch()
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.dispatch(2)
+        apply_async.assert_called_once()
+
+    def test_save_failed(self):
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.dispatch()
+        data_resp, data_req = apply_async.call_args[0][0]
+        with mock.patch('website.tasks.parse_battles', side_effect=ValueError), mock.patch('website.tasks.log_exception'):
+            handle_dungeon_run_upload_task(data_resp, data_req)
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.dispatch(2)
+        apply_async.assert_called_once()
+
+    def test_spooled_save_failed(self):
+        with override_settings(UPLOAD_SPOOL='redis'), mock.patch('website.spool.spool_battle') as spool_battle:
+            self.dispatch()
+        with mock.patch('website.spool.parse_battles', side_effect=ValueError), mock.patch('website.spool.log_exception'):
+            spool.save_battles([spool_battle.call_args[0]])
+        with mock.patch.object(handle_dungeon_run_upload_task, 'apply_async') as apply_async:
+            self.dispatch(2)
+        apply_async.assert_called_once()
+
+
+RAID_START = ('BattleRiftOfWorldsRaidStart', {
+    'wizard_info': {'wizard_id': 9001}, 'tvalue': 1600000000,
+    'battle_info': {'room_info': {'stage_id': 5}, 'user_list': [
+        {'wizard_id': 9001, 'deck_list': [{'unit_info': {'unit_id': 101}, 'index': 1, 'leader': True}]}]},
+}, {'wizard_id': 9001, 'battle_key': 777})
+RAID_RESULT = ('BattleRiftOfWorldsRaidResult', dict(), {'battle_key': 777, 'win_lose': 2})
+
+
+# held starts are removed on commit
+@override_settings(BATTLE_PAIRING=True)
+@mock.patch('website.pairing.KEY_PREFIX', 'swstats:tests:pair:')
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class BattlePairingTestCase(TransactionTestCase):
+    """Raid start waits for its result, so the run is written once & complete."""
+
+    def tearDown(self):
+        conn = pairing._redis()
+        conn.delete('swstats:tests:metrics', *conn.keys('swstats:tests:pair:*'))
+
+    def save(self, *battles):
+        with transaction.atomic():
+            return parse_battles(list(battles))
+
+    def held(self):
+        return pairing._redis().keys('swstats:tests:pair:*')
+
+    def test_separate_uploads(self):
+        self.assertEqual(self.save(RAID_START), 0)
+        self.assertFalse(RaidDungeonRun.objects.exists())
+        self.assertEqual(self.held(), [b'swstats:tests:pair:raid_start:777'])
+
+        self.assertEqual(self.save(RAID_RESULT), 1)
+        run = RaidDungeonRun.objects.get()
+        self.assertEqual((run.battle_key, run.stage, run.wizard_id, run.win), (777, 5, 9001, False))
+        self.assertEqual(self.held(), list())
+        self.assertEqual(metrics.get_counters(), {'battles.held': 1, 'battles.paired': 1})
+
+    def test_same_batch(self):
+        self.assertEqual(self.save(RAID_START, RAID_RESULT), 1)
+        self.assertEqual(RaidDungeonRun.objects.get().stage, 5)
+        self.assertEqual(self.held(), list())
+
+    def test_result_without_start(self):
+        # start expired (or was saved before pairing), result only updates stored run
+        self.assertEqual(self.save(RAID_RESULT), 0)
+        self.assertFalse(RaidDungeonRun.objects.exists())
+
+        with override_settings(BATTLE_PAIRING=False):
+            self.save(RAID_START)
+        self.assertEqual(self.held(), list())
+        RaidDungeonRun.objects.filter(battle_key=777).update(win=True)
+        self.assertEqual(self.save(RAID_RESULT), 1)
+        self.assertFalse(RaidDungeonRun.objects.get().win)
+
+
+def create_monsters(wizard_id, monster_ids, avg_eff=50.0):
+    """Stored monsters with just required fields, for records which only link them."""
+    Monster.objects.bulk_create([Monster(
+        id=monster_id, wizard_id=wizard_id, base_monster_id=10101, level=40, stars=6, hp=10500, attack=650, defense=600, speed=101,
+        res=15, acc=0, crit_rate=15, crit_dmg=50, avg_eff=avg_eff, avg_eff_artifacts=0.0, avg_eff_total=avg_eff, eff_hp=34815,
+        skills=[1, 1], created=datetime.datetime(2020, 1, 1), source_id=1, transmog=False, locked=False, storage=False,
+    ) for monster_id in monster_ids])
+
+
+def siege_defenses(tvalue, decks, units, guild_id=1):
+    """GetGuildSiegeDefenseDeckByWizardId with `decks` as (deck ID, wizard ID, wins, loses) & `units` as (deck ID, monster ID, position)."""
+    return {
+        'tvalue': tvalue,
+        'wizard_info_list': [{'wizard_id': 9001, 'guild_id': guild_id}],
+        'defense_deck_list': [{'deck_id': deck_id, 'wizard_id': wizard_id, 'win_count': wins, 'lose_count': loses,
+                               'winning_rate': round(wins / (wins + loses), 4)} for deck_id, wizard_id, wins, loses in decks],
+        'defense_unit_list': [{'deck_id': deck_id, 'pos_id': pos_id, 'unit_info': {'unit_id': monster_id}}
+                              for deck_id, monster_id, pos_id in units] + [{'deck_id': 1, 'pos_id': 4}],  # empty slot
+    }
+
+
+class SiegeDefensesTestCase(TestCase):
+    """Siege defenses of known wizards are saved with their first 3 known monsters, guild of their wizards is updated."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        date = datetime.datetime.utcfromtimestamp(PROFILE['tvalue'])
+        Guild.objects.create(id=1, level=20, members_amount=30, gw_best_place=1,
+                             gw_best_ranking=1001, last_update=date)
+        Wizard.objects.create(id=9001, last_update=date)
+        create_monsters(9001, range(101, 106))
+
+    def test_defenses(self):
+        data = siege_defenses(PROFILE['tvalue'], [(1, 9001, 10, 2), (2, 9001, 3, 3), (3, 9002, 1, 0)], [
+            (1, 102, 2), (1, 999, 3), (1, 101, 1), (1, 103, 3), (1, 104, 3),  # unknown monster, 4th one
+            (2, 105, 1), (2, 101, 2),
+            (3, 101, 1),  # unknown wizard
+        ])
+        self.assertEqual(parse_siege_defenses(data), 2)
+        self.assertEqual(list(SiegeRecord.objects.order_by('id').values('id', 'wizard_id', 'win', 'lose', 'ratio', 'leader_id', 'full')), [
+            {'id': 1, 'wizard_id': 9001, 'win': 10, 'lose': 2, 'ratio': 0.8333, 'leader_id': 101, 'full': True},
+            {'id': 2, 'wizard_id': 9001, 'win': 3, 'lose': 3, 'ratio': 0.5, 'leader_id': 105, 'full': False},
+        ])
+        self.assertEqual(set(SiegeRecord.objects.get(id=1).monsters.values_list('id', flat=True)), {101, 102, 103})
+        self.assertEqual(set(SiegeRecord.objects.get(id=2).monsters.values_list('id', flat=True)), {101, 105})
+        self.assertEqual(Wizard.objects.get(id=9001).guild_id, 1)
+
+        # newer upload of the same defense replaces it
+        data = siege_defenses(PROFILE['tvalue'] + 60, [(1, 9001, 12, 2)], [(1, 104, 1), (1, 105, 2)])
+        self.assertEqual(parse_siege_defenses(data), 1)
+        record = SiegeRecord.objects.get(id=1)
+        self.assertEqual((record.win, record.leader_id, record.full, record.last_update),
+                         (12, 104, False, datetime.datetime.utcfromtimestamp(PROFILE['tvalue'] + 60)))
+        self.assertEqual(set(record.monsters.values_list('id', flat=True)), {104, 105})
+
+    def test_unknown(self):
+        # nothing of known wizards, unknown guild
+        self.assertEqual(parse_siege_defenses(siege_defenses(
+            PROFILE['tvalue'], [(3, 9002, 1, 0)], [(3, 101, 1)])), 0)
+        self.assertEqual(parse_siege_defenses(siege_defenses(
+            PROFILE['tvalue'], [(1, 9001, 1, 0)], list(), guild_id=2)), 1)
+        self.assertFalse(SiegeRecord.objects.get(id=1).full)
+        self.assertIsNone(Wizard.objects.get(id=9001).guild_id)
+
+
+def make_friend():
+    """VisitFriend of wizard 9002: monster of PROFILE, monster with broken rune in the middle & storage with one more monster."""
+    temp_monster = copy.deepcopy(PROFILE['unit_list'][0])
+    broken = copy.deepcopy(temp_monster)
+    broken['unit_id'] = 102
+    broken['runes'] = [dict(temp_monster['runes'][0], rune_id=1004), 'broken', dict(temp_monster['runes'][1], rune_id=1005)]
+    broken['artifacts'] = [dict(temp_monster['artifacts'][0], rid=5002)]
+    stored = copy.deepcopy(temp_monster)
+    stored.update(unit_id=103, building_id=77, runes=list(), artifacts=list())
+    return {
+        'command': 'VisitFriend',
+        'tvalue': PROFILE['tvalue'],
+        'friend': {
+            'wizard_id': 9002, 'wizard_name': 'Friend', 'wizard_level': 45,
+            'unit_list': [temp_monster, broken, stored],
+            'building_list': [{'building_id': 77, 'building_master_id': 25}],
+            'deco_list': [{'master_id': 4, 'level': 10}],
+        },
+    }
+
+
+class FriendUploadTestCase(TestCase):
+    """Visited friend is inserted in bulk once, existing rows are never overwritten by friend data."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+
+    def test_friend(self):
+        handle_friend_upload_task(make_friend(), 9002)
+        self.assertEqual(Wizard.objects.get(id=9002).level, 45)
+        self.assertEqual(set(Monster.objects.filter(wizard_id=9002).values_list('id', flat=True)), {101, 103})
+        # rune before the broken one is already in
+        self.assertEqual(set(Rune.objects.filter(wizard_id=9002).values_list('id', flat=True)), {1001, 1002, 1004})
+        self.assertEqual(set(Artifact.objects.filter(wizard_id=9002).values_list('id', flat=True)), {5001})
+        monster = Monster.objects.get(id=101)
+        self.assertEqual(list(monster.runes.values_list('id', flat=True)), [1001, 1002])
+        self.assertEqual(list(monster.artifacts.values_list('id', flat=True)), [5001])
+        self.assertEqual(monster.avg_eff, round(sum(Rune.objects.filter(
+            id__in=[1001, 1002]).values_list('efficiency', flat=True)) / 2, 2))
+        self.assertTrue(Monster.objects.get(id=103).storage)
+        self.assertEqual(WizardBuilding.objects.get(wizard_id=9002, building_id=4).level, 10)
+
+        # known wizard is left untouched
+        data = make_friend()
+        data['friend']['wizard_level'] = 50
+        handle_friend_upload_task(data, 9002)
+        handle_friend_upload_task(data)
+        self.assertEqual(Wizard.objects.get(id=9002).level, 45)
+
+    def test_existing_items(self):
+        wizard = upload_profile(make_profile())
+        data = make_friend()
+        temp_monster = data['friend']['unit_list'][0]
+        temp_monster['unit_level'] = 35
+        temp_monster['runes'][0]['upgrade_curr'] = 3
+        temp_monster['artifacts'][0]['level'] = 3
+        monster = Monster.objects.filter(id=101).values().get()
+        parse_friend_items(data['friend'], wizard)
+        self.assertEqual(Monster.objects.filter(id=101).values().get(), monster)
+        self.assertEqual(Rune.objects.get(id=1001).upgrade_curr, 12)
+        self.assertEqual(Artifact.objects.get(id=5001).level, 12)
+        self.assertTrue(Monster.objects.filter(id=103).exists())
+
+
+HOMUNCULUS_BUILD = [10111010, 10111011, 10112010, 10112011, 10113010]  # build 1 of fixture
+
+
+def make_links(unit_id_list, rating_id, depth_5):
+    return {
+        'wizard_info': {'wizard_id': 9001, 'rep_unit_id': 102},
+        'deck_list': [
+            {'deck_type': 1, 'deck_seq': 1, 'leader_unit_id': 101, 'unit_id_list': unit_id_list},
+            {'deck_type': 2, 'deck_seq': 1, 'leader_unit_id': 999, 'unit_id_list': [101]},  # unknown leader
+            {'deck_type': 3, 'deck_seq': 1, 'leader_unit_id': 101, 'unit_id_list': [0, 999]},  # no known monsters
+        ],
+        'pvp_info': {'arena_win': 10, 'arena_lose': 5, 'rating_id': rating_id},
+        'defense_unit_list': [{'unit_id': 101, 'pos_id': 1}, {'unit_id': 999, 'pos_id': 2}, {'unit_id': 103, 'pos_id': 3}],
+        'homunculus_skill_list': [{'unit_id': 103, 'skill_depth': depth, 'skill_id': skill_id} for depth, skill_id in enumerate(HOMUNCULUS_BUILD[:4] + [depth_5], start=1)] + [
+            {'unit_id': 102, 'skill_depth': 1, 'skill_id': HOMUNCULUS_BUILD[0]},  # incomplete build
+            {'unit_id': 999, 'skill_depth': 1, 'skill_id': HOMUNCULUS_BUILD[0]},
+        ],
+    }
+
+
+class ProfileLinksTestCase(TestCase):
+    """Decks, arena & homunculus of a profile are saved for known monsters only, later uploads update the same rows."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+        self.wizard = upload_profile(make_profile())
+        create_monsters(9001, [102, 103], avg_eff=50.0)
+        self.avg_eff = Monster.objects.get(id=101).avg_eff
+
+    def test_links(self):
+        with transaction.atomic():
+            parse_profile_links(make_links([101, 102, 999, 102], 4001, HOMUNCULUS_BUILD[4]), self.wizard)
+        deck = Deck.objects.get()
+        self.assertEqual((deck.place, deck.number, deck.leader_id, deck.team_runes_eff),
+                         (1, 1, 101, round((self.avg_eff + 50.0) / 2, 2)))
+        self.assertEqual(set(deck.monsters.values_list('id', flat=True)), {101, 102})
+        self.assertEqual(Arena.objects.filter(wizard=self.wizard).values('wins', 'loses', 'rank', 'def_1', 'def_2', 'def_3', 'def_4').get(),
+                         {'wins': 10, 'loses': 5, 'rank': 4001, 'def_1': 101, 'def_2': None, 'def_3': 103, 'def_4': None})
+        self.assertEqual(list(WizardHomunculus.objects.values_list('homunculus_id', 'build_id')), [(103, 1)])
+        self.assertEqual(self.wizard.monsterrep_set.get().monster_id, 102)
+
+        # newer profile updates the same deck, arena & homunculus
+        with transaction.atomic():
+            parse_profile_links(make_links([102], 4002, 10113020), self.wizard)
+        self.assertEqual(Deck.objects.get().id, deck.id)
+        self.assertEqual(Deck.objects.get().team_runes_eff, 50.0)
+        self.assertEqual(list(Deck.objects.get().monsters.values_list('id', flat=True)), [102])
+        self.assertEqual(Arena.objects.get(wizard=self.wizard).rank, 4002)
+        self.assertEqual(list(WizardHomunculus.objects.values_list('homunculus_id', 'build_id')), [(103, 2)])
+
+
+@override_settings(PROFILE_RECONCILE=True)
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class ProfileReconcileTestCase(TestCase):
+    """Items of wizard which aren't in the newer profile are deleted, monsters in battle & siege history are kept."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+        upload_profile(make_profile())
+        create_monsters(9001, [102, 103])
+        SiegeRecord.objects.create(id=1, wizard_id=9001, win=1, lose=0, ratio=1.0,
+                                   last_update=datetime.datetime.utcfromtimestamp(PROFILE['tvalue'])).monsters.set([103])
+
+    def tearDown(self):
+        metrics._redis().delete('swstats:tests:metrics')
+
+    def test_reconcile(self):
+        data = make_profile(PROFILE['tvalue'] + 60)
+        data['runes'] = ['broken']  # rune 1003 sold
+        data['unit_list'][0]['artifacts'] = list()  # artifact 5001 sold, monsters 102 & 103 fed
+        deleted = dict()
+
+        def receive(sender, ids, **kwargs):
+            deleted[sender] = set(ids)
+
+        signals.pre_bulk_delete.connect(receive)
+        try:
+            upload_profile(data)
+        finally:
+            signals.pre_bulk_delete.disconnect(receive)
+        self.assertEqual(deleted, {Monster: {102}, Rune: {1003}, Artifact: {5001}})
+        self.assertEqual(set(Monster.objects.values_list('id', flat=True)), {101, 103})
+        self.assertEqual(set(Rune.objects.values_list('id', flat=True)), {1001, 1002})
+        self.assertFalse(Artifact.objects.exists())
+        self.assertEqual(list(SiegeRecord.objects.get(id=1).monsters.values_list('id', flat=True)), [103])
+        self.assertEqual(metrics.get_counters(), {'reconcile.profiles': 1, 'reconcile.monsters': 1, 'reconcile.monsters.kept': 1,
+                                                  'reconcile.runes': 1, 'reconcile.artifacts': 1})
+
+    def test_no_monsters(self):
+        # profile without monsters is broken, it mustn't wipe out the wizard
+        data = make_profile(PROFILE['tvalue'] + 60)
+        data['unit_list'] = list()
+        upload_profile(data)
+        self.assertEqual(set(Monster.objects.values_list('id', flat=True)), {101, 102, 103})
+        self.assertEqual(Rune.objects.count(), 3)
+
+        with override_settings(PROFILE_RECONCILE=False):
+            upload_profile(make_profile(PROFILE['tvalue'] + 120))
+        self.assertEqual(Monster.objects.count(), 3)
+
+
+# chunks are committed in their own transactions, so the test can't run inside of a transaction
+@override_settings(PROFILE_CHUNKED=True)
+@mock.patch('website.metrics.KEY', 'swstats:tests:metrics')
+class ProfileIngestTestCase(TransactionTestCase):
+    """Items of interrupted chunked ingest are hidden until the profile is saved again, chunked or at once."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+
+    def tearDown(self):
+        metrics._redis().delete('swstats:tests:metrics')
+
+    def interrupt_ingest(self, tvalue):
+        # inventory rune is committed in the first chunk, saving of monster breaks the second one
+        data = make_profile(tvalue)
+        with mock.patch('website.functions.parse_monsters_bulk', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                parse_profile_chunked(data, data, 'swstats:tests:missing', 1)
+        self.assertEqual(ProfileIngest.objects.get(wizard_id=9001).chunks, 1)
+        self.assertTrue(Rune.objects.filter(id=1003).exists())
+        self.assertFalse(exclude_ingesting(Rune.objects.all()).exists())
+
+    def test_small_upload(self):
+        self.interrupt_ingest(PROFILE['tvalue'])
+        upload_profile(make_profile(PROFILE['tvalue'] + 60))
+        self.assertFalse(ProfileIngest.objects.exists())
+        self.assertEqual(set(exclude_ingesting(Rune.objects.all()).values_list('id', flat=True)), {1001, 1002, 1003})
+        self.assertEqual(list(exclude_ingesting(Monster.objects.all()).values_list('id', flat=True)), [101])
+
+    def test_older_upload(self):
+        # newer ingest isn't finished by older profile, but it has to start over
+        self.interrupt_ingest(PROFILE['tvalue'] + 60)
+        upload_profile(make_profile())
+        self.assertEqual(ProfileIngest.objects.get(wizard_id=9001).chunks, 0)
+        self.assertFalse(exclude_ingesting(Rune.objects.all()).exists())
+
+    def test_expired_payload(self):
+        self.interrupt_ingest(PROFILE['tvalue'])
+        ProfileIngest.objects.update(updated=datetime.datetime.now() - datetime.timedelta(hours=1))
+        with mock.patch('website.routing.send_ingest') as send_ingest:
+            resume_profile_ingests_task()
+        send_ingest.assert_not_called()
+        self.assertFalse(ProfileIngest.objects.exists())
+        self.assertEqual(list(exclude_ingesting(Rune.objects.all()).values_list('id', flat=True)), [1003])
+        self.assertEqual(metrics.get_counters(), {'profile.abandoned': 1})
+
+    def test_flag_off(self):
+        self.interrupt_ingest(PROFILE['tvalue'])
+        runes = Rune.objects.all()
+        with override_settings(PROFILE_CHUNKED=False):
+            self.assertIs(exclude_ingesting(runes), runes)
+
+
+class SketchesTestCase(SimpleTestCase):
+    """Stats read from merged buckets are within RELATIVE_ACCURACY of exact ones, average & std are exact."""
+    values = {
+        'speed': [90, 101, 101, 104, 118, 133, 250],
+        'crit_rate': [0, 15, 47, 100],
+        'eff_hp': [34815.5, 51230.25, 12000.75],
+    }
+
+    def assertWithinAccuracy(self, value, exact):
+        self.assertLessEqual(abs(value - exact), sketches.RELATIVE_ACCURACY * abs(exact) + 1e-9)
+
+    def test_buckets(self):
+        for value in [0.5, 1, 15, 101, 10500, 34815.5]:
+            self.assertWithinAccuracy(sketches.get_bucket_value(sketches.get_bucket(value)), value)
+        self.assertEqual(sketches.get_bucket(0), sketches.ZERO_BUCKET)
+        self.assertEqual(sketches.get_bucket(-5), sketches.ZERO_BUCKET)
+        self.assertEqual(sketches.get_bucket_value(sketches.ZERO_BUCKET), 0)
+
+    def test_summarize(self):
+        # two "base monsters" with buckets merged by adding them up, like MonsterStatBucket rows of a query
+        rows = list()
+        for half in [slice(None, None, 2), slice(1, None, 2)]:
+            deltas = dict()
+            for stat, values in self.values.items():
+                for value in values[half]:
+                    delta = deltas.setdefault((stat, sketches.get_bucket(value)), [0, 0, 0])
+                    delta[0] += 1
+                    delta[1] += value
+                    delta[2] += value * value
+            rows += [key + tuple(delta) for key, delta in deltas.items()]
+        rows.append(('speed', sketches.get_bucket(300), 0, 0, 0))  # emptied bucket
+
+        summary = sketches.summarize(rows)
+        self.assertEqual(set(summary.keys()), set(self.values.keys()))
+        for stat, values in self.values.items():
+            self.assertEqual(set(summary[stat].keys()), set(sketches.SUMMARY))
+            self.assertAlmostEqual(summary[stat]['avg'], np.mean(values))
+            self.assertAlmostEqual(summary[stat]['stddev'], np.std(values))
+            self.assertWithinAccuracy(summary[stat]['min'], min(values))
+            self.assertWithinAccuracy(summary[stat]['max'], max(values))
+            for name, fraction in [('perc25', 25), ('median', 50), ('perc75', 75)]:
+                self.assertWithinAccuracy(summary[stat][name], np.percentile(values, fraction))
+
+
+# stat buckets are updated on commit, so the test can't run inside of a transaction
+@override_settings(ROLLUPS=True)
+@mock.patch('website.rollups.KEY_PREFIX', 'swstats:tests:rollups:')
+class SketchDeltasTestCase(TransactionTestCase):
+    """Stat buckets updated by deltas of uploads are the same as rebuilt ones."""
+    fixtures = ['base_data.json']
+
+    def setUp(self):
+        references.refresh()
+
+    def tearDown(self):
+        redis = metrics._redis()
+        for key in redis.keys('swstats:tests:rollups:*'):
+            redis.delete(key)
+
+    def buckets(self):
+        return sorted(MonsterStatBucket.objects.filter(count__gt=0).values_list(
+            'base_monster_id', 'stars', 'stat', 'bucket', 'count', 'total', 'total_sq'))
+
+    def test_deltas(self):
+        upload_profile(make_profile())
+        data = make_profile(PROFILE['tvalue'] + 60)
+        data['unit_list'][0]['spd'] = 120
+        data['unit_list'].append(dict(copy.deepcopy(PROFILE['unit_list'][0]), unit_id=102, runes=list(), artifacts=list()))
+        upload_profile(data)
+        speeds = [row for row in self.buckets() if row[2] == 'speed']
+        self.assertEqual(sum(row[4] for row in speeds), 2)
+
+        updated = self.buckets()
+        self.assertEqual(sketches.rebuild_sketches(), len(updated))
+        self.assertEqual(self.buckets(), updated)
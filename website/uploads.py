@@ -0,0 +1,161 @@
+from django.conf import settings
+
+from .tasks import *
+from . import spool, coalesce, routing, metrics, payloads, dedup
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def slim(response_keys=None, request_keys=None, keys=None):
+    """Payload-slimming function, keeps only top-level keys read by command handler.
+
+    Request `wizard_id` & `battle_key` are always kept (sharding, deduplication).
+    """
+    request_keys = set(request_keys or list()) | {'wizard_id', 'battle_key'}
+
+    def _slim(data):
+        if keys is not None:
+            return {key: value for key, value in data.items() if key in keys or key == 'command'}
+        data = dict(data)
+        if response_keys is not None:
+            data['response'] = {key: value for key, value in data['response'].items()
+                                if key in response_keys}
+        data['request'] = {key: value for key, value in data['request'].items()
+                           if key in request_keys}
+        return data
+    return _slim
+
+
+def battle_args(data):
+    return data['response'], data['request']
+
+
+def payload_args(data):
+    return payloads.store_payload(data),
+
+
+def data_args(data):
+    return data,
+
+
+def friend_args(data):
+    return payloads.store_payload(data), routing.get_upload_wizard_id(data)
+
+
+def is_known_wizard(data, wizard_id):
+    # friend data is incomplete, it's never used to overwrite existing wizards
+    return wizard_id is not None and Wizard.objects.filter(id=wizard_id).exists()
+
+
+def battle_dedup_key(data):
+    return get_battle_key(data['command'], data['response'], data['request'])
+
+
+def upload_command(handler, queue, priority, args=battle_args, slim=None, spool=False, sharded=True, coalesce=False, dedup=None, skip=None):
+    """Registry entry of SWEX command.
+
+    queue       - Celery queue used when UPLOAD_COMMAND_QUEUES is enabled (sharded commands use ingest.<n> when INGEST_SHARDS is set)
+    priority    - Celery (Redis transport) priority, 0 is the highest
+    args        - function which makes handler arguments from upload
+    slim        - function which strips upload from data not needed by handler, before it's queued/spooled
+    spool       - battle result which can be saved in micro-batches (UPLOAD_SPOOL) instead of a task per upload
+    sharded     - wizard-scoped, routed by wizard ID (see routing)
+    coalesce    - profile upload which can be coalesced with pending ones of the same wizard (PROFILE_COALESCING)
+    dedup       - function returning key of upload, retransmits with already seen key are dropped (BATTLE_DEDUP)
+    skip        - function (upload, wizard ID) telling if upload can be dropped before it's stored or queued
+    """
+    return {
+        'handler': handler,
+        'queue': queue,
+        'priority': priority,
+        'args': args,
+        'slim': slim,
+        'spool': spool,
+        'sharded': sharded,
+        'coalesce': coalesce,
+        'dedup': dedup,
+        'skip': skip,
+    }
+
+
+# command: registry entry, every command not listed here is ignored
+UPLOAD_COMMANDS = {
+    'HubUserLogin': upload_command(handle_profile_upload_task, 'uploads.profile', 0, args=payload_args, coalesce=True),
+    'VisitFriend': upload_command(handle_friend_upload_task, 'uploads.profile', 3, args=friend_args, skip=is_known_wizard),
+    'BattleDungeonResult': upload_command(handle_dungeon_run_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        ['wizard_info', 'tvalue', 'win_lose', 'clear_time'], ['dungeon_id', 'stage_id', 'unit_id_list'])),
+    'BattleDimensionHoleDungeonResult': upload_command(handle_dimension_hole_run_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        ['wizard_info', 'tvalue', 'dungeon_id', 'difficulty', 'practice_mode', 'win_lose', 'clear_time'], ['unit_id_list'])),
+    'BattleRiftDungeonStart': upload_command(handle_rift_dungeon_start_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        ['wizard_info', 'tvalue', 'battle_key'], ['dungeon_id', 'unit_id_list', 'leader_index'])),
+    'BattleRiftDungeonResult': upload_command(handle_rift_dungeon_run_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        ['rift_dungeon_box_id'], ['battle_result', 'round_list'])),
+    'BattleRiftOfWorldsRaidStart': upload_command(handle_raid_start_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        ['wizard_info', 'tvalue', 'battle_info'], list())),
+    'BattleRiftOfWorldsRaidResult': upload_command(handle_raid_run_upload_task, 'uploads.battles', 6, spool=True, dedup=battle_dedup_key, slim=slim(
+        list(), ['win_lose', 'clear_time'])),
+    'GetGuildSiegeDefenseDeckByWizardId': upload_command(handle_siege_defenses_upload_task, 'uploads.siege', 3, args=data_args, sharded=False, slim=slim(
+        keys=['defense_deck_list', 'defense_unit_list', 'tvalue', 'wizard_info_list'])),
+    'GetGuildSiegeRankingInfo': upload_command(handle_siege_ranking_upload_task, 'uploads.siege', 9, args=data_args, sharded=False, slim=slim(
+        keys=['guildsiege_stat_info'])),
+    'GetLobbyWizardLog': upload_command(handle_wizard_arena_upload_task, 'uploads.arena', 9, slim=slim(
+        ['tvalue', 'lobby_wizard_log'], ['target_wizard_id'])),
+}
+UPLOAD_COMMANDS['BattleDungeonResult_V2'] = UPLOAD_COMMANDS['BattleDungeonResult']
+UPLOAD_COMMANDS['BattleDimensionHoleDungeonResult_v2'] = UPLOAD_COMMANDS['BattleDimensionHoleDungeonResult']
+
+
+def send(command, task, wizard_id, *args):
+    queue = command['queue'] if settings.UPLOAD_COMMAND_QUEUES else None
+    if command['sharded']:
+        return routing.send_ingest(task, wizard_id, *args, queue=queue, priority=command['priority'])
+    return task.apply_async(args, queue=queue, priority=command['priority'])
+
+
+def dispatch(data):
+    """Sends SWEX upload to its handler according to UPLOAD_COMMANDS, returns False if command is unknown."""
+    command = UPLOAD_COMMANDS.get(data['command'])
+    if command is None:
+        metrics.incr_counter('upload.ignored')
+        return False
+    metrics.incr_counter(f"upload.{data['command']}")
+
+    if command['slim']:
+        data = command['slim'](data)
+    wizard_id = routing.get_upload_wizard_id(data)
+
+    if command['skip'] and command['skip'](data, wizard_id):
+        metrics.incr_counter(f"upload.{data['command']}.skipped")
+        return True
+
+    key = None
+    if command['dedup'] and settings.BATTLE_DEDUP:
+        key = command['dedup'](data)
+        if key is not None and dedup.is_duplicate(key):
+            return True
+
+    try:
+        submit(command, data, wizard_id)
+    except Exception:
+        dedup.release(key)
+        raise
+    return True
+
+
+def submit(command, data, wizard_id):
+    """Spools or queues accepted upload."""
+    if command['spool'] and settings.UPLOAD_SPOOL in ['redis', 'file']:
+        spool.spool_battle(data['command'], data['response'], data['request'])
+        return
+
+    args = command['args'](data)
+    if command['coalesce'] and settings.PROFILE_COALESCING and wizard_id is not None and 'tvalue' in data:
+        token = coalesce.submit(wizard_id, data['tvalue'], args[0])
+        if token is not None:
+            send(command, ingest_profile_task,
+                 wizard_id, wizard_id, args[0], token)
+        return
+
+    send(command, command['handler'], wizard_id, *args)
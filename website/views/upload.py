@@ -1,11 +1,14 @@
 from django.http import HttpResponse
 from rest_framework import viewsets, status
+from rest_framework.parsers import FormParser, MultiPartParser
 
 import logging
 
 from website.models import *
 from website.serializers import CommandSerializer
 from website.tasks import *
+from website import references, uploads
+from website.parsers import CompressedJSONParser
 
 import copy
 import math
@@ -39,6 +42,7 @@ class MonsterSourceUploadViewSet(viewsets.ViewSet):
             for source in request.data:
                 obj, created = MonsterSource.objects.update_or_create(
                     id=source['id'], defaults=source, )
+            references.invalidate()
             return HttpResponse(status=status.HTTP_201_CREATED)
 
         return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
@@ -67,6 +71,7 @@ class MonsterBaseUploadViewSet(viewsets.ViewSet):
 
                 obj, created = MonsterBase.objects.update_or_create(
                     id=base['id'], defaults=monster_base, )
+            references.invalidate()
             return HttpResponse(status=status.HTTP_201_CREATED)
 
         return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
@@ -123,6 +128,7 @@ class BuildingUploadViewSet(viewsets.ViewSet):
             for building in request.data:
                 obj, created = Building.objects.update_or_create(
                     id=building['id'], defaults=building, )
+            references.invalidate()
             return HttpResponse(status=status.HTTP_201_CREATED)
 
         return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
@@ -155,6 +161,7 @@ class HomunculusBuildUploadViewSet(viewsets.ViewSet):
                     data[key] = HomunculusSkill.objects.get(id=val)
                 obj, created = HomunculusBuild.objects.update_or_create(
                     depth_1=data['depth_1'], depth_2=data['depth_2'], depth_3=data['depth_3'], depth_4=data['depth_4'], depth_5=data['depth_5'], defaults=data, )
+            references.invalidate()
             return HttpResponse(status=status.HTTP_201_CREATED)
 
         return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
@@ -162,47 +169,11 @@ class HomunculusBuildUploadViewSet(viewsets.ViewSet):
 
 class UploadViewSet(viewsets.ViewSet):
     swagger_schema = None
+    parser_classes = [CompressedJSONParser, FormParser, MultiPartParser]
 
     def create(self, request):
         if request.data:
-            if request.data['command'] == 'HubUserLogin':
-                handle_profile_upload_task.delay(request.data)
-
-            elif request.data['command'] == 'VisitFriend':
-                handle_friend_upload_task.delay(request.data)
-
-            elif request.data['command'] == 'BattleRiftOfWorldsRaidStart':  # R5
-                handle_raid_start_upload_task.delay(
-                    request.data['response'], request.data['request'])
-            elif request.data['command'] == 'BattleRiftOfWorldsRaidResult':  # R5
-                handle_raid_run_upload_task.delay(
-                    request.data['response'], request.data['request'])
-
-            elif request.data['command'] == 'BattleDungeonResult' or request.data['command'] == 'BattleDungeonResult_V2':
-                handle_dungeon_run_upload_task.delay(
-                    request.data['response'], request.data['request'])
-
-            elif request.data['command'] == 'BattleRiftDungeonStart':  # Elemental Rift
-                handle_rift_dungeon_start_upload_task.delay(
-                    request.data['response'], request.data['request'])
-            elif request.data['command'] == 'BattleRiftDungeonResult':  # Elemental Rift
-                handle_rift_dungeon_run_upload_task.delay(
-                    request.data['response'], request.data['request'])
-
-            elif request.data['command'] == 'GetGuildSiegeDefenseDeckByWizardId':
-                handle_siege_defenses_upload_task.delay(request.data)
-
-            elif request.data['command'] == 'GetGuildSiegeRankingInfo':
-                handle_siege_ranking_upload_task.delay(request.data)
-
-            elif request.data['command'] == 'BattleDimensionHoleDungeonResult' or request.data['command'] == 'BattleDimensionHoleDungeonResult_v2':
-                handle_dimension_hole_run_upload_task.delay(
-                    request.data['response'], request.data['request'])
-
-            elif request.data['command'] == 'GetLobbyWizardLog':
-                handle_wizard_arena_upload_task.delay(
-                    request.data['response'], request.data['request'])
-
+            uploads.dispatch(request.data)
             return HttpResponse(status=status.HTTP_201_CREATED)
 
         logger.error("Given request is invalid")